@@ -1,11 +1,37 @@
 """A user account for a bank."""
 
+import hmac
+import struct
+
 from exceptions import AccountError
+from money import CENTS_PER_EURO, to_euros
+from pins import (DIGEST_SIZE, ITERATIONS, SALT_SIZE, PinHash, hash_pin,
+                  pin_bytes, same_hash, verify_pin)
+
+# Version, IBAN, balance in cents, admin status, PIN hash iterations, salt,
+# digest and the length of the UTF-8 name, followed by the name itself.
+# Version 2 held the PIN itself in place of its hash, and version 1 also
+# held the balance as a float number of euros.
+_LAYOUT = struct.Struct(f"<BIqBI{SALT_SIZE}s{DIGEST_SIZE}sH")
+_LAYOUT_V2 = struct.Struct("<BIiqBH")
+_LAYOUT_V1 = struct.Struct("<BIidBH")
+_VERSION = 3
+
 
 class Account:
-    """An account for a bank containing the user details."""
+    """An account for a bank containing the user details.
+
+    The balance is held as an integer number of cents. Amounts passed to
+    `deposit()` and `withdraw()` must already be in cents.
 
-    def __init__(self, iban: int, name: str, pin: int, admin: bool = False):
+    The PIN is held as a salted PinHash. Accounts stored before PINs were
+    hashed hold the PIN itself until it is hashed with `rehash_pin()`.
+    """
+
+    __slots__ = ("_iban", "_name", "_pin", "_admin", "_balance")
+
+    def __init__(self, iban: int, name: str, pin: int, admin: bool = False,
+                 iterations: int = ITERATIONS):
         """Create a new account.
 
         Args:
@@ -13,18 +39,132 @@ class Account:
             name (str): The user's name.
             pin (int): The user's PIN to authenticate at an ATM.
             admin (bool, optional): User's admin status. Defaults to False.
+            iterations (int, optional): The cost of the PIN hash. Defaults
+                to `pins.ITERATIONS`.
         """
         self._iban = iban
         self._name = name
-        self._pin = pin
+        self._pin = hash_pin(pin, iterations)
         self._admin = admin
         self._balance = 0
 
+    @classmethod
+    def from_record(cls, record: tuple) -> "Account":
+        """Rebuild an account from the tuple returned by `to_record()`.
+
+        Args:
+            record (tuple): The IBAN, name, PIN hash in its text form (or a
+                PIN not yet hashed), admin status and balance in cents.
+
+        Raises:
+            ValueError: If the PIN field is text but not a PIN hash.
+
+        Returns:
+            Account: The rebuilt account.
+        """
+        iban, name, pin, admin, balance = record
+        account = cls.__new__(cls)
+        account._iban = iban
+        account._name = name
+        account._pin = PinHash.parse(pin) if isinstance(pin, str) else pin
+        account._admin = admin
+        account._balance = balance
+        return account
+
+    def to_record(self) -> tuple:
+        """Get every field of the account for a storage backend to save.
+
+        Returns:
+            tuple: The IBAN, name, PIN hash in its text form (or the PIN if
+                it isn't hashed yet), admin status and balance in cents.
+        """
+        pin = str(self._pin) if isinstance(self._pin, PinHash) else self._pin
+        return (self._iban, self._name, pin, self._admin, self._balance)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Account":
+        """Decode an account encoded by `to_bytes()`.
+
+        Args:
+            data (bytes): The encoded account.
+
+        Raises:
+            ValueError: If the data isn't an encoded account.
+
+        Returns:
+            Account: The decoded account.
+        """
+        version = data[:1]
+        if version == b"\x01":
+            layout = _LAYOUT_V1
+        elif version == b"\x02":
+            layout = _LAYOUT_V2
+        else:
+            layout = _LAYOUT
+        try:
+            fields = layout.unpack_from(data)
+        except struct.error as error:
+            raise ValueError("Not an encoded account") from error
+        name_length = fields[-1]
+        if fields[0] not in (1, 2, _VERSION) or \
+                len(data) != layout.size + name_length:
+            raise ValueError("Not an encoded account")
+        account = cls.__new__(cls)
+        if fields[0] == _VERSION:
+            _, iban, balance, admin, iterations, salt, digest, _ = fields
+            account._pin = PinHash(iterations, salt, digest)
+        else:
+            _, iban, account._pin, balance, admin, _ = fields
+            if fields[0] == 1:
+                balance = round(balance * CENTS_PER_EURO)
+        account._iban = iban
+        account._name = data[layout.size:].decode("utf-8")
+        account._admin = bool(admin)
+        account._balance = balance
+        return account
+
+    def to_bytes(self) -> bytes:
+        """Encode the account as a compact, fixed layout record.
+
+        Raises:
+            ValueError: If a field can't be represented in the layout, such
+                as a name that isn't a string or a PIN that isn't hashed.
+
+        Returns:
+            bytes: The encoded account.
+        """
+        if not isinstance(self._name, str) or \
+                not isinstance(self._pin, PinHash) or \
+                len(self._pin.salt) != SALT_SIZE or \
+                len(self._pin.digest) != DIGEST_SIZE:
+            raise ValueError("Account can't be encoded")
+        name = self._name.encode("utf-8")
+        try:
+            return _LAYOUT.pack(_VERSION, self._iban, self._balance,
+                                self._admin, *self._pin, len(name)) + name
+        except struct.error as error:
+            raise ValueError("Account can't be encoded") from error
+
+    def __setstate__(self, state):
+        """Restore an unpickled account, including ones pickled before the
+        class used __slots__, whose balances were in euros.
+
+        Args:
+            state: A dict of attributes, or a (dict, slots) pair.
+        """
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        else:
+            state = dict(state)
+            state["_balance"] = round(state["_balance"] * CENTS_PER_EURO)
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
+
     def __str__(self) -> str:
         """Return a string representation of the account."""
         string = f"""IBAN: {self._iban}\
                    \nName: {self._name}\
-                   \nBalance: {self._balance}\n"""
+                   \nBalance: {to_euros(self._balance):.2f}\n"""
         if self._admin:
             string += "---Admin Account---\n"
         return string
@@ -45,8 +185,9 @@ class Account:
             raise TypeError("Must compare with another account.")
         outcome = False
         if self._iban == other.iban and self._name == other.name\
-           and self._admin == other.admin and self._balance == other.balance\
-           and other.check_pin(self._pin):
+           and self._admin == other.admin\
+           and self._balance == other.balance_cents\
+           and _same_pin(self._pin, other._pin):
             outcome = True
         return outcome
 
@@ -66,66 +207,109 @@ class Account:
         return self._admin
 
     @property
-    def balance(self):
-        """Get the user's account balance."""
+    def balance(self) -> float:
+        """Get the user's account balance in euros."""
+        return to_euros(self._balance)
+
+    @property
+    def balance_cents(self) -> int:
+        """Get the user's account balance in cents."""
         return self._balance
 
-    def deposit(self, amount: float):
+    def deposit(self, amount: int):
         """Deposit the given amount into the account.
 
         Args:
-            amount (float): The amount to deposit
+            amount (int): The amount to deposit, in cents.
 
         Raises:
-            TypeError: If the amount is not a float or an int.
+            TypeError: If the amount is not an int.
         """
-        if not isinstance(amount, (int, float)):
-            raise TypeError("Must be of type int or float")
+        if not isinstance(amount, int):
+            raise TypeError("Must be an int number of cents")
         self._balance += amount
 
-    def withdraw(self, amount: float):
+    def withdraw(self, amount: int):
         """Withdraw the given amount from the account.
 
         Args:
-            amount (float): The amount to withdraw.
+            amount (int): The amount to withdraw, in cents.
 
         Raises:
-            TypeError: If the amount is not a float or an int.
+            TypeError: If the amount is not an int.
             AccountError: If the account does not have sufficient balance.
         """
-        if not isinstance(amount, (int, float)):
-            raise TypeError("Must be of type int or float")
+        if not isinstance(amount, int):
+            raise TypeError("Must be an int number of cents")
         if amount > self._balance:
             raise AccountError("Insufficient funds")
         self._balance -= amount
 
+    @property
+    def pin_hash(self) -> PinHash:
+        """Get the hash of the user's PIN, or None if it isn't hashed yet."""
+        return self._pin if isinstance(self._pin, PinHash) else None
+
     def check_pin(self, pin: int) -> bool:
         """Check whether the given PIN matches the one on the account.
 
+        The PIN is hashed with the account's salt and cost, and the digests
+        are compared in constant time.
+
         Args:
             pin (int): The PIN to check.
 
         Returns:
             bool: True if the PINs are the same, otherwise False.
         """
-        pin_equal = False
-        try:
-            pin = int(pin)
-        except ValueError:
-            return False
-        if pin == self._pin:
-            pin_equal = True
-        return pin_equal
-
-    def update_pin(self, new_pin: int):
+        if isinstance(self._pin, PinHash):
+            return verify_pin(pin, self._pin)
+        return hmac.compare_digest(pin_bytes(pin), pin_bytes(self._pin))
+
+    def needs_rehash(self, iterations: int) -> bool:
+        """Return whether the PIN should be hashed again at a new cost.
+
+        Args:
+            iterations (int): The cost the PIN should be hashed with.
+
+        Returns:
+            bool: True if the PIN isn't hashed, or is hashed at another cost.
+        """
+        return not isinstance(self._pin, PinHash) or \
+            self._pin.iterations != iterations
+
+    def rehash_pin(self, pin: int, iterations: int = ITERATIONS):
+        """Hash the account's PIN with a new salt and cost.
+
+        The caller must have checked the PIN first.
+
+        Args:
+            pin (int): The account's PIN.
+            iterations (int, optional): The cost of the hash. Defaults to
+                `pins.ITERATIONS`.
+        """
+        self._pin = hash_pin(pin, iterations)
+
+    def update_pin(self, new_pin: int, iterations: int = ITERATIONS):
         """Update the user's PIN.
 
         Args:
             new_pin (int): The new PIN.
+            iterations (int, optional): The cost of the hash. Defaults to
+                `pins.ITERATIONS`.
 
         Raises:
             ValueError: If the PIN is not exactly 4 digits long.
         """
         if len(str(new_pin)) != 4:
             raise ValueError("Pin length must be 4.")
-        self._pin = int(new_pin)
+        self._pin = hash_pin(new_pin, iterations)
+
+
+def _same_pin(first, second) -> bool:
+    """Compare two stored PINs, hashed or not, in constant time."""
+    if isinstance(first, PinHash) and isinstance(second, PinHash):
+        return same_hash(first, second)
+    if isinstance(first, PinHash) or isinstance(second, PinHash):
+        return False
+    return hmac.compare_digest(pin_bytes(first), pin_bytes(second))
@@ -0,0 +1,88 @@
+"""Allocation of unused IBANs for a bank."""
+
+import threading
+from random import randrange
+
+from exceptions import BankError
+
+FIRST_IBAN = 10000000
+LAST_IBAN = 99999999
+
+
+class IbanAllocator:
+    """Hands out random, unused 8-digit IBANs without probing storage.
+
+    The IBANs already in use are read once, on the first allocation, and
+    tracked in memory from then on. The allocator assumes its bank is the
+    only one creating accounts in the database. It is safe to use from
+    several threads.
+    """
+
+    def __init__(self, load_used):
+        """Create a new allocator.
+
+        Args:
+            load_used (callable): Returns an iterable of the IBANs in use.
+                Called once, on the first allocation.
+        """
+        self._load_used = load_used
+        self._used = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, iban: int) -> bool:
+        """Return whether the IBAN has been allocated or was already in use."""
+        with self._lock:
+            return int(iban) in self._get_used()
+
+    def allocate(self) -> int:
+        """Reserve and return a new IBAN.
+
+        Raises:
+            BankError: If every IBAN is in use.
+
+        Returns:
+            int: The new IBAN.
+        """
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> list:
+        """Reserve and return several new IBANs in one pass.
+
+        Args:
+            count (int): The number of IBANs to allocate.
+
+        Raises:
+            BankError: If there aren't enough unused IBANs left.
+
+        Returns:
+            list: The new IBANs.
+        """
+        with self._lock:
+            used = self._get_used()
+            if len(used) + count > LAST_IBAN - FIRST_IBAN + 1:
+                raise BankError("No IBANs left to allocate")
+            ibans = []
+            while len(ibans) < count:
+                iban = randrange(FIRST_IBAN, LAST_IBAN + 1)
+                if iban not in used:
+                    used.add(iban)
+                    ibans.append(iban)
+        return ibans
+
+    def reserve(self, iban: int):
+        """Mark an IBAN as in use, such as one given in an import.
+
+        Args:
+            iban (int): The IBAN to mark as used.
+        """
+        with self._lock:
+            self._get_used().add(int(iban))
+
+    def _get_used(self) -> set:
+        """Get the set of IBANs in use, loading it on first use.
+
+        Must be called with the lock held.
+        """
+        if self._used is None:
+            self._used = {int(iban) for iban in self._load_used()}
+        return self._used
@@ -0,0 +1,207 @@
+"""Coroutine versions of the Bank and ATM for use with asyncio.
+
+The storage work behind each call blocks, so it is run in a thread pool
+executor and the event loop stays free to serve other terminals. The
+wrapped Bank and ATM are thread-safe, so many calls can be in flight at once.
+"""
+
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+
+from account import Account
+from atm import ATM
+from bank import Bank
+from sessions import Session
+
+
+class _AsyncWrapper:
+    """Runs the methods of a blocking object in an executor."""
+
+    def __init__(self, executor: Executor = None, max_workers: int = 8):
+        """Create a new wrapper.
+
+        Args:
+            executor (Executor, optional): The executor to run calls in.
+                Defaults to a new thread pool owned by this wrapper.
+            max_workers (int, optional): The size of the thread pool made
+                when no executor is given. Defaults to 8.
+        """
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._executor = executor
+
+    async def __aenter__(self):
+        """Use the wrapper in an `async with` block."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Shut down the executor at the end of an `async with` block."""
+        self.close()
+
+    def close(self):
+        """Shut down the thread pool if it was made by this wrapper."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+
+    async def _run(self, function, *args):
+        """Run a blocking function in the executor and wait for it."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          partial(function, *args))
+
+
+class AsyncBank(_AsyncWrapper):
+    """A Bank whose account operations are coroutines."""
+
+    def __init__(self, bank: Bank, executor: Executor = None,
+                 max_workers: int = 8):
+        """Wrap a bank.
+
+        Args:
+            bank (Bank): The bank to wrap.
+            executor (Executor, optional): See `_AsyncWrapper`.
+            max_workers (int, optional): See `_AsyncWrapper`.
+        """
+        super().__init__(executor, max_workers)
+        self._bank = bank
+
+    @property
+    def bank(self) -> Bank:
+        """Get the wrapped bank."""
+        return self._bank
+
+    @property
+    def name(self):
+        """Get the name of the Bank."""
+        return self._bank.name
+
+    async def login(self, iban: int, pin: int) -> Account:
+        """Coroutine version of `Bank.login`."""
+        return await self._run(self._bank.login, iban, pin)
+
+    async def start_session(self, iban: int, pin: int) -> Session:
+        """Coroutine version of `Bank.start_session`."""
+        return await self._run(self._bank.start_session, iban, pin)
+
+    async def end_session(self, session: Session):
+        """Coroutine version of `Bank.end_session`."""
+        return await self._run(self._bank.end_session, session)
+
+    async def get_account(self, iban: int) -> Account:
+        """Coroutine version of `Bank.get_account`."""
+        return await self._run(self._bank.get_account, iban)
+
+    async def valid_user(self, user: Account) -> bool:
+        """Coroutine version of `Bank.valid_user`."""
+        return await self._run(self._bank.valid_user, user)
+
+    async def check_balance(self, user: Account) -> float:
+        """Coroutine version of `Bank.check_balance`."""
+        return await self._run(self._bank.check_balance, user)
+
+    async def check_admin(self, user: Account) -> bool:
+        """Coroutine version of `Bank.check_admin`."""
+        return await self._run(self._bank.check_admin, user)
+
+    async def withdraw(self, user: Account, amount: float):
+        """Coroutine version of `Bank.withdraw`."""
+        return await self._run(self._bank.withdraw, user, amount)
+
+    async def deposit(self, user: Account, amount: float):
+        """Coroutine version of `Bank.deposit`."""
+        return await self._run(self._bank.deposit, user, amount)
+
+    async def transfer(self, iban: int, amount: float):
+        """Coroutine version of `Bank.transfer`."""
+        return await self._run(self._bank.transfer, iban, amount)
+
+    async def get_statement(self, iban: int, since: float = None,
+                            limit: int = 10) -> list:
+        """Coroutine version of `Bank.get_statement`."""
+        return await self._run(self._bank.get_statement, iban, since, limit)
+
+    async def reset_pin(self, user: Account, new_pin: int):
+        """Coroutine version of `Bank.reset_pin`."""
+        return await self._run(self._bank.reset_pin, user, new_pin)
+
+
+class AsyncATM(_AsyncWrapper):
+    """An ATM whose user and admin operations are coroutines."""
+
+    def __init__(self, atm: ATM, executor: Executor = None,
+                 max_workers: int = 8):
+        """Wrap an ATM.
+
+        Args:
+            atm (ATM): The ATM to wrap.
+            executor (Executor, optional): See `_AsyncWrapper`.
+            max_workers (int, optional): See `_AsyncWrapper`.
+        """
+        super().__init__(executor, max_workers)
+        self._atm = atm
+
+    @property
+    def atm(self) -> ATM:
+        """Get the wrapped ATM."""
+        return self._atm
+
+    async def login(self, iban: int, pin: int) -> Session:
+        """Coroutine version of `ATM.login`."""
+        return await self._run(self._atm.login, iban, pin)
+
+    async def logout(self, session: Session):
+        """Coroutine version of `ATM.logout`."""
+        return await self._run(self._atm.logout, session)
+
+    async def user_check_balance(self, account: Account) -> float:
+        """Coroutine version of `ATM.user_check_balance`."""
+        return await self._run(self._atm.user_check_balance, account)
+
+    async def user_withdraw(self, account: Account, amount: float):
+        """Coroutine version of `ATM.user_withdraw`."""
+        return await self._run(self._atm.user_withdraw, account, amount)
+
+    async def user_deposit(self, account: Account, amount: float):
+        """Coroutine version of `ATM.user_deposit`."""
+        return await self._run(self._atm.user_deposit, account, amount)
+
+    async def user_transfer(self, account: Account, amount: float,
+                            transfer_bank: str, transfer_iban: int):
+        """Coroutine version of `ATM.user_transfer`."""
+        return await self._run(self._atm.user_transfer, account, amount,
+                               transfer_bank, transfer_iban)
+
+    async def user_statement(self, account: Account, since: float = None,
+                             limit: int = 10) -> list:
+        """Coroutine version of `ATM.user_statement`."""
+        return await self._run(self._atm.user_statement, account, since,
+                               limit)
+
+    async def user_reset_pin(self, account: Account, new_pin: int):
+        """Coroutine version of `ATM.user_reset_pin`."""
+        return await self._run(self._atm.user_reset_pin, account, new_pin)
+
+    async def admin_withdraw(self, account: Account, amount: float):
+        """Coroutine version of `ATM.admin_withdraw`."""
+        return await self._run(self._atm.admin_withdraw, account, amount)
+
+    async def admin_deposit(self, account: Account, amount: float,
+                            notes: dict = None):
+        """Coroutine version of `ATM.admin_deposit`."""
+        return await self._run(self._atm.admin_deposit, account, amount,
+                               notes)
+
+    async def check_balance(self, account: Account) -> float:
+        """Coroutine version of `ATM.check_balance`."""
+        return await self._run(self._atm.check_balance, account)
+
+    async def cash_inventory(self, account: Account) -> dict:
+        """Coroutine version of `ATM.cash_inventory`."""
+        return await self._run(self._atm.cash_inventory, account)
+
+    async def cash_forecast(self, account: Account,
+                            horizon: float = None) -> dict:
+        """Coroutine version of `ATM.cash_forecast`."""
+        return await self._run(self._atm.cash_forecast, account, horizon)
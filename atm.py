@@ -2,28 +2,65 @@
 
 from bank import Bank
 from account import Account
-from exceptions import AtmError, AccountError
+from cassette import Cassette
+from exceptions import AtmError, AccountError, BankError
+from metrics import Metrics
+from money import parse_amount, to_cents, to_euros
+from server import RemoteBank
+from sessions import Session
+
+# What the user_* and admin_* operations accept as the logged in user.
+_USERS = (Account, Session)
+
+# What an ATM accepts as a bank, in this process or served over a socket.
+_BANKS = (Bank, RemoteBank)
+
+# The public methods timed when an ATM is given a Metrics object.
+INSTRUMENTED_METHODS = ("login", "logout", "user_check_balance",
+                        "user_withdraw", "user_deposit", "user_transfer",
+                        "user_statement", "user_reset_pin", "admin_withdraw",
+                        "admin_deposit", "check_balance", "cash_inventory",
+                        "cash_forecast")
 
 
 class ATM:
-    """An Automated Teller Machine for user transactions with a bank."""
+    """An Automated Teller Machine for user transactions with a bank.
+
+    An ATM can serve several sessions from different threads. Its cash is
+    held in a Cassette, counted by denomination, which makes its own changes
+    thread safe. Amounts are given in euros and converted to integer cents
+    once, on the way in.
+    """
 
-    def __init__(self, bank: Bank, balance: float = 1000.0):
+    def __init__(self, bank: Bank, balance: float = 1000.0,
+                 metrics: Metrics = None, cassette: Cassette = None):
         """Create a new ATM.
 
         Args:
-            bank (Bank): The bank that this ATM is connected to.
-            balance (float, optional): The initial balance. Defaults to 1000.0.
+            bank (Bank or RemoteBank): The bank that this ATM is
+                connected to, in this process or on a BankServer.
+            balance (float, optional): The initial balance, spread across
+                the denominations. Defaults to 1000.0.
+            metrics (Metrics, optional): Count and time the public methods
+                of this ATM in these metrics. Defaults to None, which adds
+                no overhead.
+            cassette (Cassette, optional): The notes loaded, used instead of
+                the balance. Defaults to None.
         """
         self._bank = bank
-        self._balance = balance
+        if cassette is None:
+            cassette = Cassette.from_amount(to_cents(balance))
+        self._cassette = cassette
         self._connected_banks = {}
+        if metrics is not None:
+            metrics.instrument(self, "atm", INSTRUMENTED_METHODS,
+                               bank=bank.name)
 
     def __str__(self) -> str:
         """Return a string of the bank which the ATM is connected to."""
         return f"ATM for {self._bank.name}"
 
-    def login(self, iban: int, pin: int) -> Account:
+    def login(self, iban: int, pin: int) -> Session:
         """Checks with the bank if the user is permitted to login.
 
         Args:
@@ -34,148 +71,257 @@ class ATM:
             BankError: If the IBAN or PIN are incorrect.
 
         Returns:
-            Account: The account of the user logging in.
+            Session: A session for the user logging in, to pass to the
+                other operations until `logout()`.
+        """
+        return self._bank.start_session(iban, pin)
+
+    def logout(self, session: Session):
+        """End a user's session.
+
+        Args:
+            session (Session): The session returned by `login()`.
         """
-        return self._bank.login(iban, pin)
+        self._bank.end_session(session)
 
     def user_check_balance(self, account: Account) -> float:
         """Get the current account balance of a user.
 
         Args:
-            account (Account): The account to get the balance of.
+            account (Account or Session): The account to get the balance of.
 
         Returns:
             float: The user's current balance.
         """
         return self._bank.check_balance(account)
 
-    def user_withdraw(self, account: Account, amount: float):
+    def user_withdraw(self, account: Account, amount: float) -> dict:
         """Withdraw the given amount from the user's account.
 
         Args:
-            account (Account): The account to withdraw from.
+            account (Account or Session): The account to withdraw from.
             amount (float): The amount of money to withdraw.
 
         Raises:
-            TypeError: If the account isn't an Account object.
+            TypeError: If the account isn't an Account or Session.
             TypeError: If the amount isn't a float or an int.
             ValueError: If the amount of money is less than or equal to 0.
-            AtmError: If the ATM doesn't have enough money for the transaction.
+            AtmError: If the ATM doesn't have enough money for the
+                transaction, or can't make up the amount with its notes.
             AccountError: If the given account has been tampered with.
+
+        Returns:
+            dict: The count of each denomination dispensed, in cents.
         """
-        if not isinstance(account, Account):
+        if not isinstance(account, _USERS):
             raise TypeError("Not a valid user")
-        if not isinstance(amount, (int, float)):
-            raise TypeError("Must be of type int or float")
-        if amount <= 0:
-            raise ValueError("Amount must be greater than 0")
-        if amount > self._balance:
-            raise AtmError("ATM does not have enough funds")
+        amount = parse_amount(amount)
+        notes = self._cassette.dispense(amount)
+        withdrawn = False
         try:
             self._bank.withdraw(account, amount)
-            self._balance -= amount
+            withdrawn = True
         except AccountError as error:
             raise AccountError() from error
+        finally:
+            if not withdrawn:
+                self._cassette.restore(notes)
+        return notes
 
     def user_deposit(self, account: Account, amount: float):
         """Deposit the given amount into the user's account.
 
         Args:
-            account (Account): THe account to deposit into.
+            account (Account or Session): THe account to deposit into.
             amount (float): The amount to deposit.
 
         Raises:
-            TypeError: If the account isn't an Account object.
+            TypeError: If the account isn't an Account or Session.
             TypeError: If the amount isn't a float or an int
             ValueError: If the amount is not greater than 0.
         """
-        if not isinstance(account, Account):
+        if not isinstance(account, _USERS):
             raise TypeError("Not a valid user")
-        if not isinstance(amount, (int, float)):
-            raise TypeError("Must be of type int or float")
-        if amount <= 0:
-            raise ValueError("Amount must be greater than 0")
+        amount = parse_amount(amount)
         self._bank.deposit(account, amount)
-        self._balance += amount
+        self._cassette.deposit(amount)
 
     def user_transfer(self, account: Account, amount: float,
                       transfer_bank: str, transfer_iban: int):
-        self.user_withdraw(account, amount)
+        """Transfer money from the user's account to a connected bank.
+
+        No cash leaves the ATM. The destination account is checked before
+        anything is taken from the user's account.
+
+        Args:
+            account (Account or Session): The account to transfer from.
+            amount (float): The amount of money to transfer.
+            transfer_bank (str): The name of the connected bank to pay.
+            transfer_iban (int): The IBAN of the account to pay.
+
+        Raises:
+            TypeError: If the account isn't an Account or Session.
+            TypeError: If the amount isn't a float or an int.
+            ValueError: If the amount of money is less than or equal to 0.
+            AtmError: If the bank isn't connected to this ATM.
+            BankError: If the destination account doesn't exist.
+            AccountError: If the user doesn't have sufficient balance.
+        """
+        if not isinstance(account, _USERS):
+            raise TypeError("Not a valid user")
+        amount = parse_amount(amount)
         other_bank = self.get_connected_bank(transfer_bank)
-        other_bank.transfer(transfer_iban, amount)
+        if other_bank is None:
+            raise AtmError("Bank is not connected to this ATM")
+        self._bank.transfer_to(account, amount, other_bank, transfer_iban)
+
+    def user_statement(self, account: Account, since: float = None,
+                       limit: int = 10) -> list:
+        """Get a mini-statement of the user's recent transactions.
+
+        Args:
+            account (Account or Session): The account to get the
+                statement of.
+            since (float, optional): Only include transactions at or after
+                this time, in seconds since the epoch. Defaults to None.
+            limit (int, optional): The most transactions to include.
+                Defaults to 10.
+
+        Raises:
+            TypeError: If the account isn't an Account or Session.
+            ValueError: If the limit is not greater than 0.
+            BankError: If the user's data has been tampered with.
+
+        Returns:
+            list: The Transactions, newest first.
+        """
+        if not isinstance(account, _USERS):
+            raise TypeError("Not a valid user")
+        if not self._bank.valid_user(account):
+            raise BankError("User data has been tampered with")
+        if isinstance(self._bank, RemoteBank):
+            return self._bank.get_statement(account, since, limit)
+        return self._bank.get_statement(account.iban, since, limit)
 
     def user_reset_pin(self, account: Account, new_pin: int):
-        if not isinstance(account, Account):
+        if not isinstance(account, _USERS):
             raise TypeError("Not a valid user")
         self._bank.reset_pin(account, new_pin)
 
-    def admin_withdraw(self, account: Account, amount: float):
-        """Remove funds from the ATM, if the user is an admin.
+    def admin_withdraw(self, account: Account, amount: float) -> dict:
+        """Remove notes from the ATM, if the user is an admin.
 
         Args:
-            account (Account): The user account (must be an admin).
+            account (Account or Session): The user (must be an admin).
             amount (float): The amount of money to remove.
 
         Raises:
-            TypeError: If the account is not an Account object.
+            TypeError: If the account is not an Account or Session.
             TypeError: If the amount is not a float or an int.
             ValueError: If the amount is not greater than 0.
             AccountError: If the user account is not an Admin
-            AtmError: If the ATM doesn't have enough money to remove.
+            AtmError: If the ATM doesn't have enough money to remove, or
+                can't make up the amount with its notes.
+
+        Returns:
+            dict: The count of each denomination removed, in cents.
         """
-        if not isinstance(account, Account):
+        if not isinstance(account, _USERS):
             raise TypeError("Not a valid user")
-        if not isinstance(amount, (float, int)):
-            raise TypeError("Amount must be of type float or int")
-        if amount <= 0:
-            raise ValueError("Amount must be greater than 0")
-        if not self._bank.check_admin(account):
-            raise AccountError("User must be an admin")
-        if amount > self._balance:
-            raise AtmError("ATM does not have enough funds")
-        self._balance -= amount
+        amount = parse_amount(amount)
+        self._check_admin(account)
+        return self._cassette.dispense(amount)
 
-    def admin_deposit(self, account: Account, amount: float):
+    def admin_deposit(self, account: Account, amount: float,
+                      notes: dict = None):
         """Add funds to the ATM, if the user is an admin.
 
         Args:
-            account (Account): The user account (must be an admin).
+            account (Account or Session): The user (must be an admin).
             amount (float): The amount to add to the ATM.
+            notes (dict, optional): The count of each denomination loaded,
+                keyed by denomination in cents, which must add up to the
+                amount. Defaults to None, to load the amount as the fewest
+                notes, with anything left over in the deposit bin.
 
         Raises:
-            TypeError: If the account is not an Account object
+            TypeError: If the account is not an Account or Session
             TypeError: If the amount is not a float or an int.
-            ValueError: If the amount is not greater than 0.
+            ValueError: If the amount is not greater than 0, or the notes
+                don't add up to it.
             AccountError: If the user account is not an admin.
         """
-        if not isinstance(account, Account):
+        if not isinstance(account, _USERS):
             raise TypeError("Not a valid user")
-        if not isinstance(amount, (float, int)):
-            raise TypeError("Amount must be of type float or int")
-        if amount <= 0:
-            raise ValueError("Amount must be greater than 0")
-        if not self._bank.check_admin(account):
-            raise AccountError("User must be an admin")
-        self._balance += amount
+        amount = parse_amount(amount)
+        if notes is not None and sum(
+                denomination * count
+                for denomination, count in notes.items()) != amount:
+            raise ValueError("Notes must add up to the amount")
+        self._check_admin(account)
+        if notes is None:
+            self._cassette.deposit(amount)
+        else:
+            self._cassette.load(notes)
 
     def check_balance(self, account: Account) -> float:
         """Get the total balance of the ATM, if the user is an admin.
 
         Args:
-            account (Account): The user account (must be an admin).
+            account (Account or Session): The user (must be an admin).
 
         Raises:
-            TypeError: If the account is not an Account object.
+            TypeError: If the account is not an Account or Session.
             AccountError: If the user account is not an admin.
 
         Returns:
-            float: The total balance of the ATM.
+            float: The total balance of the ATM, including the deposit bin.
         """
-        if not isinstance(account, Account):
+        if not isinstance(account, _USERS):
             raise TypeError("Not a valid user")
-        if not self._bank.check_admin(account):
-            raise AccountError("User must be an admin")
-        return self._balance
+        self._check_admin(account)
+        return to_euros(self._cassette.total)
+
+    def cash_inventory(self, account: Account) -> dict:
+        """Get the notes held by the ATM, if the user is an admin.
+
+        Args:
+            account (Account or Session): The user (must be an admin).
+
+        Raises:
+            TypeError: If the account is not an Account or Session.
+            AccountError: If the user account is not an admin.
+
+        Returns:
+            dict: The count of each denomination, in cents.
+        """
+        if not isinstance(account, _USERS):
+            raise TypeError("Not a valid user")
+        self._check_admin(account)
+        return self._cassette.counts()
+
+    def cash_forecast(self, account: Account,
+                      horizon: float = None) -> dict:
+        """Forecast when the ATM runs out of each note, if the user is an
+        admin.
+
+        Args:
+            account (Account or Session): The user (must be an admin).
+            horizon (float, optional): Only include denominations expected
+                to run out within this many seconds. Defaults to None.
+
+        Raises:
+            TypeError: If the account is not an Account or Session.
+            AccountError: If the user account is not an admin.
+
+        Returns:
+            dict: The seconds until each denomination, in cents, runs out
+                at the recent rate of withdrawals.
+        """
+        if not isinstance(account, _USERS):
+            raise TypeError("Not a valid user")
+        self._check_admin(account)
+        return self._cassette.forecast(horizon)
 
     def add_connected_bank(self, bank: Bank) -> bool:
         """Add a bank connection to this ATM.
@@ -183,17 +329,23 @@ class ATM:
         Allows ATM users to transfer funds to other users the added bank.
 
         Args:
-            bank (Bank): The new bank to be added.
+            bank (Bank or RemoteBank): The new bank to be added. It must be
+                the same kind as this ATM's bank, and a RemoteBank can only
+                be paid from a RemoteBank on the same server.
 
         Raises:
-            TypeError: If the bank isn't from the Bank class.
+            TypeError: If the bank isn't a Bank or a RemoteBank, or isn't
+                the same kind as this ATM's bank.
 
         Returns:
             bool: True if the bank was added, otherwise False.
         """
         added = False
-        if not isinstance(bank, Bank):
+        if not isinstance(bank, _BANKS):
             raise TypeError("Not a valid bank")
+        if isinstance(bank, RemoteBank) != \
+                isinstance(self._bank, RemoteBank):
+            raise TypeError("Can't connect a local and a remote bank")
         if bank is not self._bank:
             bank_name = bank.name
             if bank_name not in self._connected_banks:
@@ -234,3 +386,12 @@ class ATM:
             dict: The connected banks.
         """
         return self._connected_banks
+
+    def _check_admin(self, account: Account):
+        """Check that the user is an admin.
+
+        Raises:
+            AccountError: If the user account is not an admin.
+        """
+        if not self._bank.check_admin(account):
+            raise AccountError("User must be an admin")
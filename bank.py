@@ -1,29 +1,162 @@
 """A bank to be used with an ATM."""
 
-import shelve
-from random import randint
+import threading
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+from copy import copy
+from functools import partial
+from time import time
 
 from account import Account
+from allocator import IbanAllocator
+from cache import AccountCache
 from exceptions import BankError, AccountError
+from history import History, MemoryHistory, Transaction
+from metrics import Metrics
+from money import parse_amount
+from pins import ITERATIONS, VerifiedPinCache, hash_pin
+from reports import DEFAULT_BOUNDS, Report, summarise
+from sessions import Session, SessionManager
+from sharding import ShardedStorage
+from singleflight import SingleFlight
+from storage import DbmStorage, Storage
+
+
+# The public methods timed when a Bank is given a Metrics object.
+INSTRUMENTED_METHODS = ("login", "start_session", "valid_user",
+                        "check_balance", "check_admin", "withdraw",
+                        "deposit", "transfer", "transfer_to", "reset_pin",
+                        "apply_batch", "get_statement")
+
+# The transactions kept per account by the default, in-memory history.
+HISTORY_RETENTION = 100
+
+BatchResult = namedtuple("BatchResult", ["kind", "iban", "amount", "error"])
+BatchResult.__doc__ = """The outcome of one transaction applied by `Bank.apply_batch`.
+
+The error is the exception that rejected the transaction, or None if the
+transaction was applied.
+"""
 
 
 class Bank:
     """A bank that contains a database of accounts."""
 
-    def __init__(self, bank_id: str, bank_name: str):
+    def __init__(self, bank_id: str, bank_name: str, sync_every: int = 0,
+                 cache_size: int = 0, storage: Storage = None,
+                 lock_stripes: int = 64, pin_iterations: int = ITERATIONS,
+                 pin_cache_size: int = 1024, session_ttl: float = 300.0,
+                 history: History = None, metrics: Metrics = None,
+                 shards: int = 1, coalesce_reads: bool = True):
         """Create a new Bank.
 
+        The account database is opened and closed on every call unless the
+        bank is opened with `open()` (or used as a context manager), in which
+        case a single handle is kept until `close()` is called.
+
+        A Bank can be shared between threads. Each change to an account is
+        made while holding one of a fixed set of locks chosen by its IBAN,
+        so operations on different accounts rarely wait for each other.
+
         Args:
             bank_id (str): Short identifier for the bank (Must have no spaces).
             bank_name (str): Longer name of the bank for printing strings.
+            sync_every (int, optional): While the database is held open, flush
+                it to disk after this many writes. 0 only flushes on `sync()`
+                and `close()`. Ignored if a storage backend is given.
+                Defaults to 0.
+            cache_size (int, optional): Keep up to this many recently used
+                accounts in memory so repeat lookups skip the database. The
+                cache assumes this Bank is the only writer to its database.
+                0 disables the cache. Defaults to 0.
+            storage (Storage, optional): Where the accounts are kept.
+                Defaults to a dbm database named after the bank_id. Given
+                a read-only store, such as a `replica.ReplicaStorage`, the
+                bank answers lookups and balance checks, and every change
+                raises a BankError.
+            lock_stripes (int, optional): The number of account locks.
+                Defaults to 64.
+            pin_iterations (int, optional): The cost of the PIN hashes of
+                new accounts and reset PINs. Existing PINs are hashed again
+                at this cost when their owner next logs in. Defaults to
+                `pins.ITERATIONS`.
+            pin_cache_size (int, optional): Remember up to this many recent
+                logins so repeat logins skip hashing the PIN. 0 disables
+                the cache. Defaults to 1024.
+            session_ttl (float, optional): Seconds a session from
+                `start_session()` lasts. Defaults to 300.
+            history (History, optional): Where a transaction is recorded
+                for every change to a balance. Defaults to a MemoryHistory
+                keeping the last HISTORY_RETENTION transactions of each
+                account, which is lost when the process ends; give a
+                `history.SQLiteHistory` to keep every transaction on disk.
+            metrics (Metrics, optional): Count and time the public methods
+                of this bank, and report its storage and cache counters,
+                in these metrics. Defaults to None, which adds no overhead.
+            shards (int, optional): Split the default database into this
+                many shards by IBAN range, so operations on accounts in
+                different shards run in parallel. An existing shard layout
+                is reopened as it is. Ignored if a storage backend is given.
+                Defaults to 1, for a single database.
+            coalesce_reads (bool, optional): Let concurrent lookups of one
+                account, such as by `get_account()`, `login()` and
+                `check_balance()`, share a single read of the database.
+                Defaults to True.
+
+        Raises:
+            ValueError: If sync_every, cache_size or pin_cache_size is
+                negative, or lock_stripes, pin_iterations, session_ttl or
+                shards is not greater than 0, or a cache is asked for with
+                a read-only store, which would outlive its staleness bound.
         """
+        if cache_size < 0:
+            raise ValueError("cache_size must not be negative")
+        if pin_cache_size < 0:
+            raise ValueError("pin_cache_size must not be negative")
+        if pin_iterations <= 0:
+            raise ValueError("pin_iterations must be greater than 0")
+        if lock_stripes <= 0:
+            raise ValueError("lock_stripes must be greater than 0")
+        if shards <= 0:
+            raise ValueError("shards must be greater than 0")
+        if storage is None and shards > 1:
+            storage = ShardedStorage.at(
+                f"{bank_id}_bank_accounts", shards,
+                lambda path: DbmStorage(path, sync_every))
+        elif storage is None:
+            storage = DbmStorage(f"{bank_id}_bank_accounts", sync_every)
+        if cache_size and storage.read_only:
+            raise ValueError("A read-only bank can't cache accounts")
         self._name = bank_name
-        self._database = f"{bank_id}_bank_accounts"
+        self._storage = storage
+        self._allocator = IbanAllocator(self._stored_ibans)
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._cache = AccountCache(cache_size) if cache_size else None
+        self._pin_iterations = pin_iterations
+        self._verified_pins = VerifiedPinCache(pin_cache_size) \
+            if pin_cache_size else None
+        self._sessions = SessionManager(session_ttl)
+        self._history = MemoryHistory(HISTORY_RETENTION) \
+            if history is None else history
+        self._reads = SingleFlight() if coalesce_reads else None
+        if metrics is not None:
+            metrics.instrument(self, "bank", INSTRUMENTED_METHODS,
+                               bank=bank_name)
+            metrics.add_collector(self._collect_metrics)
 
     def __str__(self) -> str:
         """Returns a string of the name of the Bank."""
         return str(self._name)
 
+    def __enter__(self):
+        """Open the database for the duration of a `with` block."""
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the database at the end of a `with` block."""
+        self.close()
+
     def __contains__(self, iban: int) -> bool:
         """Returns whether or not the account is in this bank.
 
@@ -33,9 +166,11 @@ class Bank:
         Returns:
             bool: True if the account is in the bank, otherwise False.
         """
+        if self._cache is not None and iban in self._cache:
+            return True
         contained = False
-        with shelve.open(self._database) as accounts:
-            if str(iban) in accounts:
+        with self._accounts() as accounts:
+            if iban in accounts:
                 contained = True
         return contained
 
@@ -44,6 +179,87 @@ class Bank:
         """Get the name of the Bank."""
         return self._name
 
+    @property
+    def is_open(self) -> bool:
+        """Return whether the database handle is being held open."""
+        return self._storage.is_open
+
+    @property
+    def read_only(self) -> bool:
+        """Return whether the bank serves reads from a read-only store."""
+        return self._storage.read_only
+
+    @property
+    def storage(self) -> Storage:
+        """Get the storage backend holding the accounts."""
+        return self._storage
+
+    @property
+    def history(self) -> History:
+        """Get the store of transactions made by this bank."""
+        return self._history
+
+    @property
+    def stats(self) -> dict:
+        """Get a copy of the storage counters for this bank.
+
+        Returns:
+            dict: The number of times the database file has been opened and
+                the number of reads and writes of account records.
+        """
+        return self._storage.stats
+
+    @property
+    def cache_stats(self) -> dict:
+        """Get the account cache counters.
+
+        Returns:
+            dict: The cache hits, misses, evictions, size and capacity, or an
+                empty dict if the cache is disabled.
+        """
+        if self._cache is None:
+            return {}
+        stats = self._cache.stats
+        stats["size"] = len(self._cache)
+        stats["capacity"] = self._cache.capacity
+        return stats
+
+    @property
+    def coalescing_stats(self) -> dict:
+        """Get the counters of lookups that shared a database read.
+
+        Returns:
+            dict: The lookups that went to the database, how many of those
+                shared another lookup's read, and the fraction coalesced,
+                or an empty dict if coalescing is disabled.
+        """
+        if self._reads is None:
+            return {}
+        stats = self._reads.stats
+        stats["fraction"] = self._reads.coalesced_fraction
+        return stats
+
+    def open(self):
+        """Open the account database and keep it open until `close()`.
+
+        Calling `open()` on a bank that is already open does nothing.
+        """
+        self._storage.open()
+
+    def close(self):
+        """Flush and close the account database if it is open.
+
+        The thread sweeping expired sessions is stopped too. Sessions
+        already issued stay valid, and the sweep starts again with the next
+        session.
+        """
+        self._storage.close()
+        self._sessions.stop()
+
+    def sync(self):
+        """Flush any pending writes to disk if the database is open."""
+        self._storage.sync()
+
     def get_account(self, iban: int) -> Account:
         """Get the user account corresponding to the given IBAN.
 
@@ -56,16 +272,18 @@ class Bank:
         Returns:
             Account: The user account with the given IBAN.
         """
-        account = None
-        with shelve.open(self._database) as accounts:
-            if str(iban) not in accounts:
-                raise KeyError("Account does not exist")
-            account = accounts[str(iban)]
+        account = self._lookup(iban)
+        if account is None:
+            raise KeyError("Account does not exist")
         return account
 
     def login(self, iban: int, pin: int) -> Account:
         """Authenticate a user logging into an ATM.
 
+        A PIN that isn't hashed, or is hashed at another cost than this
+        bank's, is hashed again and stored once it has been checked, unless
+        the bank is read-only.
+
         Args:
             iban (int): The bank account identifier of the user.
             pin (int): The user's PIN.
@@ -76,26 +294,61 @@ class Bank:
         Returns:
             Account: The user's account.
         """
-        if iban not in self:
+        account = self._lookup(iban)
+        if account is None:
             raise BankError("Account does not exist")
-        account = self.get_account(iban)
-        if not account.check_pin(pin):
+        if not self._check_pin(account, pin):
             raise BankError("Incorrect PIN")
+        if account.needs_rehash(self._pin_iterations) and \
+                not self._storage.read_only:
+            account = self._rehash_pin(account, pin)
         return account
 
+    def start_session(self, iban: int, pin: int) -> Session:
+        """Authenticate a user and start a session for them.
+
+        Operations given the session check it in memory instead of reading
+        the stored account back to compare it, and it stays valid while
+        the balance changes, until it expires or is ended.
+
+        Args:
+            iban (int): The bank account identifier of the user.
+            pin (int): The user's PIN.
+
+        Raises:
+            BankError: If the authentication fails.
+
+        Returns:
+            Session: The user's session.
+        """
+        account = self.login(iban, pin)
+        return self._sessions.issue(account.iban, account.name,
+                                    account.admin)
+
+    def end_session(self, session: Session):
+        """End a session so it can't be used again.
+
+        Args:
+            session (Session): The session to end.
+        """
+        self._sessions.end(session)
+
     def valid_user(self, user: Account) -> bool:
         """Checks whether the given user data matches the database.
 
         Args:
-            user (Account): The user account to validate.
+            user (Account or Session): The user account to validate, or a
+                session, which is checked without reading the database.
 
         Returns:
             bool: True if the account matches the database, False otherwise.
         """
+        if isinstance(user, Session):
+            return self._sessions.is_valid(user)
         validated = False
         if isinstance(user, Account):
-            account = self.get_account(user.iban)
-            if user == account:
+            account = self._lookup(user.iban)
+            if account is not None and user == account:
                 validated = True
         return validated
 
@@ -103,7 +356,7 @@ class Bank:
         """Get the given user's account balance.
 
         Args:
-            user (Account): The account to get the balance of.
+            user (Account or Session): The account to get the balance of.
 
         Raises:
             BankError: If the user data has been tampered with.
@@ -111,16 +364,13 @@ class Bank:
         Returns:
             float: The user's account balance.
         """
-        if not self.valid_user(user):
-            raise BankError("User data has been tampered with")
-        account = self.get_account(user.iban)
-        return account.balance
+        return self._validated(None, user).balance
 
     def withdraw(self, user: Account, amount: float):
         """Withdraw the given amount from the user's account.
 
         Args:
-            user (Account): The account to withdraw from.
+            user (Account or Session): The account to withdraw from.
             amount (float): The amount to withdraw.
 
         Raises:
@@ -129,36 +379,25 @@ class Bank:
             BankError: If the user's data has been tampered with.
             AccountError: If the user doesn't have sufficient balance.
         """
-        if not isinstance(amount, (int, float)):
-            raise TypeError("Must be of type int or float")
-        if amount <= 0:
-            raise ValueError("Amount must be greater than 0")
-        if not self.valid_user(user):
-            raise BankError("User data has been tampered with")
-        with shelve.open(self._database) as accounts:
-            account = accounts[str(user.iban)]
-            try:
-                account.withdraw(amount)
-            except AccountError as error:
-                raise AccountError() from error
-            accounts[str(user.iban)] = account
+        amount = parse_amount(amount)
+        with self._account_lock(_iban_of(user)):
+            self._debit(user, amount)
 
     def reset_pin(self, user: Account, new_pin: int):
-        if not self.valid_user(user):
-            raise BankError("User data has been tampered with")
-        with shelve.open(self._database) as accounts:
-            account = accounts[str(user.iban)]
+        with self._account_lock(_iban_of(user)), \
+                self._accounts() as accounts:
+            account = self._validated(accounts, user)
             try:
-                account.update_pin(new_pin)
+                account.update_pin(new_pin, self._pin_iterations)
             except ValueError as error:
                 raise ValueError() from error
-            accounts[str(user.iban)] = account
+            self._write(accounts, account)
 
     def deposit(self, user: Account, amount: float):
         """Deposit the given amount into the user's account.
 
         Args:
-            user (Account): The account to deposit into
+            user (Account or Session): The account to deposit into
             amount (float): The amount to deposit.
 
         Raises:
@@ -166,22 +405,138 @@ class Bank:
             ValueError: If the amount is not greater than 0.
             BankError: If the user's data has been tampered with.
         """
-        if not isinstance(amount, (int, float)):
-            raise TypeError("Must be of type int or float")
-        if amount <= 0:
-            raise ValueError("Amount must be greater than 0")
-        if not self.valid_user(user):
-            raise BankError("User data has been tampered with")
-        with shelve.open(self._database) as accounts:
-            account = accounts[str(user.iban)]
+        amount = parse_amount(amount)
+        with self._account_lock(_iban_of(user)), \
+                self._accounts() as accounts:
+            account = self._validated(accounts, user)
             account.deposit(amount)
-            accounts[str(user.iban)] = account
-    
+            self._write(accounts, account)
+            self._record(account, "deposit", amount)
+
     def transfer(self, iban: int, amount: float):
-        if iban not in self:
-            raise BankError("Account does not exist")
-        account = self.get_account(iban)
-        self.deposit(account, amount)
+        """Deposit a transfer from another bank into an account.
+
+        Args:
+            iban (int): The IBAN of the account to deposit into.
+            amount (float): The amount being transferred.
+
+        Raises:
+            TypeError: If the amount isn't a float or an int.
+            ValueError: If the amount is not greater than 0.
+            BankError: If the account does not exist.
+        """
+        amount = parse_amount(amount)
+        with self._account_lock(iban):
+            self._credit(iban, amount, kind="transfer in")
+
+    def transfer_to(self, user: Account, amount: float, other_bank: "Bank",
+                    iban: int):
+        """Move money from a user's account to an account in another bank.
+
+        The transfer runs in two phases while holding the locks of both
+        accounts. First the destination account is checked, so nothing is
+        taken from the user if it doesn't exist. Then the user's account is
+        debited and the destination credited. If the credit fails the debit
+        is rolled back.
+
+        Args:
+            user (Account or Session): The account to transfer from.
+            amount (float): The amount to transfer.
+            other_bank (Bank): The bank holding the destination account.
+            iban (int): The IBAN of the destination account.
+
+        Raises:
+            TypeError: If the amount isn't a float or an int.
+            ValueError: If the amount is not greater than 0.
+            BankError: If the other bank isn't a Bank in this process, the
+                destination account does not exist or is the user's own
+                account, or the user's data has been tampered with.
+            AccountError: If the user doesn't have sufficient balance.
+        """
+        amount = parse_amount(amount)
+        if not isinstance(other_bank, Bank):
+            raise BankError("Can't transfer to a bank in another process")
+        if other_bank is self and str(iban) == str(_iban_of(user)):
+            raise BankError("Can't transfer to the same account")
+        locks = sorted({self._indexed_lock(_iban_of(user)),
+                        other_bank._indexed_lock(iban)},
+                       key=lambda entry: (id(entry[0]), entry[1]))
+        with ExitStack() as stack:
+            for _, _, lock in locks:
+                stack.enter_context(lock)
+            with other_bank._accounts() as accounts:
+                destination = other_bank._read(accounts, iban)
+            if destination is None:
+                raise BankError("Account does not exist")
+            self._debit(user, amount, "transfer out")
+            try:
+                other_bank._credit(iban, amount, destination, "transfer in")
+            except BaseException:
+                self._credit(user.iban, amount, kind="reversal")
+                raise
+
+    def apply_batch(self, transactions) -> list:
+        """Apply many deposits and withdrawals, such as an end-of-day replay.
+
+        Each transaction is a `(kind, iban, amount)` tuple where kind is
+        "deposit" or "withdraw". The transactions for each account are
+        applied in the order given, with each account read and written once,
+        and the whole batch is flushed to the database once at the end. A
+        transaction that fails is skipped without affecting the others.
+
+        Args:
+            transactions (iterable): The (kind, iban, amount) tuples.
+
+        Returns:
+            list: A BatchResult for each transaction, in the order given.
+        """
+        results = []
+        transactions_made = []
+        by_iban = {}
+        for kind, iban, amount in transactions:
+            by_iban.setdefault(str(iban), []).append(len(results))
+            results.append(BatchResult(kind, iban, amount, None))
+        with self._all_accounts_locked(), self._storage.batch() as accounts:
+            for key, indexes in by_iban.items():
+                account = self._read(accounts, key)
+                changed = False
+                for index in indexes:
+                    kind, iban, amount, _ = results[index]
+                    try:
+                        cents = self._apply(account, kind, amount)
+                        changed = True
+                    except (TypeError, ValueError, AccountError,
+                            BankError) as error:
+                        results[index] = results[index]._replace(error=error)
+                        continue
+                    transactions_made.append(Transaction(
+                        account.iban, time(), kind, int(cents),
+                        account.balance_cents))
+                if changed:
+                    self._write(accounts, account)
+        self._history.record_many(transactions_made)
+        return results
+
+    def get_statement(self, iban: int, since: float = None,
+                      limit: int = 10) -> list:
+        """Get the most recent transactions of an account.
+
+        Args:
+            iban (int): The IBAN of the account.
+            since (float, optional): Only return transactions at or after
+                this time, in seconds since the epoch. Defaults to None.
+            limit (int, optional): The most transactions to return.
+                Defaults to 10.
+
+        Raises:
+            ValueError: If the limit is not greater than 0.
+
+        Returns:
+            list: The Transactions, newest first.
+        """
+        if limit <= 0:
+            raise ValueError("Limit must be greater than 0")
+        return self._history.statement(iban, since, limit)
 
     def create_account(self, name: str, pin: int) -> int:
         """Add a user to the bank and return their bank account number (IBAN).
@@ -194,11 +549,126 @@ class Bank:
             int: The users bank account number (IBAN).
         """
         iban = self._generate_iban()
-        account = Account(iban, name, pin)
-        with shelve.open(self._database) as accounts:
-            accounts[str(iban)] = account
+        account = Account(iban, name, pin, iterations=self._pin_iterations)
+        with self._accounts() as accounts:
+            self._write(accounts, account)
         return iban
 
+    def create_accounts(self, users) -> list:
+        """Add many users to the bank at once.
+
+        The IBANs are allocated in one pass and the accounts are written in
+        a single batch.
+
+        Args:
+            users (iterable): (name, pin) or (name, pin, admin) tuples.
+
+        Returns:
+            list: The new IBANs, in the same order as the users.
+        """
+        users = [tuple(user) for user in users]
+        ibans = self._allocator.allocate_many(len(users))
+        with self._storage.batch() as accounts:
+            for iban, user in zip(ibans, users):
+                self._write(accounts, Account(
+                    iban, *user, iterations=self._pin_iterations))
+        return ibans
+
+    def import_accounts(self, records, pool=None) -> int:
+        """Write full account records, such as rows read from an export.
+
+        A record with an IBAN replaces any account with that IBAN, and a
+        record whose IBAN is None is given a new one. PIN hashes, as
+        PinHash values or in their text form, are stored as they are.
+
+        PINs given as numbers are hashed at this bank's full PBKDF2 cost,
+        which takes far longer than writing the account, so an import of
+        plain PINs is bound by hashing. They are hashed before the storage
+        batch starts, spread over the pool if one is given; pass PIN hashes
+        to skip the cost. The records are written in a single batch, so
+        callers should pass them in chunks.
+
+        Args:
+            records (iterable): (iban, name, pin, admin, balance) tuples,
+                with the balance in cents.
+            pool (multiprocessing.pool.Pool, optional): Hash plain PINs in
+                these worker processes. Defaults to None, to hash them in
+                this thread.
+
+        Raises:
+            ValueError: If a PIN is text but not a PIN hash.
+
+        Returns:
+            int: The number of accounts written.
+        """
+        records = list(records)
+        missing = sum(record[0] is None for record in records)
+        new_ibans = iter(self._allocator.allocate_many(missing))
+        for index, record in enumerate(records):
+            if record[0] is None:
+                records[index] = (next(new_ibans), *record[1:])
+            else:
+                self._allocator.reserve(record[0])
+        imported = [Account.from_record(record) for record in records]
+        plain = [index for index, account in enumerate(imported)
+                 if account.pin_hash is None]
+        if plain:
+            hash_plain = partial(hash_pin, iterations=self._pin_iterations)
+            pins = [records[index][2] for index in plain]
+            hashes = pool.map(hash_plain, pins) if pool is not None \
+                else map(hash_plain, pins)
+            for index, pin_hash in zip(plain, hashes):
+                iban, name, _, admin, balance = records[index]
+                imported[index] = Account.from_record(
+                    (iban, name, pin_hash, admin, balance))
+        with self._all_accounts_locked(), self._storage.batch() as accounts:
+            for account in imported:
+                self._write(accounts, account)
+        return len(imported)
+
+    def export_accounts(self):
+        """Iterate over the full record of every account in the bank.
+
+        The database is kept open until the iteration finishes.
+
+        Yields:
+            tuple: (iban, name, pin, admin, balance) for each account, with
+                the PIN hash in its text form and the balance in cents.
+        """
+        with self._accounts() as accounts:
+            for account in accounts.accounts():
+                yield account.to_record()
+
+    def report(self, top: int = 10, bounds: tuple = DEFAULT_BOUNDS,
+               chunk_size: int = 65536) -> Report:
+        """Total up every account, such as for an end-of-day report.
+
+        The accounts are read in chunks of their IBAN, balance and admin
+        status, and reduced with NumPy if it is installed, so memory use
+        doesn't grow with the number of accounts. The database is kept
+        open, and other threads wait for it, until the report is made.
+
+        Args:
+            top (int, optional): The number of largest balances to list.
+                Defaults to 10.
+            bounds (tuple, optional): The sorted upper bounds of the
+                balance distribution buckets, in cents. Defaults to
+                `reports.DEFAULT_BOUNDS`.
+            chunk_size (int, optional): The accounts read at a time.
+                Defaults to 65536.
+
+        Raises:
+            ValueError: If top is negative, chunk_size is not greater than
+                0, or the bounds aren't sorted.
+
+        Returns:
+            Report: The number of accounts and admins, the total, smallest
+                and largest balance, the balance distribution and the top
+                balances, all in cents.
+        """
+        with self._accounts() as accounts:
+            return summarise(accounts.columns(chunk_size), top, bounds)
+
     def create_admin_account(self, name: str, pin: int) -> int:
         """Add an admin to the bank and return their account number (IBAN).
 
@@ -210,37 +680,355 @@ class Bank:
             int: The admin's bank account number (IBAN).
         """
         iban = self._generate_iban()
-        account = Account(iban, name, pin, True)
-        with shelve.open(self._database) as accounts:
-            accounts[str(iban)] = account
+        account = Account(iban, name, pin, True, self._pin_iterations)
+        with self._accounts() as accounts:
+            self._write(accounts, account)
         return iban
 
     def check_admin(self, user: Account) -> bool:
         """Check if the user is an admin in the database.
 
         Args:
-            user (Account): The account to check.
+            user (Account or Session): The account to check. A session
+                holds the admin status from when the user logged in.
 
         Raises:
-            BankError: If the users data has been tampered with.
+            BankError: If the users data has been tampered with, or the
+                session isn't valid.
 
         Returns:
             bool: True if the user is an admin, otherwise False.
         """
-        if not self.valid_user(user):
-            raise BankError("User data has been tampered with")
-        account = self.get_account(user.iban)
-        return account.admin
+        if isinstance(user, Session):
+            return self._sessions.check(user).admin
+        return self._validated(None, user).admin
+
+    def _collect_metrics(self):
+        """Report the storage and cache counters for `Metrics`.
+
+        Yields:
+            tuple: (name, labels, value) for each counter.
+        """
+        labels = {"bank": self._name}
+        for counter, value in self._storage.stats.items():
+            yield f"bank_storage_{counter}_total", labels, value
+        if self._cache is not None:
+            for counter, value in self._cache.stats.items():
+                yield f"bank_cache_{counter}_total", labels, value
+        if self._verified_pins is not None:
+            for counter, value in self._verified_pins.stats.items():
+                yield f"bank_verified_pin_{counter}_total", labels, value
+        if self._reads is not None:
+            for counter, value in self._reads.stats.items():
+                yield f"bank_lookup_{counter}_total", labels, value
 
     def _generate_iban(self) -> int:
-        """Generate a random 8-digit IBAN.
+        """Generate a random, unused 8-digit IBAN.
 
         Returns:
             int: The new IBAN.
         """
-        iban = None
-        while iban is None:
-            iban = randint(10000000, 99999999)
-            if iban in self:
-                iban = None
-        return iban
+        return self._allocator.allocate()
+
+    def _stored_ibans(self) -> list:
+        """Read the IBAN of every account in the database.
+
+        Returns:
+            list: The stored IBANs.
+        """
+        with self._accounts() as accounts:
+            return accounts.ibans()
+
+    def _accounts(self):
+        """Use the account database, opening it only if it isn't open.
+
+        Returns:
+            contextmanager: Yields the storage backend.
+        """
+        return self._storage.session()
+
+    @staticmethod
+    def _apply(account: Account, kind: str, amount: float) -> int:
+        """Apply one batch transaction to an account.
+
+        Args:
+            account (Account): The account, or None if it doesn't exist.
+            kind (str): Either "deposit" or "withdraw".
+            amount (float): The amount to deposit or withdraw.
+
+        Raises:
+            TypeError: If the amount isn't a float or an int.
+            ValueError: If the amount is not greater than 0 or the kind is
+                not recognised.
+            BankError: If the account does not exist.
+            AccountError: If the account doesn't have sufficient balance.
+
+        Returns:
+            int: The amount applied, in cents.
+        """
+        amount = parse_amount(amount)
+        if account is None:
+            raise BankError("Account does not exist")
+        if kind == "deposit":
+            account.deposit(amount)
+        elif kind == "withdraw":
+            account.withdraw(amount)
+        else:
+            raise ValueError(f"Unknown transaction kind: {kind}")
+        return amount
+
+    def _account_lock(self, iban: int) -> threading.Lock:
+        """Get the lock that guards changes to an account.
+
+        Args:
+            iban (int): The IBAN of the account.
+
+        Returns:
+            threading.Lock: The lock for the account's stripe.
+        """
+        return self._locks[hash(str(iban)) % len(self._locks)]
+
+    def _indexed_lock(self, iban: int) -> tuple:
+        """Get an account lock with the keys that fix its locking order.
+
+        Locks held together, even across banks, must be taken in order of
+        these keys so that two transfers can never wait on each other.
+
+        Args:
+            iban (int): The IBAN of the account.
+
+        Returns:
+            tuple: This bank, the stripe index and the lock.
+        """
+        index = hash(str(iban)) % len(self._locks)
+        return self, index, self._locks[index]
+
+    def _debit(self, user: Account, amount: float, kind: str = "withdraw"):
+        """Validate a user and withdraw from their account.
+
+        The caller must hold the account's lock.
+
+        Args:
+            user (Account or Session): The account to withdraw from.
+            amount (float): The amount to withdraw.
+            kind (str, optional): The kind of transaction to record.
+                Defaults to "withdraw".
+
+        Raises:
+            BankError: If the user's data has been tampered with.
+            AccountError: If the user doesn't have sufficient balance.
+        """
+        with self._accounts() as accounts:
+            account = self._validated(accounts, user)
+            try:
+                account.withdraw(amount)
+            except AccountError as error:
+                raise AccountError() from error
+            self._write(accounts, account)
+        self._record(account, kind, amount)
+
+    def _credit(self, iban: int, amount: float, account: Account = None,
+                kind: str = "deposit"):
+        """Deposit into an account by IBAN, without validating a user.
+
+        The caller must hold the account's lock.
+
+        Args:
+            iban (int): The IBAN of the account to deposit into.
+            amount (float): The amount to deposit.
+            account (Account, optional): The account, if the caller has
+                already read it while holding the lock. Defaults to None.
+            kind (str, optional): The kind of transaction to record.
+                Defaults to "deposit".
+
+        Raises:
+            BankError: If the account does not exist.
+        """
+        with self._accounts() as accounts:
+            if account is None:
+                account = self._read(accounts, iban)
+            if account is None:
+                raise BankError("Account does not exist")
+            account.deposit(amount)
+            self._write(accounts, account)
+        self._record(account, kind, amount)
+
+    def _record(self, account: Account, kind: str, amount: int):
+        """Record a change to an account's balance in the history.
+
+        The caller must hold the account's lock, so each account's
+        transactions are recorded in order.
+
+        Args:
+            account (Account): The account after the change.
+            kind (str): The kind of transaction.
+            amount (int): The amount of the change, in cents.
+        """
+        self._history.record(Transaction(account.iban, time(), kind,
+                                         int(amount), account.balance_cents))
+
+    @contextmanager
+    def _all_accounts_locked(self):
+        """Hold every account lock, taken in a fixed order, for a block."""
+        with ExitStack() as stack:
+            for lock in self._locks:
+                stack.enter_context(lock)
+            yield
+
+    def _lookup(self, iban: int) -> Account:
+        """Read an account, only opening the database on a cache miss.
+
+        Concurrent lookups of one account share a single read, which is
+        made while holding the account's lock and landed before the lock is
+        released, so a lookup never sees an account older than a change
+        that finished before it started. Each caller gets its own copy.
+
+        Args:
+            iban (int): The IBAN of the account to read.
+
+        Returns:
+            Account: The account, or None if it does not exist.
+        """
+        account = None
+        if self._cache is not None:
+            account = self._cache.get(iban)
+        if account is not None:
+            return account
+        if self._reads is None:
+            with self._account_lock(iban), self._accounts() as accounts:
+                return self._load(accounts, iban)
+        key = str(iban)
+        future, leader = self._reads.join(key)
+        if leader:
+            try:
+                with self._account_lock(iban), self._accounts() as accounts:
+                    account = self._load(accounts, iban)
+                    self._reads.land(key, future, account)
+            except BaseException as error:
+                self._reads.land(key, future, error=error)
+                raise
+        account = future.result()
+        return None if account is None else copy(account)
+
+    def _check_pin(self, account: Account, pin: int) -> bool:
+        """Check a PIN, skipping the hash if the login was recently verified.
+
+        Args:
+            account (Account): The stored account.
+            pin (int): The PIN to check.
+
+        Returns:
+            bool: True if the PIN matches, otherwise False.
+        """
+        cache = self._verified_pins
+        pin_hash = account.pin_hash
+        if cache is None or pin_hash is None:
+            return account.check_pin(pin)
+        if cache.check(account.iban, pin, pin_hash):
+            return True
+        if not account.check_pin(pin):
+            return False
+        cache.add(account.iban, pin, pin_hash)
+        return True
+
+    def _rehash_pin(self, account: Account, pin: int) -> Account:
+        """Hash a checked PIN again at this bank's cost and store it.
+
+        Args:
+            account (Account): The account whose PIN has been checked.
+            pin (int): The PIN.
+
+        Returns:
+            Account: The stored account, or the account given if it has
+                changed since it was read.
+        """
+        with self._account_lock(account.iban), self._accounts() as accounts:
+            stored = self._read(accounts, account.iban)
+            if stored is None or stored != account:
+                return account
+            stored.rehash_pin(pin, self._pin_iterations)
+            self._write(accounts, stored)
+        return stored
+
+    def _validated(self, accounts, user: Account) -> Account:
+        """Read the stored copy of an account and check it against the user's.
+
+        This is the single read behind every operation on a user's account,
+        so the validated account can be changed and written straight back.
+        A session is checked in memory and the stored account is read
+        without comparing it.
+
+        Args:
+            accounts (Storage): The open account database, or None to read
+                with `_lookup()`, for a check that changes nothing.
+            user (Account or Session): The user account to validate.
+
+        Raises:
+            BankError: If the user data doesn't match the database, or the
+                session isn't valid.
+
+        Returns:
+            Account: The stored account.
+        """
+        read = self._lookup if accounts is None \
+            else lambda iban: self._read(accounts, iban)
+        if isinstance(user, Session):
+            account = read(self._sessions.check(user).iban)
+            if account is None:
+                raise BankError("Account does not exist")
+            return account
+        account = None
+        if isinstance(user, Account):
+            account = read(user.iban)
+        if account is None or user != account:
+            raise BankError("User data has been tampered with")
+        return account
+
+    def _read(self, accounts, iban: int) -> Account:
+        """Read an account, preferring the cache over the database.
+
+        Args:
+            accounts (Storage): The open account database.
+            iban (int): The IBAN of the account to read.
+
+        Returns:
+            Account: The account, or None if it does not exist.
+        """
+        if self._cache is not None:
+            account = self._cache.get(iban)
+            if account is not None:
+                return account
+        return self._load(accounts, iban)
+
+    def _load(self, accounts, iban: int) -> Account:
+        """Read an account from the database and add it to the cache.
+
+        Args:
+            accounts (Storage): The open account database.
+            iban (int): The IBAN of the account to read.
+
+        Returns:
+            Account: The account, or None if it does not exist.
+        """
+        account = accounts.get(iban)
+        if account is not None and self._cache is not None:
+            self._cache.put(account)
+        return account
+
+    def _write(self, accounts, account: Account):
+        """Store an account and update the cache.
+
+        Args:
+            accounts (Storage): The open account database.
+            account (Account): The account to store.
+        """
+        accounts.put(account)
+        if self._cache is not None:
+            self._cache.put(account)
+
+
+def _iban_of(user: Account) -> int:
+    """Get the IBAN of a user, or None if it isn't an Account or Session."""
+    if isinstance(user, (Account, Session)):
+        return user.iban
+    return None
@@ -0,0 +1,876 @@
+"""Benchmarks for the Bank and ATM.
+
+Run a benchmark with `python3 benchmark.py <name>`, or list them with
+`python3 benchmark.py --help`. Every benchmark works in a temporary directory
+so the account databases used by `main.py` are left alone.
+"""
+
+import argparse
+import asyncio
+import os
+import pickle
+import random
+from decimal import Decimal
+import tempfile
+import threading
+from contextlib import contextmanager
+from multiprocessing import Pool
+from time import perf_counter
+
+from account import Account
+from async_atm import AsyncATM
+from atm import ATM
+import bulk
+from bank import Bank
+from cassette import Cassette
+from exceptions import AccountError, BankError
+from history import MemoryHistory, SQLiteHistory, Transaction
+from metrics import Metrics
+from money import to_cents, to_euros
+from pins import ITERATIONS
+from replica import ReplicaStorage, SnapshotPublisher
+import reports
+from server import BankServer, RemoteBank
+from sharding import ShardedStorage
+from storage import DbmStorage, JournalStorage, MmapStorage, SQLiteStorage
+
+# Benchmarks that set up many accounts hash their PINs at a low cost so the
+# setup doesn't swamp what they measure; `pins` measures the real cost.
+PIN_ITERATIONS = 1000
+
+
+@contextmanager
+def temporary_directory():
+    """Run the body of a `with` block inside a fresh temporary directory."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+
+def report(label: str, operations: int, seconds: float, **extra):
+    """Print a single line of benchmark results.
+
+    Args:
+        label (str): What was measured.
+        operations (int): The number of operations performed.
+        seconds (float): The time taken for all of the operations.
+        **extra: Additional values to print after the throughput.
+    """
+    rate = operations / seconds if seconds else float("inf")
+    line = f"{label:<32} {operations:>9} ops {seconds:>9.3f}s {rate:>12.0f} ops/s"
+    for key, value in extra.items():
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        line += f"  {key}={value}"
+    print(line)
+
+
+def _withdraw_session(atm: ATM, iban: int, pin: int, operations: int):
+    """Log in and perform a number of small withdrawals and deposits."""
+    session = atm.login(iban, pin)
+    for _ in range(operations):
+        atm.user_deposit(session, 10)
+        atm.user_withdraw(session, 10)
+    atm.logout(session)
+
+
+def bench_open_count(operations: int = 200):
+    """Compare database opens per operation with and without a held handle.
+
+    Args:
+        operations (int, optional): Deposit/withdraw pairs per run.
+    """
+    with temporary_directory():
+        for label, held in (("reopen per call", False), ("held handle", True)):
+            bank = Bank(f"bench_{int(held)}", "Benchmark Bank",
+                        pin_iterations=PIN_ITERATIONS)
+            iban = bank.create_account("Bench", 1234)
+            atm = ATM(bank)
+            if held:
+                bank.open()
+            opens_before = bank.stats["opens"]
+            start = perf_counter()
+            _withdraw_session(atm, iban, 1234, operations)
+            seconds = perf_counter() - start
+            bank.close()
+            opens = bank.stats["opens"] - opens_before
+            report(label, operations * 2, seconds,
+                   opens_per_op=opens / (operations * 2))
+
+
+def bench_cache(operations: int = 2000):
+    """Time repeated lookups of a few hot accounts with and without a cache.
+
+    Args:
+        operations (int, optional): The number of lookups per run.
+    """
+    with temporary_directory():
+        for label, cache_size in (("no cache", 0), ("lru cache", 16)):
+            bank = Bank(f"bench_{cache_size}", "Benchmark Bank",
+                        cache_size=cache_size, pin_iterations=PIN_ITERATIONS)
+            with bank:
+                ibans = [bank.create_account("Bench", 1234)
+                         for _ in range(8)]
+                start = perf_counter()
+                for number in range(operations):
+                    bank.get_account(ibans[number % len(ibans)])
+                seconds = perf_counter() - start
+            report(label, operations, seconds, **bank.cache_stats)
+
+
+def bench_storage(operations: int = 2000):
+    """Compare deposits and lookups on the dbm and SQLite backends.
+
+    Args:
+        operations (int, optional): The number of deposits per backend.
+    """
+    backends = (("dbm", lambda: DbmStorage("bench_dbm")),
+                ("sqlite", lambda: SQLiteStorage("bench.db")),
+                ("journal", lambda: JournalStorage("bench_journal")))
+    with temporary_directory():
+        for label, make_storage in backends:
+            with Bank("bench", "Benchmark Bank", storage=make_storage(),
+                      pin_iterations=PIN_ITERATIONS) as bank:
+                ibans = [bank.create_account("Bench", 1234)
+                         for _ in range(100)]
+                start = perf_counter()
+                for number in range(operations):
+                    bank.transfer(ibans[number % len(ibans)], 1)
+                seconds = perf_counter() - start
+                report(f"{label} deposit", operations, seconds)
+                start = perf_counter()
+                for number in range(operations):
+                    bank.get_account(ibans[number % len(ibans)])
+                seconds = perf_counter() - start
+                report(f"{label} lookup", operations, seconds)
+
+
+def bench_batch(operations: int = 10000, sample: int = 200):
+    """Compare end-of-day settlement through apply_batch and per-call loops.
+
+    Pass `-n 100000` or `-n 1000000` for the larger settlement runs. The
+    per-call loop reopens the database for every call, so it only replays
+    the first `sample` transactions and its rate is measured on those.
+
+    Args:
+        operations (int, optional): The number of transactions to replay.
+        sample (int, optional): The most transactions the loop replays.
+    """
+    with temporary_directory():
+        for label in ("per-call loop", "apply_batch"):
+            bank = Bank(label.replace(" ", "_"), "Benchmark Bank",
+                        pin_iterations=PIN_ITERATIONS)
+            with bank:
+                ibans = [bank.create_account("Bench", 1234)
+                         for _ in range(1000)]
+            transactions = []
+            for number in range(operations):
+                kind = "deposit" if number % 3 else "withdraw"
+                transactions.append((kind, ibans[number % len(ibans)], 5))
+            start = perf_counter()
+            if label == "apply_batch":
+                results = bank.apply_batch(transactions)
+                failed = sum(result.error is not None for result in results)
+            else:
+                transactions = transactions[:sample]
+                failed = 0
+                for kind, iban, amount in transactions:
+                    account = bank.get_account(iban)
+                    try:
+                        getattr(bank, kind)(account, amount)
+                    except AccountError:
+                        failed += 1
+            seconds = perf_counter() - start
+            report(label, len(transactions), seconds, failed=failed,
+                   opens=bank.stats["opens"])
+
+
+def bench_create(operations: int = 10000):
+    """Time creating accounts in bulk against creating them one at a time.
+
+    Args:
+        operations (int, optional): The number of accounts to create.
+    """
+    with temporary_directory():
+        with Bank("single", "Benchmark Bank",
+                  pin_iterations=PIN_ITERATIONS) as bank:
+            start = perf_counter()
+            for _ in range(operations):
+                bank.create_account("Bench", 1234)
+            report("create_account loop", operations, perf_counter() - start)
+        bank = Bank("bulk", "Benchmark Bank", pin_iterations=PIN_ITERATIONS)
+        start = perf_counter()
+        bank.create_accounts(("Bench", 1234) for _ in range(operations))
+        report("create_accounts", operations, perf_counter() - start,
+               opens=bank.stats["opens"])
+
+
+def bench_bulk(operations: int = 100000):
+    """Time streaming an account file into a bank and back out again.
+
+    Args:
+        operations (int, optional): The number of rows in the file.
+    """
+    with temporary_directory():
+        with open("accounts.csv", "w", encoding="utf-8") as file:
+            file.write("iban,name,pin,admin,balance\n")
+            for number in range(operations):
+                file.write(f",Bench {number},1234,0,{number % 500}\n")
+        bank = Bank("bench", "Benchmark Bank",
+                    storage=SQLiteStorage("bench.db"),
+                    pin_iterations=PIN_ITERATIONS)
+        result = bulk.import_file(bank, "accounts.csv")
+        report("import csv", result["rows"], result["seconds"])
+        bank = Bank("pooled", "Benchmark Bank",
+                    storage=SQLiteStorage("pooled.db"),
+                    pin_iterations=PIN_ITERATIONS)
+        result = bulk.import_file(bank, "accounts.csv",
+                                  processes=os.cpu_count() or 1)
+        report("import csv, pooled hashing", result["rows"],
+               result["seconds"])
+        result = bulk.export_file(bank, "accounts.jsonl")
+        report("export jsonl", result["rows"], result["seconds"])
+        bank = Bank("hashed", "Benchmark Bank",
+                    storage=SQLiteStorage("hashed.db"),
+                    pin_iterations=PIN_ITERATIONS)
+        result = bulk.import_file(bank, "accounts.jsonl")
+        report("import jsonl, hashed PINs", result["rows"],
+               result["seconds"])
+
+
+def bench_threads(operations: int = 4000):
+    """Run transfers from 1, 2, 4 and 8 threads and check none are lost.
+
+    Args:
+        operations (int, optional): The total transfers per run.
+    """
+    with temporary_directory():
+        for thread_count in (1, 2, 4, 8):
+            bank = Bank(f"threads_{thread_count}", "Benchmark Bank",
+                        storage=SQLiteStorage(f"threads_{thread_count}.db"),
+                        cache_size=64, pin_iterations=PIN_ITERATIONS)
+            with bank:
+                ibans = bank.create_accounts([("Bench", 1234)] * 32)
+                per_thread = operations // thread_count
+
+                def work(offset):
+                    for number in range(per_thread):
+                        bank.transfer(ibans[(offset + number) % len(ibans)], 1)
+
+                threads = [threading.Thread(target=work, args=(offset,))
+                           for offset in range(thread_count)]
+                start = perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                seconds = perf_counter() - start
+                total = sum(bank.get_account(iban).balance_cents
+                            for iban in ibans) // 100
+            report(f"{thread_count} threads", per_thread * thread_count,
+                   seconds, lost=per_thread * thread_count - total)
+
+
+def bench_async(operations: int = 2000):
+    """Run simulated terminals on one event loop and count sessions/s.
+
+    Each session logs in, deposits, logs in again and checks the balance.
+
+    Args:
+        operations (int, optional): The number of terminal sessions.
+    """
+    async def terminal(atm, iban):
+        user = await atm.login(iban, 1234)
+        await atm.user_deposit(user, 10)
+        user = await atm.login(iban, 1234)
+        await atm.user_check_balance(user)
+
+    async def run(atm, ibans):
+        await asyncio.gather(*(terminal(atm, ibans[number % len(ibans)])
+                               for number in range(operations)))
+
+    with temporary_directory():
+        bank = Bank("bench", "Benchmark Bank",
+                    storage=SQLiteStorage("bench.db"), cache_size=1024,
+                    pin_iterations=PIN_ITERATIONS)
+        with bank:
+            ibans = bank.create_accounts([("Bench", 1234)] * operations)
+            for workers in (1, 4, 16):
+                async_atm = AsyncATM(ATM(bank), max_workers=workers)
+                start = perf_counter()
+                asyncio.run(run(async_atm, ibans))
+                seconds = perf_counter() - start
+                async_atm.close()
+                report(f"sessions, {workers} executor workers", operations,
+                       seconds)
+
+
+def bench_transfer(operations: int = 2000):
+    """Compare the original transfer sequence with Bank.transfer_to.
+
+    The original sequence validates the user, looks up the destination in
+    the other bank, withdraws, then deposits into the destination, each
+    with its own read. Only the reads made by the transfer itself are
+    counted, not those fetching the user before it.
+
+    Args:
+        operations (int, optional): The number of transfers per run.
+    """
+    with temporary_directory():
+        source_bank = Bank("source", "Source Bank",
+                           pin_iterations=PIN_ITERATIONS)
+        target_bank = Bank("target", "Target Bank",
+                           pin_iterations=PIN_ITERATIONS)
+
+        def reads():
+            return source_bank.stats["reads"] + target_bank.stats["reads"]
+
+        with source_bank, target_bank:
+            source = source_bank.create_account("Source", 1234)
+            target = target_bank.create_account("Target", 1234)
+            source_bank.transfer(source, 2 * operations)
+            for label in ("original sequence", "transfer_to"):
+                seconds = 0.0
+                transfer_reads = 0
+                for _ in range(operations):
+                    user = source_bank.get_account(source)
+                    before = reads()
+                    start = perf_counter()
+                    if label == "transfer_to":
+                        source_bank.transfer_to(user, 1, target_bank, target)
+                    else:
+                        if not source_bank.valid_user(user):
+                            raise BankError("User data has been tampered "
+                                            "with")
+                        destination = target_bank.get_account(target)
+                        source_bank.withdraw(user, 1)
+                        target_bank.deposit(destination, 1)
+                    seconds += perf_counter() - start
+                    transfer_reads += reads() - before
+                report(label, operations, seconds,
+                       reads_per_transfer=transfer_reads / operations)
+
+
+def bench_encoding(operations: int = 100000):
+    """Compare the compact account encoding with a pickle round trip.
+
+    Args:
+        operations (int, optional): The number of round trips per format.
+    """
+    account = Account(12345678, "Benchmark User", 1234,
+                      iterations=PIN_ITERATIONS)
+    account.deposit(100)
+    formats = (("pickle", pickle.dumps, pickle.loads),
+               ("compact", Account.to_bytes, Account.from_bytes))
+    for label, encode, decode in formats:
+        start = perf_counter()
+        for _ in range(operations):
+            decode(encode(account))
+        report(f"{label} round trip", operations, perf_counter() - start,
+               bytes=len(encode(account)))
+
+
+def bench_money(operations: int = 1000000):
+    """Add up 0.10 deposits as floats, Decimals and integer cents.
+
+    Args:
+        operations (int, optional): The number of deposits to add up.
+    """
+    expected = Decimal(operations) / 10
+    amounts = (("float", 0.0, 0.1, float),
+               ("Decimal", Decimal(0), Decimal("0.1"), Decimal),
+               ("integer cents", 0, to_cents(0.1), to_euros))
+    for label, balance, amount, to_total in amounts:
+        start = perf_counter()
+        for _ in range(operations):
+            balance += amount
+        seconds = perf_counter() - start
+        exact = Decimal(str(to_total(balance))) == expected
+        report(label, operations, seconds, exact=exact)
+
+
+def bench_pins(operations: int = 20):
+    """Time logins at several PIN hash costs, with and without the cache.
+
+    Args:
+        operations (int, optional): The number of logins per cost.
+    """
+    with temporary_directory():
+        for iterations in (10000, ITERATIONS, 4 * ITERATIONS):
+            for label, pin_cache_size in (("uncached", 0), ("cached", 16)):
+                bank = Bank(f"pins_{iterations}_{pin_cache_size}",
+                            "Benchmark Bank", pin_iterations=iterations,
+                            pin_cache_size=pin_cache_size)
+                with bank:
+                    iban = bank.create_account("Bench", 1234)
+                    bank.login(iban, 1234)
+                    start = perf_counter()
+                    for _ in range(operations):
+                        bank.login(iban, 1234)
+                    seconds = perf_counter() - start
+                report(f"{iterations} iterations, {label}", operations,
+                       seconds, ms_per_login=seconds / operations * 1000)
+
+
+def bench_sessions(operations: int = 2000):
+    """Compare operations given an Account with operations given a session.
+
+    An Account goes stale after every change to the account, so the user
+    has to log in again before the next operation.
+
+    Args:
+        operations (int, optional): The number of deposits per run.
+    """
+    with temporary_directory():
+        bank = Bank("bench", "Benchmark Bank", pin_iterations=PIN_ITERATIONS)
+        with bank:
+            iban = bank.create_account("Bench", 1234)
+            for label in ("account, log in again", "session"):
+                before = bank.stats["reads"]
+                start = perf_counter()
+                if label == "session":
+                    session = bank.start_session(iban, 1234)
+                    for _ in range(operations):
+                        bank.deposit(session, 1)
+                        bank.check_admin(session)
+                    bank.end_session(session)
+                else:
+                    for _ in range(operations):
+                        user = bank.login(iban, 1234)
+                        bank.deposit(user, 1)
+                        bank.check_admin(bank.login(iban, 1234))
+                seconds = perf_counter() - start
+                reads = bank.stats["reads"] - before
+                report(label, operations, seconds,
+                       reads_per_op=reads / operations)
+
+
+def bench_journal(operations: int = 100000):
+    """Time group-committed deposits into a journal, then replay on startup.
+
+    Args:
+        operations (int, optional): The number of deposits.
+    """
+    with temporary_directory():
+        for sync_every in (1, 100, 1000):
+            path = f"journal_{sync_every}"
+            storage = JournalStorage(path, sync_every)
+            bank = Bank(path, "Benchmark Bank", storage=storage,
+                        pin_iterations=PIN_ITERATIONS)
+            with bank:
+                ibans = bank.create_accounts([("Bench", 1234)] * 1000)
+                start = perf_counter()
+                for number in range(operations):
+                    bank.transfer(ibans[number % len(ibans)], 1)
+                seconds = perf_counter() - start
+            report(f"deposits, fsync every {sync_every}", operations,
+                   seconds, fsyncs=operations // sync_every)
+            start = perf_counter()
+            with JournalStorage(path) as replayed:
+                accounts = len(replayed.ibans())
+            report(f"startup replay, fsync every {sync_every}", accounts,
+                   perf_counter() - start,
+                   journal_bytes=os.path.getsize(path + ".journal"))
+
+
+def bench_history(operations: int = 10000000, memory_rows: int = 1000000,
+                  statements: int = 1000):
+    """Time recording transactions and reading mini-statements back.
+
+    The transactions are spread over 10000 accounts. The in-memory history
+    holds at most memory_rows of them.
+
+    Args:
+        operations (int, optional): The number of transactions to record.
+        memory_rows (int, optional): The most the in-memory history holds.
+        statements (int, optional): The number of statements to read.
+    """
+    accounts = 10000
+
+    def transactions(first, count):
+        for number in range(first, first + count):
+            iban = 10000000 + number % accounts
+            yield Transaction(iban, float(number), "deposit", 100,
+                              100 * (number // accounts + 1))
+
+    with temporary_directory():
+        histories = (("sqlite", SQLiteHistory("history.db"), operations),
+                     ("memory", MemoryHistory(),
+                      min(operations, memory_rows)))
+        for label, history, rows in histories:
+            chunk = 100000
+            start = perf_counter()
+            for offset in range(0, rows, chunk):
+                history.record_many(
+                    transactions(offset, min(chunk, rows - offset)))
+            report(f"{label} record", rows, perf_counter() - start)
+            start = perf_counter()
+            for number in range(statements):
+                history.statement(10000000 + number * 7 % accounts)
+            seconds = perf_counter() - start
+            report(f"{label} statement", statements, seconds, rows=rows,
+                   ms_per_statement=seconds / statements * 1000)
+            history.close()
+
+
+def bench_metrics(operations: int = 20000):
+    """Compare deposits and withdrawals with metrics disabled and enabled.
+
+    Args:
+        operations (int, optional): Deposit/withdraw pairs per run.
+    """
+    with temporary_directory():
+        for label, metrics in (("metrics disabled", None),
+                               ("metrics enabled", Metrics())):
+            bank = Bank(label.replace(" ", "_"), "Benchmark Bank",
+                        storage=JournalStorage(label.replace(" ", "_")),
+                        cache_size=16, pin_iterations=PIN_ITERATIONS,
+                        metrics=metrics)
+            atm = ATM(bank, metrics=metrics)
+            with bank:
+                iban = bank.create_account("Bench", 1234)
+                start = perf_counter()
+                _withdraw_session(atm, iban, 1234, operations)
+                seconds = perf_counter() - start
+            report(label, operations * 2, seconds)
+
+
+def bench_cassette(operations: int = 100000):
+    """Time checking and dispensing amounts from a loaded cassette.
+
+    Checks are answered from the cached table of reachable amounts. Each
+    dispense changes the counts, so the next one rebuilds the table first.
+
+    Args:
+        operations (int, optional): The number of checks and dispenses.
+    """
+    random_source = random.Random(0)
+    amounts = [random_source.randrange(1, 200) * 500
+               for _ in range(operations)]
+    cassette = Cassette({5000: 2000, 2000: 3, 1000: 1, 500: 0})
+    start = perf_counter()
+    reachable = sum(map(cassette.can_dispense, amounts))
+    report("can_dispense", operations, perf_counter() - start,
+           reachable=reachable)
+    start = perf_counter()
+    for amount in amounts:
+        if cassette.can_dispense(amount):
+            cassette.restore(cassette.dispense(amount))
+    report("dispense and restore", operations, perf_counter() - start)
+
+
+def bench_shards(operations: int = 2000, threads: int = 8):
+    """Run transfers from several threads against 1, 2, 4 and 8 shards.
+
+    Each shard is a journal synced on every write, so a write waits for its
+    fsync while holding only its own shard.
+
+    Args:
+        operations (int, optional): The total transfers per run.
+        threads (int, optional): The threads making transfers.
+    """
+    with temporary_directory():
+        for shard_count in (1, 2, 4, 8):
+            storage = ShardedStorage(
+                [JournalStorage(f"shards_{shard_count}.{number}",
+                                sync_every=1)
+                 for number in range(shard_count)])
+            bank = Bank(f"shards_{shard_count}", "Benchmark Bank",
+                        storage=storage, pin_iterations=PIN_ITERATIONS)
+            with bank:
+                ibans = bank.create_accounts([("Bench", 1234)] * 64)
+                per_thread = operations // threads
+
+                def work(offset):
+                    for number in range(per_thread):
+                        bank.transfer(ibans[(offset + number) % len(ibans)], 1)
+
+                workers = [threading.Thread(target=work, args=(offset * 8,))
+                           for offset in range(threads)]
+                start = perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                seconds = perf_counter() - start
+            report(f"{shard_count} shards", per_thread * threads, seconds)
+
+
+def _replica_reads(path: str, ibans: list, operations: int) -> float:
+    """Check balances on a replica of a snapshot, returning the seconds."""
+    bank = Bank("replica", "Benchmark Bank",
+                storage=ReplicaStorage(path, max_staleness=1.0),
+                pin_iterations=PIN_ITERATIONS)
+    sessions = [bank.start_session(iban, 1234) for iban in ibans]
+    start = perf_counter()
+    for number in range(operations):
+        bank.check_balance(sessions[number % len(sessions)])
+    return perf_counter() - start
+
+
+def bench_replicas(operations: int = 100000):
+    """Check balances on replicas in 1, 2 and 4 processes while writing.
+
+    A thread keeps making transfers on the primary bank, which publishes a
+    snapshot every 0.2 seconds, for as long as the readers run.
+
+    Args:
+        operations (int, optional): The total balance checks per run.
+    """
+    with temporary_directory():
+        bank = Bank("primary", "Benchmark Bank",
+                    storage=JournalStorage("primary", sync_every=100),
+                    pin_iterations=PIN_ITERATIONS)
+        path = os.path.abspath("primary.replica")
+        with bank:
+            ibans = bank.create_accounts([("Bench", 1234)] * 32)
+        with bank, SnapshotPublisher(bank.storage, path, interval=0.2):
+            stopped = threading.Event()
+            writes = [0]
+
+            def write():
+                while not stopped.is_set():
+                    bank.transfer(ibans[writes[0] % len(ibans)], 1)
+                    writes[0] += 1
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            try:
+                for processes in (1, 2, 4):
+                    per_process = operations // processes
+                    jobs = [(path, ibans, per_process)] * processes
+                    written = writes[0]
+                    with Pool(processes) as pool:
+                        seconds = max(pool.starmap(_replica_reads, jobs))
+                    report(f"{processes} reader processes",
+                           per_process * processes, seconds,
+                           writes=writes[0] - written)
+            finally:
+                stopped.set()
+                writer.join()
+
+
+def bench_mmap(operations: int = 100000,
+               sizes: tuple = (1000000, 10000000)):
+    """Compare point lookups and updates on the dbm and mmap backends.
+
+    Each store is filled with copies of one account under sequential IBANs,
+    so no PINs are hashed, then read and updated at random IBANs.
+
+    Args:
+        operations (int, optional): The lookups and updates per store.
+        sizes (tuple, optional): The numbers of accounts to fill with.
+    """
+    template = Account(0, "Bench", 1234, iterations=PIN_ITERATIONS)
+    _, name, pin, admin, _ = template.to_record()
+    random_source = random.Random(0)
+    with temporary_directory():
+        for size in sizes:
+            ibans = [random_source.randrange(size) + 10000000
+                     for _ in range(operations)]
+            for label, storage in (("dbm", DbmStorage(f"dbm_{size}")),
+                                   ("mmap", MmapStorage(f"mmap_{size}"))):
+                start = perf_counter()
+                with storage.batch():
+                    for iban in range(10000000, 10000000 + size):
+                        storage.put(Account.from_record(
+                            (iban, name, pin, admin, 0)))
+                report(f"{label} {size} fill", size, perf_counter() - start)
+                with storage:
+                    start = perf_counter()
+                    for iban in ibans:
+                        storage.get(iban)
+                    report(f"{label} {size} lookups", operations,
+                           perf_counter() - start)
+                    start = perf_counter()
+                    for iban in ibans:
+                        account = storage.get(iban)
+                        account.deposit(1)
+                        storage.put(account)
+                    report(f"{label} {size} updates", operations,
+                           perf_counter() - start)
+                    if isinstance(storage, MmapStorage):
+                        start = perf_counter()
+                        for iban in ibans:
+                            storage.balance_of(iban)
+                        report(f"{label} {size} balance_of", operations,
+                               perf_counter() - start)
+
+
+def bench_report(operations: int = 10000000, chunk_size: int = 65536):
+    """Time an end-of-day report over a bank of memory-mapped accounts.
+
+    The report is made with NumPy, if it is installed, and in plain Python.
+
+    Args:
+        operations (int, optional): The number of accounts in the bank.
+        chunk_size (int, optional): The accounts read at a time.
+    """
+    template = Account(0, "Bench", 1234, iterations=PIN_ITERATIONS)
+    _, name, pin, _, _ = template.to_record()
+    random_source = random.Random(0)
+    with temporary_directory():
+        storage = MmapStorage("report", capacity=operations)
+        with storage.batch():
+            for iban in range(10000000, 10000000 + operations):
+                storage.put(Account.from_record(
+                    (iban, name, pin, iban % 1000 == 0,
+                     random_source.randrange(10000000))))
+        modes = [False] if reports.numpy is None else [True, False]
+        for vectorised in modes:
+            start = perf_counter()
+            with storage.session():
+                summary = reports.summarise(storage.columns(chunk_size),
+                                            vectorised=vectorised)
+            report("NumPy" if vectorised else "plain Python", operations,
+                   perf_counter() - start, total=summary.total)
+
+
+def bench_remote(operations: int = 20000, threads: int = 8):
+    """Compare balance checks in process and on a local BankServer.
+
+    Over TCP and a Unix socket, calls are made one at a time, pipelined
+    from one thread, and from several threads sharing a connection pool.
+
+    Args:
+        operations (int, optional): The balance checks per run.
+        threads (int, optional): The threads making calls at once.
+    """
+    with temporary_directory() as directory:
+        bank = Bank("remote", "Benchmark Bank", pin_iterations=PIN_ITERATIONS)
+        iban = bank.create_account("Bench", 1234)
+        with bank:
+            session = bank.start_session(iban, 1234)
+            start = perf_counter()
+            for _ in range(operations):
+                bank.check_balance(session)
+            report("in process", operations, perf_counter() - start)
+            addresses = [("TCP", ("127.0.0.1", 0)),
+                         ("Unix", os.path.join(directory, "bank.sock"))]
+            for transport, address in addresses:
+                with BankServer(bank, address) as server, \
+                        RemoteBank(server.address, pool_size=4) as remote:
+                    start = perf_counter()
+                    for _ in range(operations):
+                        remote.check_balance(session)
+                    report(f"{transport} one at a time", operations,
+                           perf_counter() - start)
+                    start = perf_counter()
+                    futures = [remote.submit("check_balance", session)
+                               for _ in range(operations)]
+                    for future in futures:
+                        future.result()
+                    report(f"{transport} pipelined", operations,
+                           perf_counter() - start)
+
+                    def check(count):
+                        for _ in range(count):
+                            remote.check_balance(session)
+
+                    workers = [threading.Thread(target=check,
+                                                args=(operations // threads,))
+                               for _ in range(threads)]
+                    start = perf_counter()
+                    for worker in workers:
+                        worker.start()
+                    for worker in workers:
+                        worker.join()
+                    report(f"{transport} {threads} threads",
+                           operations // threads * threads,
+                           perf_counter() - start)
+
+
+def bench_coalesce(operations: int = 20000, threads: int = 16):
+    """Check balances of a few hot accounts from many threads at once.
+
+    Runs with and without coalesced reads, on the default dbm storage, and
+    counts the reads that reach it.
+
+    Args:
+        operations (int, optional): The total balance checks per run.
+        threads (int, optional): The threads checking balances at once.
+    """
+    with temporary_directory():
+        for coalesce in (False, True):
+            bank = Bank(f"coalesce_{coalesce}", "Benchmark Bank",
+                        pin_iterations=PIN_ITERATIONS,
+                        coalesce_reads=coalesce)
+            ibans = bank.create_accounts([("Bench", 1234)] * 4)
+            with bank:
+                sessions = [bank.start_session(iban, 1234) for iban in ibans]
+                per_thread = operations // threads
+                reads = bank.stats["reads"]
+
+                def work(offset):
+                    for number in range(per_thread):
+                        bank.check_balance(
+                            sessions[(offset + number) % len(sessions)])
+
+                workers = [threading.Thread(target=work, args=(offset,))
+                           for offset in range(threads)]
+                start = perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                seconds = perf_counter() - start
+                fraction = bank.coalescing_stats.get("fraction", 0.0)
+                report("coalesced" if coalesce else "not coalesced",
+                       per_thread * threads, seconds,
+                       reads=bank.stats["reads"] - reads,
+                       coalesced=f"{fraction:.0%}")
+
+
+BENCHMARKS = {
+    "open-count": bench_open_count,
+    "cache": bench_cache,
+    "storage": bench_storage,
+    "batch": bench_batch,
+    "create": bench_create,
+    "bulk": bench_bulk,
+    "threads": bench_threads,
+    "async": bench_async,
+    "transfer": bench_transfer,
+    "encoding": bench_encoding,
+    "money": bench_money,
+    "pins": bench_pins,
+    "sessions": bench_sessions,
+    "journal": bench_journal,
+    "history": bench_history,
+    "metrics": bench_metrics,
+    "cassette": bench_cassette,
+    "shards": bench_shards,
+    "replicas": bench_replicas,
+    "mmap": bench_mmap,
+    "report": bench_report,
+    "remote": bench_remote,
+    "coalesce": bench_coalesce,
+}
+
+
+def main():
+    """Parse the command line and run the chosen benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"Benchmarks to run: {', '.join(BENCHMARKS)} "
+                             "(default: all).")
+    parser.add_argument("-n", "--operations", type=int,
+                        help="Override the default operation count.")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}")
+        if args.operations is None:
+            BENCHMARKS[name]()
+        else:
+            BENCHMARKS[name](args.operations)
+
+
+if __name__ == "__main__":
+    main()
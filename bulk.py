@@ -0,0 +1,183 @@
+"""Streaming import and export of bank accounts as CSV or JSON Lines files.
+
+Files are read and written one row at a time and accounts are written to the
+bank in fixed-size chunks, so memory use does not grow with the file size.
+The format is chosen from the file extension: `.csv` or `.jsonl`. Balances
+are written in euros and records hold them in cents. Exports hold the text
+form of each PIN hash; imports take either that or a plain PIN.
+"""
+
+import csv
+import json
+from contextlib import ExitStack
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from multiprocessing import Pool
+from time import perf_counter
+
+from bank import Bank
+from money import to_cents, to_euros
+from pins import is_encoded
+
+FIELDS = ("iban", "name", "pin", "admin", "balance")
+
+
+def read_records(path: str):
+    """Read account records from a CSV or JSON Lines file.
+
+    Args:
+        path (str): The file to read.
+
+    Raises:
+        ValueError: If the file extension or a row isn't valid.
+
+    Yields:
+        tuple: (iban, name, pin, admin, balance) for each row, with the
+            balance in cents. The IBAN is None if the row doesn't have one.
+    """
+    file_format = _format(path)
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for line_number, row in enumerate(rows, 1):
+            try:
+                yield _to_record(row)
+            except (KeyError, TypeError, ValueError) as error:
+                raise ValueError(f"{path}: invalid row {line_number}: "
+                                 f"{error}") from error
+
+
+def write_records(path: str, records):
+    """Write account records to a CSV or JSON Lines file.
+
+    Args:
+        path (str): The file to write.
+        records (iterable): (iban, name, pin, admin, balance) tuples.
+
+    Raises:
+        ValueError: If the file extension isn't valid.
+
+    Yields:
+        tuple: Each record after it has been written, so the caller can
+            count progress while the file is streamed.
+    """
+    file_format = _format(path)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            writer = csv.writer(file)
+            writer.writerow(FIELDS)
+            for record in records:
+                iban, name, pin, admin, balance = record
+                writer.writerow((iban, name, pin, int(admin),
+                                 to_euros(balance)))
+                yield record
+        else:
+            for record in records:
+                row = dict(zip(FIELDS, record))
+                row["balance"] = to_euros(row["balance"])
+                file.write(json.dumps(row) + "\n")
+                yield record
+
+
+def import_file(bank: Bank, path: str, chunk_size: int = 10000,
+                progress=None, processes: int = 1) -> dict:
+    """Stream the accounts in a file into a bank.
+
+    Plain PINs are hashed at the bank's full cost, which bounds the speed
+    of an import that has them; see `Bank.import_accounts()`.
+
+    Args:
+        bank (Bank): The bank to import into.
+        path (str): The CSV or JSON Lines file to read.
+        chunk_size (int, optional): Accounts written per storage batch.
+            Defaults to 10000.
+        progress (callable, optional): Called with the number of rows done
+            and the seconds elapsed after each chunk.
+        processes (int, optional): Hash plain PINs in this many worker
+            processes. Defaults to 1, to hash them in this process.
+
+    Raises:
+        ValueError: If the chunk size or processes isn't greater than 0, or
+            the file isn't valid.
+
+    Returns:
+        dict: The rows imported, seconds taken and rows per second.
+    """
+    if chunk_size <= 0:
+        raise ValueError("Chunk size must be greater than 0")
+    if processes <= 0:
+        raise ValueError("processes must be greater than 0")
+    records = read_records(path)
+    rows = 0
+    start = perf_counter()
+    with ExitStack() as stack:
+        pool = stack.enter_context(Pool(processes)) if processes > 1 \
+            else None
+        chunk = list(islice(records, chunk_size))
+        while chunk:
+            rows += bank.import_accounts(chunk, pool)
+            if progress is not None:
+                progress(rows, perf_counter() - start)
+            chunk = list(islice(records, chunk_size))
+    return _summary(rows, perf_counter() - start)
+
+
+def export_file(bank: Bank, path: str, progress=None,
+                progress_every: int = 10000) -> dict:
+    """Stream every account in a bank out to a file.
+
+    Args:
+        bank (Bank): The bank to export.
+        path (str): The CSV or JSON Lines file to write.
+        progress (callable, optional): Called with the number of rows done
+            and the seconds elapsed every progress_every rows.
+        progress_every (int, optional): Rows between progress calls.
+            Defaults to 10000.
+
+    Returns:
+        dict: The rows exported, seconds taken and rows per second.
+    """
+    rows = 0
+    start = perf_counter()
+    for _ in write_records(path, bank.export_accounts()):
+        rows += 1
+        if progress is not None and rows % progress_every == 0:
+            progress(rows, perf_counter() - start)
+    return _summary(rows, perf_counter() - start)
+
+
+def _format(path: str) -> str:
+    """Get the file format from the extension of the path."""
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith(".jsonl"):
+        return "jsonl"
+    raise ValueError("File must be .csv or .jsonl")
+
+
+def _to_record(row: dict) -> tuple:
+    """Convert a row read from a file into an account record."""
+    iban = row.get("iban")
+    iban = int(iban) if iban not in (None, "") else None
+    admin = row.get("admin", False)
+    if isinstance(admin, str):
+        admin = admin.strip().lower() in ("1", "true", "yes")
+    pin = row["pin"]
+    if not is_encoded(pin):
+        pin = int(pin)
+    balance = row.get("balance") or 0
+    if isinstance(balance, str):
+        try:
+            balance = Decimal(balance)
+        except InvalidOperation as error:
+            raise ValueError(f"invalid balance {balance!r}") from error
+    return (iban, str(row["name"]), pin, bool(admin),
+            int(to_cents(balance)))
+
+
+def _summary(rows: int, seconds: float) -> dict:
+    """Build the result of an import or export."""
+    rate = rows / seconds if seconds else 0.0
+    return {"rows": rows, "seconds": seconds, "rows_per_second": rate}
@@ -0,0 +1,102 @@
+"""A bounded least-recently-used cache of accounts for a bank."""
+
+import threading
+from collections import OrderedDict
+from copy import copy
+
+from account import Account
+
+
+class AccountCache:
+    """An LRU cache of decoded accounts keyed by IBAN.
+
+    IBANs are normalised with `str()` the same way the account database keys
+    them, so a lookup with "12345678" finds the account cached as 12345678.
+
+    The cache hands out and stores copies, so callers can never change a
+    cached account by mutating an object they were given. It is safe to use
+    from several threads.
+    """
+
+    def __init__(self, capacity: int):
+        """Create a new, empty cache.
+
+        Args:
+            capacity (int): The maximum number of accounts to hold.
+
+        Raises:
+            ValueError: If the capacity is not greater than 0.
+        """
+        if capacity <= 0:
+            raise ValueError("Capacity must be greater than 0")
+        self._capacity = capacity
+        self._accounts = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of accounts currently cached."""
+        return len(self._accounts)
+
+    def __contains__(self, iban: int) -> bool:
+        """Return whether the account is cached, without counting a lookup."""
+        return str(iban) in self._accounts
+
+    @property
+    def capacity(self) -> int:
+        """Get the maximum number of accounts the cache holds."""
+        return self._capacity
+
+    @property
+    def stats(self) -> dict:
+        """Get a copy of the hit, miss and eviction counters."""
+        with self._lock:
+            return dict(self._stats)
+
+    def get(self, iban: int) -> Account:
+        """Get a copy of a cached account and mark it as recently used.
+
+        Args:
+            iban (int): The IBAN of the account.
+
+        Returns:
+            Account: A copy of the cached account, or None on a miss.
+        """
+        key = str(iban)
+        with self._lock:
+            account = self._accounts.get(key)
+            if account is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._accounts.move_to_end(key)
+        return copy(account)
+
+    def put(self, account: Account):
+        """Cache a copy of the account, evicting the oldest if full.
+
+        Args:
+            account (Account): The account to cache.
+        """
+        key = str(account.iban)
+        account = copy(account)
+        with self._lock:
+            self._accounts[key] = account
+            self._accounts.move_to_end(key)
+            if len(self._accounts) > self._capacity:
+                self._accounts.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def discard(self, iban: int):
+        """Remove an account from the cache if it is present.
+
+        Args:
+            iban (int): The IBAN of the account to remove.
+        """
+        with self._lock:
+            self._accounts.pop(str(iban), None)
+
+    def clear(self):
+        """Remove every account from the cache."""
+        with self._lock:
+            self._accounts.clear()
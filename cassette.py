@@ -0,0 +1,342 @@
+"""The cash cassettes of an ATM, counted by denomination.
+
+A Cassette knows how many notes of each denomination it holds and which
+amounts it can pay out with them. The amounts it can reach are worked out
+once per change to the counts, as a bounded knapsack over the
+denominations, and kept as one bit per amount. A request is then rejected
+or planned with a few table lookups, however much cash is loaded.
+
+Amounts and denominations are in cents.
+"""
+
+import threading
+from functools import reduce
+from math import exp, gcd, inf
+from time import monotonic
+
+from exceptions import AtmError
+
+# Euro notes, in cents.
+DENOMINATIONS = (500, 1000, 2000, 5000)
+
+
+class Cassette:
+    """The notes held by an ATM, with a cached table of reachable amounts.
+
+    Amounts up to `cache_limit` are answered from tables rebuilt lazily after
+    the counts change. Larger amounts, such as an admin emptying the ATM,
+    are planned on demand. Cash deposited that can't be made up of the
+    denominations, such as coins, goes to a deposit bin: it counts towards
+    the total but is never paid out.
+
+    Dispensing is tracked as a decaying rate per denomination, which gives
+    a forecast of when each one will run out. It is safe to use from several
+    threads.
+    """
+
+    def __init__(self, notes: dict = None, denominations=DENOMINATIONS,
+                 cache_limit: int = 100000, rate_window: float = 3600.0):
+        """Create a cassette.
+
+        Args:
+            notes (dict, optional): The count of each denomination loaded.
+                Defaults to None, for an empty cassette.
+            denominations (iterable, optional): The denominations it holds,
+                in cents. Defaults to DENOMINATIONS.
+            cache_limit (int, optional): The largest amount, in cents, kept
+                in the table of reachable amounts. Defaults to 100000.
+            rate_window (float, optional): Seconds over which the dispense
+                rate is averaged for forecasts. Defaults to 3600.
+
+        Raises:
+            ValueError: If a denomination isn't a whole number of cents
+                greater than 0, or cache_limit or rate_window isn't greater
+                than 0.
+        """
+        denominations = tuple(sorted(set(denominations), reverse=True))
+        if not denominations or any(
+                not isinstance(denomination, int) or denomination <= 0
+                for denomination in denominations):
+            raise ValueError("Denominations must be whole cents above 0")
+        if cache_limit <= 0:
+            raise ValueError("cache_limit must be greater than 0")
+        if rate_window <= 0:
+            raise ValueError("rate_window must be greater than 0")
+        self._denominations = denominations
+        self._unit = reduce(gcd, denominations)
+        self._limit = cache_limit // self._unit
+        self._counts = dict.fromkeys(denominations, 0)
+        self._binned = 0
+        self._tables = None
+        self._rate_window = rate_window
+        self._rates = dict.fromkeys(denominations, 0.0)
+        self._rates_at = monotonic()
+        self._lock = threading.Lock()
+        if notes:
+            self.load(notes)
+
+    @classmethod
+    def from_amount(cls, amount: int, denominations=DENOMINATIONS,
+                    **kwargs) -> "Cassette":
+        """Create a cassette holding an amount spread across denominations.
+
+        Each denomination gets an equal share of the value, so small and
+        large withdrawals can both be paid. What is left is made up with
+        the largest notes that fit, and anything below the smallest note
+        goes to the deposit bin.
+
+        Args:
+            amount (int): The amount to load, in cents.
+            denominations (iterable, optional): The denominations it holds.
+                Defaults to DENOMINATIONS.
+            **kwargs: Passed on to the constructor.
+
+        Returns:
+            Cassette: The loaded cassette.
+        """
+        cassette = cls(denominations=denominations, **kwargs)
+        share = amount // len(cassette._denominations)
+        notes = {denomination: share // denomination
+                 for denomination in cassette._denominations}
+        remainder = amount - sum(denomination * count
+                                 for denomination, count in notes.items())
+        with cassette._lock:
+            cassette._add(notes)
+            cassette._add(cassette._split(remainder))
+        return cassette
+
+    @property
+    def denominations(self) -> tuple:
+        """Get the denominations held, largest first."""
+        return self._denominations
+
+    @property
+    def total(self) -> int:
+        """Get the cash held, including the deposit bin, in cents."""
+        with self._lock:
+            return self._binned + sum(denomination * count for denomination,
+                                      count in self._counts.items())
+
+    @property
+    def binned(self) -> int:
+        """Get the cash in the deposit bin, in cents."""
+        return self._binned
+
+    def counts(self) -> dict:
+        """Get the count of each denomination held.
+
+        Returns:
+            dict: A copy of the counts, keyed by denomination.
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def can_dispense(self, amount: int) -> bool:
+        """Return whether an amount can be paid out with the notes held.
+
+        Args:
+            amount (int): The amount, in cents.
+
+        Returns:
+            bool: True if the amount is reachable, otherwise False.
+        """
+        with self._lock:
+            return self._plan(amount) is not None
+
+    def dispense(self, amount: int) -> dict:
+        """Pay out an amount, preferring the largest notes.
+
+        Args:
+            amount (int): The amount, in cents.
+
+        Raises:
+            AtmError: If there isn't enough cash, or the amount can't be
+                made up of the notes held.
+
+        Returns:
+            dict: The count of each denomination paid out.
+        """
+        with self._lock:
+            notes = self._plan(amount)
+            if notes is None:
+                if amount > self._held():
+                    raise AtmError("ATM does not have enough funds")
+                raise AtmError("ATM can't dispense that amount")
+            self._decay_rates()
+            for denomination, count in notes.items():
+                self._counts[denomination] -= count
+                self._rates[denomination] += count / self._rate_window
+            self._tables = None
+            return notes
+
+    def deposit(self, amount: int) -> dict:
+        """Take in cash, as the fewest notes, with the rest in the bin.
+
+        Args:
+            amount (int): The amount, in cents.
+
+        Returns:
+            dict: The count of each denomination added.
+        """
+        with self._lock:
+            notes = self._split(amount)
+            self._add(notes)
+            return notes
+
+    def load(self, notes: dict):
+        """Add notes to the cassette.
+
+        Args:
+            notes (dict): The count of each denomination to add.
+
+        Raises:
+            ValueError: If a denomination isn't held by the cassette, or a
+                count is less than 0.
+        """
+        for denomination, count in notes.items():
+            if denomination not in self._counts:
+                raise ValueError(f"Unknown denomination: {denomination}")
+            if count < 0:
+                raise ValueError("Counts can't be less than 0")
+        with self._lock:
+            self._add(notes)
+
+    def restore(self, notes: dict):
+        """Put back notes from a dispense that wasn't completed.
+
+        Args:
+            notes (dict): The notes returned by `dispense()`.
+        """
+        with self._lock:
+            self._add(notes)
+            for denomination, count in notes.items():
+                self._rates[denomination] = max(
+                    0.0, self._rates[denomination] - count / self._rate_window)
+
+    def collect_bin(self) -> int:
+        """Empty the deposit bin.
+
+        Returns:
+            int: The cash that was in the bin, in cents.
+        """
+        with self._lock:
+            binned, self._binned = self._binned, 0
+            return binned
+
+    def forecast(self, horizon: float = None) -> dict:
+        """Estimate when each denomination will run out.
+
+        Args:
+            horizon (float, optional): Only include denominations expected
+                to run out within this many seconds. Defaults to None, for
+                every denomination.
+
+        Returns:
+            dict: The seconds until each denomination runs out at the
+                recent dispense rate, or infinity if it isn't being used.
+        """
+        with self._lock:
+            self._decay_rates()
+            forecast = {}
+            for denomination, count in self._counts.items():
+                rate = self._rates[denomination]
+                seconds = count / rate if rate > 0 else \
+                    (0.0 if count == 0 else inf)
+                if horizon is None or seconds <= horizon:
+                    forecast[denomination] = seconds
+            return forecast
+
+    def _add(self, notes: dict):
+        """Add notes to the counts, while holding the lock."""
+        for denomination, count in notes.items():
+            if count:
+                self._counts[denomination] += count
+                self._tables = None
+
+    def _held(self) -> int:
+        """Get the cash that can be paid out, while holding the lock."""
+        return sum(denomination * count
+                   for denomination, count in self._counts.items())
+
+    def _split(self, amount: int) -> dict:
+        """Make up an amount with the fewest notes, binning the rest."""
+        notes = {}
+        for denomination in self._denominations:
+            count, amount = divmod(amount, denomination)
+            if count:
+                notes[denomination] = count
+        self._binned += amount
+        return notes
+
+    def _plan(self, amount: int) -> dict:
+        """Choose the notes for an amount, while holding the lock.
+
+        The largest denomination goes first, and takes as many notes as it
+        can while the rest is still reachable with the smaller ones.
+
+        Amounts that aren't a multiple of the notes, or are more than the
+        cash held, are rejected before any table is built.
+
+        Returns:
+            dict: The count of each denomination, or None if the amount
+                can't be paid.
+        """
+        if amount <= 0 or amount % self._unit or \
+                amount > self._held():
+            return None
+        units = amount // self._unit
+        if units <= self._limit:
+            if self._tables is None:
+                self._tables = self._build_tables(self._limit)
+            tables = self._tables
+        else:
+            tables = self._build_tables(units)
+        if not _reachable(tables[0], units):
+            return None
+        notes = {}
+        for index, denomination in enumerate(self._denominations):
+            step = denomination // self._unit
+            count = min(self._counts[denomination], units // step)
+            while not _reachable(tables[index + 1], units - count * step):
+                count -= 1
+            if count:
+                notes[denomination] = count
+                units -= count * step
+        return notes
+
+    def _build_tables(self, limit: int) -> list:
+        """Work out the reachable amounts, up to a limit in units.
+
+        Table i has bit n set if n units can be made up of the notes of the
+        denominations from index i on. Each count is added as chunks of 1,
+        2, 4, ... notes, which together reach every count up to it.
+        """
+        mask = (1 << (limit + 1)) - 1
+        size = limit // 8 + 1
+        bits = 1
+        tables = [bits.to_bytes(size, "little")]
+        for denomination in reversed(self._denominations):
+            step = denomination // self._unit
+            count = min(self._counts[denomination], limit // step)
+            chunk = 1
+            while count > 0:
+                taken = min(chunk, count)
+                bits = (bits | bits << taken * step) & mask
+                count -= taken
+                chunk *= 2
+            tables.append(bits.to_bytes(size, "little"))
+        tables.reverse()
+        return tables
+
+    def _decay_rates(self):
+        """Decay the dispense rates to now, while holding the lock."""
+        now = monotonic()
+        decay = exp((self._rates_at - now) / self._rate_window)
+        for denomination in self._rates:
+            self._rates[denomination] *= decay
+        self._rates_at = now
+
+
+def _reachable(table: bytes, units: int) -> bool:
+    """Look up whether a table has an amount, in units, set."""
+    return bool(table[units >> 3] >> (units & 7) & 1)
@@ -0,0 +1,177 @@
+"""Per-account transaction history for mini-statements.
+
+Every change a bank makes to a balance is recorded as a Transaction. A
+statement is read through an index on (iban, timestamp), so the time it
+takes depends on the number of transactions returned, not on how many are
+stored.
+"""
+
+import sqlite3
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+
+Transaction = namedtuple("Transaction",
+                         ["iban", "timestamp", "kind", "amount", "balance"])
+Transaction.__doc__ = """One change to the balance of an account.
+
+The timestamp is in seconds since the epoch. The kind is "deposit",
+"withdraw", "transfer in", "transfer out" or "reversal". The amount and the
+balance after the change are in cents.
+"""
+
+
+class History:
+    """Base class for a store of transactions, indexed by IBAN and time.
+
+    Backends implement `record_many()` and `statement()`. Each account's
+    transactions must be recorded in time order.
+    """
+
+    def record(self, transaction: Transaction):
+        """Store a transaction.
+
+        Args:
+            transaction (Transaction): The transaction to store.
+        """
+        self.record_many((transaction,))
+
+    def record_many(self, transactions):
+        """Store many transactions at once.
+
+        Args:
+            transactions (iterable): The transactions to store.
+        """
+        raise NotImplementedError
+
+    def statement(self, iban: int, since: float = None,
+                  limit: int = 10) -> list:
+        """Get the most recent transactions of an account.
+
+        Args:
+            iban (int): The IBAN of the account.
+            since (float, optional): Only return transactions at or after
+                this time, in seconds since the epoch. Defaults to None,
+                for no limit.
+            limit (int, optional): The most transactions to return.
+                Defaults to 10.
+
+        Returns:
+            list: The transactions, newest first.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release anything held by the store."""
+
+
+class MemoryHistory(History):
+    """Transactions held in memory, in a time-ordered list per account.
+
+    A statement finds its start with a binary search over the account's
+    timestamps. Only the most recent transactions of each account are
+    kept, if a retention is given, and nothing survives a restart. It is
+    safe to use from several threads.
+    """
+
+    def __init__(self, retention: int = None):
+        """Create an empty history.
+
+        Args:
+            retention (int, optional): The most transactions kept per
+                account; older ones are dropped. Defaults to None, to keep
+                every transaction.
+
+        Raises:
+            ValueError: If retention is not greater than 0.
+        """
+        if retention is not None and retention <= 0:
+            raise ValueError("retention must be greater than 0")
+        self._retention = retention
+        self._transactions = {}
+        self._timestamps = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of transactions stored."""
+        return sum(len(entries) for entries in self._transactions.values())
+
+    def record_many(self, transactions):
+        with self._lock:
+            for transaction in transactions:
+                key = str(transaction.iban)
+                entries = self._transactions.setdefault(key, [])
+                timestamps = self._timestamps.setdefault(key, [])
+                if timestamps and transaction.timestamp < timestamps[-1]:
+                    transaction = transaction._replace(
+                        timestamp=timestamps[-1])
+                entries.append(transaction)
+                timestamps.append(transaction.timestamp)
+                if self._retention is not None and \
+                        len(entries) > self._retention:
+                    del entries[0]
+                    del timestamps[0]
+
+    def statement(self, iban: int, since: float = None,
+                  limit: int = 10) -> list:
+        key = str(iban)
+        with self._lock:
+            entries = self._transactions.get(key)
+            if not entries:
+                return []
+            first = max(len(entries) - limit, 0)
+            if since is not None:
+                first = max(first, bisect_left(self._timestamps[key], since))
+            return entries[first:][::-1]
+
+
+class SQLiteHistory(History):
+    """Transactions held in an SQLite table with an (iban, timestamp) index.
+
+    Each call to `record_many()` is committed on its own. It is safe to use
+    from several threads.
+    """
+
+    _CREATE = ("CREATE TABLE IF NOT EXISTS transactions ("
+               "iban INTEGER NOT NULL, timestamp REAL NOT NULL, "
+               "kind TEXT NOT NULL, amount INTEGER NOT NULL, "
+               "balance INTEGER NOT NULL)")
+    _INDEX = ("CREATE INDEX IF NOT EXISTS transactions_by_account "
+              "ON transactions (iban, timestamp)")
+    _INSERT = ("INSERT INTO transactions (iban, timestamp, kind, amount, "
+               "balance) VALUES (?, ?, ?, ?, ?)")
+    _STATEMENT = ("SELECT iban, timestamp, kind, amount, balance "
+                  "FROM transactions WHERE iban = ? AND timestamp >= ? "
+                  "ORDER BY timestamp DESC, rowid DESC LIMIT ?")
+
+    def __init__(self, path: str):
+        """Open, or create, a history database.
+
+        Args:
+            path (str): The filename of the database.
+        """
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(self._CREATE)
+        self._connection.execute(self._INDEX)
+        self._connection.commit()
+        self._lock = threading.Lock()
+
+    def record_many(self, transactions):
+        with self._lock:
+            self._connection.executemany(self._INSERT, transactions)
+            self._connection.commit()
+
+    def statement(self, iban: int, since: float = None,
+                  limit: int = 10) -> list:
+        since = float("-inf") if since is None else since
+        with self._lock:
+            rows = self._connection.execute(self._STATEMENT,
+                                            (iban, since, limit))
+            return [Transaction(*row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
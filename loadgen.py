@@ -0,0 +1,292 @@
+"""A load generator that drives a simulated fleet of banks and ATMs.
+
+Run it with `python3 loadgen.py`, or see `python3 loadgen.py --help` for the
+fleet size, traffic mix and storage backend. Each worker process builds its
+own fleet in a temporary directory, the way `main.setup()` does, and runs its
+share of the operations against it. The throughput and the p50, p95 and p99
+latency of each kind of operation are reported at the end.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import Pool
+from time import perf_counter, perf_counter_ns
+
+from atm import ATM
+from bank import Bank
+from exceptions import AccountError, AtmError, BankError
+from storage import DbmStorage, JournalStorage, MmapStorage, SQLiteStorage
+
+OPERATIONS = ("login", "balance", "withdraw", "deposit", "transfer")
+DEFAULT_MIX = {"login": 10, "balance": 30, "withdraw": 25, "deposit": 25,
+               "transfer": 10}
+STORAGE = {
+    "dbm": lambda path: DbmStorage(path),
+    "sqlite": lambda path: SQLiteStorage(path + ".db"),
+    "journal": lambda path: JournalStorage(path, sync_every=100),
+    "mmap": lambda path: MmapStorage(path),
+}
+
+LoadConfig = namedtuple("LoadConfig", [
+    "operations", "processes", "banks", "atms", "accounts", "mix",
+    "storage", "pin_iterations", "seed"])
+LoadConfig.__doc__ = """The fleet and traffic for a load run.
+
+operations is the total across every process, banks the banks per process,
+atms the ATMs per bank and accounts the accounts per bank. mix maps each
+operation in OPERATIONS to its relative weight.
+"""
+
+
+@contextmanager
+def temporary_directory():
+    """Run the body of a `with` block inside a fresh temporary directory."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+
+def build_fleet(config: LoadConfig, random_source: random.Random) -> list:
+    """Create the banks, accounts and ATMs of one worker's fleet.
+
+    Every ATM is connected to every other bank, so users can transfer to
+    any bank in the fleet.
+
+    Args:
+        config (LoadConfig): The fleet to build.
+        random_source (random.Random): Source of the starting balances.
+
+    Returns:
+        list: A (bank, atms, users) tuple for each bank, where users is a
+            list of (iban, pin) tuples.
+    """
+    fleet = []
+    for number in range(config.banks):
+        bank_id = f"bank{number}"
+        bank = Bank(bank_id, f"Bank {number}",
+                    storage=STORAGE[config.storage](bank_id),
+                    pin_iterations=config.pin_iterations)
+        bank.open()
+        users = [(f"User {index}", 1000 + index % 9000)
+                 for index in range(config.accounts)]
+        ibans = bank.create_accounts(users)
+        for iban in ibans:
+            bank.transfer(iban, random_source.randrange(500, 5000))
+        atms = [ATM(bank, 1000000) for _ in range(config.atms)]
+        fleet.append((bank, atms, [(iban, pin) for iban, (_, pin)
+                                   in zip(ibans, users)]))
+    for _, atms, _ in fleet:
+        for atm in atms:
+            for other, _, _ in fleet:
+                atm.add_connected_bank(other)
+    return fleet
+
+
+def run_worker(config: LoadConfig, worker: int, operations: int) -> tuple:
+    """Run one worker's share of the load against its own fleet.
+
+    Args:
+        config (LoadConfig): The fleet and traffic to run.
+        worker (int): The index of this worker, used to seed its choices.
+        operations (int): The number of operations to run.
+
+    Returns:
+        tuple: The seconds taken to run the operations, not counting
+            building the fleet, and a dict mapping each operation to a
+            (latencies, errors) tuple, with the latencies in nanoseconds.
+    """
+    random_source = random.Random(f"{config.seed}-{worker}")
+    kinds = [kind for kind in OPERATIONS if config.mix.get(kind)]
+    if config.banks < 2 and "transfer" in kinds:
+        kinds.remove("transfer")
+    weights = [config.mix[kind] for kind in kinds]
+    results = {kind: ([], 0) for kind in kinds}
+    with temporary_directory():
+        fleet = build_fleet(config, random_source)
+        sessions = {}
+        choices = random_source.choices(kinds, weights, k=operations)
+        run_start = perf_counter()
+        for kind in choices:
+            bank_index = random_source.randrange(len(fleet))
+            _, atms, users = fleet[bank_index]
+            atm = random_source.choice(atms)
+            iban, pin = random_source.choice(users)
+            session = sessions.get(iban)
+            if session is None:
+                session = sessions[iban] = atm.login(iban, pin)
+            start = perf_counter_ns()
+            try:
+                if kind == "login":
+                    atm.logout(session)
+                    sessions[iban] = atm.login(iban, pin)
+                elif kind == "balance":
+                    atm.user_check_balance(session)
+                elif kind == "withdraw":
+                    atm.user_withdraw(session,
+                                      5 * random_source.randrange(1, 10))
+                elif kind == "deposit":
+                    atm.user_deposit(session, random_source.randrange(1, 50))
+                else:
+                    other_index = (bank_index + random_source.randrange(
+                        1, len(fleet))) % len(fleet)
+                    other, _, other_users = fleet[other_index]
+                    atm.user_transfer(session, random_source.randrange(1, 50),
+                                      other.name,
+                                      random_source.choice(other_users)[0])
+                failed = 0
+            except (AccountError, AtmError, BankError):
+                failed = 1
+            latencies, errors = results[kind]
+            latencies.append(perf_counter_ns() - start)
+            results[kind] = (latencies, errors + failed)
+        seconds = perf_counter() - run_start
+        for bank, _, _ in fleet:
+            bank.close()
+    return seconds, results
+
+
+def run_load(config: LoadConfig) -> dict:
+    """Run the load across a pool of worker processes.
+
+    Args:
+        config (LoadConfig): The fleet and traffic to run.
+
+    Raises:
+        ValueError: If the operations, processes, banks, ATMs or accounts
+            aren't greater than 0, or the mix or storage isn't valid.
+
+    Returns:
+        dict: Under "seconds", the time taken by the slowest worker to run
+            its operations, and under "operations", a summary of each kind
+            of operation from `summarise()`.
+    """
+    if min(config.operations, config.processes, config.banks, config.atms,
+           config.accounts) <= 0:
+        raise ValueError("Counts must be greater than 0")
+    if config.storage not in STORAGE:
+        raise ValueError(f"Unknown storage: {config.storage}")
+    if set(config.mix) - set(OPERATIONS) or \
+            not any(weight > 0 for weight in config.mix.values()):
+        raise ValueError("Mix must weight at least one known operation")
+    if config.banks < 2 and not any(config.mix.get(kind)
+                                    for kind in OPERATIONS[:-1]):
+        raise ValueError("Transfers need at least 2 banks")
+    shares = [config.operations // config.processes] * config.processes
+    for worker in range(config.operations % config.processes):
+        shares[worker] += 1
+    jobs = [(config, worker, share) for worker, share in enumerate(shares)]
+    if config.processes == 1:
+        parts = [run_worker(*jobs[0])]
+    else:
+        with Pool(config.processes) as pool:
+            parts = pool.starmap(run_worker, jobs)
+    seconds = max(part_seconds for part_seconds, _ in parts)
+    merged = {}
+    for _, part in parts:
+        for kind, (latencies, errors) in part.items():
+            all_latencies, all_errors = merged.get(kind, ([], 0))
+            all_latencies.extend(latencies)
+            merged[kind] = (all_latencies, all_errors + errors)
+    summary = {kind: summarise(*merged[kind], seconds)
+               for kind in OPERATIONS if kind in merged}
+    return {"seconds": seconds, "operations": summary}
+
+
+def summarise(latencies: list, errors: int, seconds: float) -> dict:
+    """Summarise the latencies of one kind of operation.
+
+    Args:
+        latencies (list): The latency of each operation, in nanoseconds.
+        errors (int): How many of the operations failed.
+        seconds (float): The time the run took.
+
+    Returns:
+        dict: The count, errors, operations per second, and the p50, p95
+            and p99 latencies in milliseconds.
+    """
+    ordered = sorted(latencies)
+    summary = {"count": len(ordered), "errors": errors,
+               "ops_per_second": len(ordered) / seconds if seconds else 0.0}
+    for percentile in (50, 95, 99):
+        summary[f"p{percentile}_ms"] = _percentile(ordered, percentile) / 1e6
+    return summary
+
+
+def _percentile(ordered: list, percentile: float) -> float:
+    """Get a percentile of sorted values by the nearest-rank method."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-percentile * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+
+def _parse_mix(text: str) -> dict:
+    """Parse a mix such as "login=10,withdraw=40,deposit=50"."""
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        try:
+            mix[kind.strip()] = float(weight)
+        except ValueError as error:
+            raise argparse.ArgumentTypeError(
+                f"invalid weight in {part!r}") from error
+    return mix
+
+
+def main():
+    """Parse the command line, run the load and print a report."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--operations", type=int, default=100000,
+                        help="Total operations (default: 100000).")
+    parser.add_argument("-p", "--processes", type=int,
+                        default=os.cpu_count() or 1,
+                        help="Worker processes (default: one per CPU).")
+    parser.add_argument("--banks", type=int, default=3,
+                        help="Banks per process (default: 3).")
+    parser.add_argument("--atms", type=int, default=2,
+                        help="ATMs per bank (default: 2).")
+    parser.add_argument("--accounts", type=int, default=100,
+                        help="Accounts per bank (default: 100).")
+    parser.add_argument("--mix", type=_parse_mix,
+                        default=",".join(f"{kind}={weight}" for kind, weight
+                                         in DEFAULT_MIX.items()),
+                        help="Relative weight of each operation "
+                             "(default: %(default)s).")
+    parser.add_argument("--storage", choices=sorted(STORAGE), default="dbm",
+                        help="Storage backend (default: dbm).")
+    parser.add_argument("--pin-iterations", type=int, default=1000,
+                        help="PIN hash cost (default: 1000).")
+    parser.add_argument("--seed", default="loadgen",
+                        help="Seed for the traffic (default: loadgen).")
+    args = parser.parse_args()
+    config = LoadConfig(args.operations, args.processes, args.banks,
+                        args.atms, args.accounts, args.mix, args.storage,
+                        args.pin_iterations, args.seed)
+    try:
+        result = run_load(config)
+    except ValueError as error:
+        parser.error(str(error))
+    total = sum(summary["count"] for summary in
+                result["operations"].values())
+    print(f"{total} operations in {result['seconds']:.3f}s "
+          f"({total / result['seconds']:.0f} ops/s) across "
+          f"{config.processes} processes")
+    print(f"{'operation':<10} {'count':>9} {'errors':>7} {'ops/s':>10} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for kind, summary in result["operations"].items():
+        print(f"{kind:<10} {summary['count']:>9} {summary['errors']:>7} "
+              f"{summary['ops_per_second']:>10.0f} "
+              f"{summary['p50_ms']:>8.3f} {summary['p95_ms']:>8.3f} "
+              f"{summary['p99_ms']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
 Install requirements with `pip3 install -r requirements.txt`
 """
 
+from datetime import datetime
 from time import sleep
 from rich.console import Console
 from rich.panel import Panel
@@ -10,6 +11,7 @@ from rich.panel import Panel
 from atm import ATM
 from bank import Bank
 import exceptions
+from money import to_euros
 
 console = Console()
 
@@ -82,10 +84,13 @@ def atm_login(atm: ATM):
             menu_selection = get_user_selection(["q"])
         return
 
-    if user.admin:
-        admin_menu(atm, user)
-    else:
-        main_menu(atm, user)
+    try:
+        if user.admin:
+            admin_menu(atm, user)
+        else:
+            main_menu(atm, user)
+    finally:
+        atm.logout(user)
 
 
 def main_menu(atm, user):
@@ -99,9 +104,11 @@ def main_menu(atm, user):
         console.print("3) Deposit")
         console.print("4) Transfer Funds")
         console.print("5) Reset PIN")
+        console.print("6) Mini Statement")
         console.print("\nPlease select an option or press (q) to quit.")
 
-        menu_selection = get_user_selection(["1", "2", "3", "4", "5", "q"])
+        menu_selection = get_user_selection(["1", "2", "3", "4", "5", "6",
+                                             "q"])
 
     if menu_selection == "1":
         user_check_balance(atm, user)
@@ -118,6 +125,9 @@ def main_menu(atm, user):
     elif menu_selection == "5":
         user_reset_pin(atm, user)
 
+    elif menu_selection == "6":
+        user_statement(atm, user)
+
 
 def user_check_balance(atm, user):
     balance = atm.user_check_balance(user)
@@ -125,7 +135,24 @@ def user_check_balance(atm, user):
     while menu_selection is None:
         console.clear()
         console.print(Panel.fit("Balance"))
-        console.print(f"You have €{balance} in your account.")
+        console.print(f"You have €{balance:.2f} in your account.")
+        console.print("\nPress (q) to quit.")
+        menu_selection = get_user_selection(["q"])
+
+
+def user_statement(atm, user):
+    transactions = atm.user_statement(user)
+    menu_selection = None
+    while menu_selection is None:
+        console.clear()
+        console.print(Panel.fit("Mini Statement"))
+        if not transactions:
+            console.print("No recent transactions.")
+        for transaction in transactions:
+            when = datetime.fromtimestamp(transaction.timestamp)
+            console.print(f"{when:%d/%m/%Y %H:%M}  {transaction.kind:<12} "
+                          f"€{to_euros(transaction.amount):>9.2f}  "
+                          f"€{to_euros(transaction.balance):>9.2f}")
         console.print("\nPress (q) to quit.")
         menu_selection = get_user_selection(["q"])
 
@@ -138,7 +165,7 @@ def user_withdraw(atm, user):
         console.print("Enter the amount to withdraw")
         amount = get_amount()
         try:
-            atm.user_withdraw(user, amount)
+            notes = atm.user_withdraw(user, amount)
         except exceptions.AccountError:
             menu_selection = None
             while menu_selection is None:
@@ -148,13 +175,13 @@ def user_withdraw(atm, user):
                 console.print("\nPress (q) to quit.")
                 menu_selection = get_user_selection(["q"])
             return
-        except exceptions.AtmError:
+        except exceptions.AtmError as error:
             menu_selection = None
             while menu_selection is None:
                 console.clear()
                 console.clear()
                 console.print(Panel.fit("Sorry!"))
-                console.print("Insufficient funds in ATM")
+                console.print(error)
                 console.print("Please come back again later")
                 console.print("\nPress (q) to quit.")
                 menu_selection = get_user_selection(["q"])
@@ -165,6 +192,8 @@ def user_withdraw(atm, user):
         console.clear()
         console.print(Panel.fit("Thank you"))
         console.print(f"€{amount} removed from your account")
+        for denomination, count in notes.items():
+            console.print(f"{count} x €{to_euros(denomination):g}")
         console.print("\nPress (q) to quit.")
         menu_selection = get_user_selection(["q"])
 
@@ -217,7 +246,6 @@ def user_transfer(atm, user):
             return
 
     transfer_bank_name = bank_list[int(menu_selection) - 1]
-    transfer_bank = atm.get_connected_bank(transfer_bank_name)
 
     transferred = False
     error_msg = ""
@@ -242,12 +270,10 @@ def user_transfer(atm, user):
             console.print("Enter the amount to transfer")
             amount = get_amount()
         try:
-            atm.user_withdraw(user, amount)
+            atm.user_transfer(user, amount, transfer_bank_name, iban)
         except exceptions.AccountError:
             error_msg = "Insufficient balance for transfer.\n"
             continue
-        try:
-            transfer_bank.transfer(iban, amount)
         except exceptions.BankError:
             error_msg = "Invalid IBAN.\n"
             continue
@@ -317,7 +343,7 @@ def admin_check_balance(atm, user):
     while menu_selection is None:
         console.clear()
         console.print(Panel.fit("Total ATM Balance"))
-        console.print(f"€{balance}")
+        console.print(f"€{balance:.2f}")
         console.print("\nPress (q) to quit.")
         menu_selection = get_user_selection(["q"])
 
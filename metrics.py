@@ -0,0 +1,256 @@
+"""Optional counters and latency histograms for the Bank and ATM.
+
+Pass a Metrics object to a Bank or ATM to time each of its public methods.
+Instrumentation wraps the methods of that one instance, so a Bank or ATM
+made without metrics runs exactly the code it always did. Storage and cache
+counters are read from the objects that already keep them, when the metrics
+are collected, so they add nothing to the hot path either.
+
+The results can be read in process or dumped in the Prometheus text
+exposition format with `to_prometheus()`.
+"""
+
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+# Upper bounds of the latency histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets, with their sum."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        """Create an empty histogram.
+
+        Args:
+            buckets (tuple): The sorted upper bounds of the buckets. Values
+                above the last bound are counted in a final bucket.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Count a value.
+
+        Args:
+            value (float): The value to count.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self) -> "Histogram":
+        """Return a copy of the histogram."""
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+
+class Metrics:
+    """A registry of counters and histograms keyed by name and labels.
+
+    It is safe to use from several threads.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        """Create an empty registry.
+
+        Args:
+            buckets (tuple, optional): The latency histogram buckets, in
+                seconds. Defaults to DEFAULT_BUCKETS.
+        """
+        self._buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        """Add to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            amount (float, optional): The amount to add. Defaults to 1.
+            **labels: The labels of the counter.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        """Count a value in a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            value (float): The value, such as a latency in seconds.
+            **labels: The labels of the histogram.
+        """
+        self._observe(name, value, _label_key(labels))
+
+    def counter(self, name: str, **labels) -> float:
+        """Get the value of a counter, including collected ones.
+
+        Args:
+            name (str): The name of the counter.
+            **labels: The labels of the counter.
+
+        Returns:
+            float: The value, or 0 if it hasn't been counted.
+        """
+        return self._all_counters().get((name, _label_key(labels)), 0)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """Get a copy of a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            **labels: The labels of the histogram.
+
+        Returns:
+            Histogram: A copy, or None if nothing has been observed.
+        """
+        with self._lock:
+            histogram = self._histograms.get((name, _label_key(labels)))
+            return None if histogram is None else histogram.copy()
+
+    def add_collector(self, collect):
+        """Add a source of counters that are read when metrics are read.
+
+        Args:
+            collect (callable): Returns an iterable of (name, labels,
+                value) tuples, where labels is a dict.
+        """
+        with self._lock:
+            self._collectors.append(collect)
+
+    def instrument(self, target, prefix: str, methods, **labels):
+        """Count and time methods of one object.
+
+        Each method is replaced on the object, not its class, by a wrapper
+        that records its latency in the histogram prefix + "_call_seconds"
+        and counts exceptions in prefix + "_errors_total", both labelled
+        with the method name and the given labels.
+
+        Args:
+            target: The object to instrument.
+            prefix (str): The prefix of the metric names.
+            methods (iterable): The names of the methods to instrument.
+            **labels: Labels added to every metric.
+        """
+        for method in methods:
+            key = _label_key({**labels, "method": method})
+            setattr(target, method,
+                    self._timed(getattr(target, method), prefix, key))
+
+    def to_prometheus(self) -> str:
+        """Dump every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, one sample per line.
+        """
+        counters = self._all_counters()
+        with self._lock:
+            histograms = {key: histogram.copy()
+                          for key, histogram in self._histograms.items()}
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (_, labels), value in sorted(
+                    item for item in counters.items() if item[0][0] == name):
+                lines.append(f"{name}{_format_labels(labels)} "
+                             f"{_format_value(value)}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (_, labels), histogram in sorted(
+                    (item for item in histograms.items()
+                     if item[0][0] == name), key=lambda item: item[0]):
+                cumulative = 0
+                bounds = [*map(_format_value, histogram.buckets), "+Inf"]
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    bucket_labels = labels + (("le", bound),)
+                    lines.append(f"{name}_bucket"
+                                 f"{_format_labels(bucket_labels)} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} "
+                             f"{_format_value(histogram.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} "
+                             f"{histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _observe(self, name: str, value: float, key: tuple):
+        """Count a value in a histogram with labels already keyed."""
+        with self._lock:
+            histogram = self._histograms.get((name, key))
+            if histogram is None:
+                histogram = self._histograms[(name, key)] = \
+                    Histogram(self._buckets)
+            histogram.observe(value)
+
+    def _timed(self, call, prefix: str, key: tuple):
+        """Wrap a bound method so its calls are counted and timed."""
+        seconds_name = prefix + "_call_seconds"
+        errors_name = (prefix + "_errors_total", key)
+        observe = self._observe
+
+        @wraps(call)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return call(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self._counters[errors_name] = \
+                        self._counters.get(errors_name, 0) + 1
+                raise
+            finally:
+                observe(seconds_name, perf_counter() - start, key)
+
+        return timed
+
+    def _all_counters(self) -> dict:
+        """Get the counted and collected counters together."""
+        with self._lock:
+            counters = dict(self._counters)
+            collectors = list(self._collectors)
+        for collect in collectors:
+            for name, labels, value in collect():
+                key = (name, _label_key(labels))
+                counters[key] = counters.get(key, 0) + value
+        return counters
+
+
+def _label_key(labels: dict) -> tuple:
+    """Turn labels into a hashable, ordered key."""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: tuple) -> str:
+    """Format a label key in the Prometheus text format."""
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"") \
+        .replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value, without a trailing .0 on whole numbers."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
@@ -0,0 +1,81 @@
+"""Exact amounts of money held as integer cents.
+
+Amounts arrive in euros as ints, floats or Decimals and are converted to
+cents once, where they enter the Bank or ATM. Everything past that point
+adds and subtracts plain integers, so balances never drift.
+"""
+
+from decimal import Decimal
+
+CENTS_PER_EURO = 100
+
+
+class Cents(int):
+    """An amount in cents that has already been validated.
+
+    Passing a Cents value to another Bank or ATM method skips converting
+    and validating it again.
+    """
+
+    __slots__ = ()
+
+
+def to_cents(amount) -> Cents:
+    """Convert an amount in euros to cents.
+
+    Args:
+        amount (int, float or Decimal): The amount in euros.
+
+    Raises:
+        TypeError: If the amount isn't an int, a float or a Decimal.
+        ValueError: If the amount isn't finite or has fractions of a cent.
+
+    Returns:
+        Cents: The amount in cents.
+    """
+    if type(amount) is Cents:
+        return amount
+    if type(amount) is int:
+        return Cents(amount * CENTS_PER_EURO)
+    if isinstance(amount, float):
+        amount = Decimal(repr(amount))
+    elif not isinstance(amount, Decimal) or isinstance(amount, bool):
+        raise TypeError("Must be of type int or float")
+    if not amount.is_finite():
+        raise ValueError("Amount must be a finite number")
+    cents = amount * CENTS_PER_EURO
+    if cents != cents.to_integral_value():
+        raise ValueError("Amount can't have fractions of a cent")
+    return Cents(int(cents))
+
+
+def parse_amount(amount) -> Cents:
+    """Convert a transaction amount in euros to cents.
+
+    Args:
+        amount (int, float or Decimal): The amount in euros.
+
+    Raises:
+        TypeError: If the amount isn't an int, a float or a Decimal.
+        ValueError: If the amount isn't greater than 0 or isn't a whole
+            number of cents.
+
+    Returns:
+        Cents: The amount in cents.
+    """
+    cents = to_cents(amount)
+    if cents <= 0:
+        raise ValueError("Amount must be greater than 0")
+    return cents
+
+
+def to_euros(cents: int) -> float:
+    """Convert an amount in cents to euros for display.
+
+    Args:
+        cents (int): The amount in cents.
+
+    Returns:
+        float: The amount in euros.
+    """
+    return cents / CENTS_PER_EURO
@@ -0,0 +1,215 @@
+"""Salted, slow hashes of account PINs and a cache of verified logins.
+
+PINs are stored as PBKDF2-HMAC-SHA256 hashes with a random salt per account.
+The number of iterations sets how long each check takes and is stored with
+the hash, so it can be raised later without breaking existing accounts.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from time import monotonic
+
+ALGORITHM = "pbkdf2_sha256"
+ITERATIONS = 100000
+SALT_SIZE = 16
+DIGEST_SIZE = 32
+
+
+class PinHash(namedtuple("PinHash", ["iterations", "salt", "digest"])):
+    """The stored hash of a PIN, with the salt and cost that produced it.
+
+    `str()` gives a text form, "pbkdf2_sha256$<iterations>$<salt>$<digest>"
+    with the salt and digest in hex, for backends and files that hold text.
+    """
+
+    __slots__ = ()
+
+    def __str__(self) -> str:
+        """Return the text form of the hash."""
+        return (f"{ALGORITHM}${self.iterations}$"
+                f"{self.salt.hex()}${self.digest.hex()}")
+
+    @classmethod
+    def parse(cls, text: str) -> "PinHash":
+        """Read a hash from its text form.
+
+        Args:
+            text (str): The text returned by `str()`.
+
+        Raises:
+            ValueError: If the text isn't a PIN hash.
+
+        Returns:
+            PinHash: The hash.
+        """
+        try:
+            algorithm, iterations, salt, digest = text.split("$")
+            pin_hash = cls(int(iterations), bytes.fromhex(salt),
+                           bytes.fromhex(digest))
+        except (AttributeError, ValueError) as error:
+            raise ValueError("Not a PIN hash") from error
+        if algorithm != ALGORITHM or pin_hash.iterations <= 0:
+            raise ValueError("Not a PIN hash")
+        return pin_hash
+
+
+def is_encoded(value) -> bool:
+    """Return whether a value is the text form of a PinHash."""
+    return isinstance(value, str) and value.startswith(ALGORITHM + "$")
+
+
+def hash_pin(pin, iterations: int = ITERATIONS) -> PinHash:
+    """Hash a PIN with a new random salt.
+
+    Args:
+        pin (int or str): The PIN to hash.
+        iterations (int, optional): The PBKDF2 cost. Defaults to ITERATIONS.
+
+    Raises:
+        ValueError: If iterations is not greater than 0.
+
+    Returns:
+        PinHash: The hash.
+    """
+    if iterations <= 0:
+        raise ValueError("Iterations must be greater than 0")
+    salt = os.urandom(SALT_SIZE)
+    return PinHash(iterations, salt, _derive(pin, salt, iterations))
+
+
+def verify_pin(pin, pin_hash: PinHash) -> bool:
+    """Check a PIN against a hash in constant time.
+
+    Args:
+        pin (int or str): The PIN to check.
+        pin_hash (PinHash): The stored hash.
+
+    Returns:
+        bool: True if the PIN matches, otherwise False.
+    """
+    digest = _derive(pin, pin_hash.salt, pin_hash.iterations)
+    return hmac.compare_digest(digest, pin_hash.digest)
+
+
+def same_hash(first: PinHash, second: PinHash) -> bool:
+    """Check whether two stored hashes are the same, in constant time.
+
+    Args:
+        first (PinHash): A hash.
+        second (PinHash): Another hash.
+
+    Returns:
+        bool: True if the hashes are equal, otherwise False.
+    """
+    return first.iterations == second.iterations \
+        and hmac.compare_digest(first.salt, second.salt) \
+        and hmac.compare_digest(first.digest, second.digest)
+
+
+def pin_bytes(pin) -> bytes:
+    """Normalise a PIN so 1234 and "1234" hash the same."""
+    try:
+        pin = int(pin)
+    except (TypeError, ValueError):
+        pass
+    return str(pin).encode("utf-8")
+
+
+def _derive(pin, salt: bytes, iterations: int) -> bytes:
+    """Run PBKDF2 over a PIN."""
+    return hashlib.pbkdf2_hmac("sha256", pin_bytes(pin), salt, iterations)
+
+
+class VerifiedPinCache:
+    """Remembers recent successful logins so they skip the slow hash.
+
+    Entries are keyed by a keyed HMAC of the IBAN, the PIN and the stored
+    hash, using a secret made for each cache, so the PINs themselves are
+    never held. A changed PIN changes the stored hash, so old entries stop
+    matching. Entries expire after a fixed time. A wrong PIN never matches
+    an entry and always pays the full cost. It is safe to use from several
+    threads.
+    """
+
+    def __init__(self, capacity: int, ttl: float = 300.0):
+        """Create a new, empty cache.
+
+        Args:
+            capacity (int): The maximum number of logins to remember.
+            ttl (float, optional): Seconds an entry stays valid. Defaults
+                to 300.
+
+        Raises:
+            ValueError: If the capacity or ttl is not greater than 0.
+        """
+        if capacity <= 0:
+            raise ValueError("Capacity must be greater than 0")
+        if ttl <= 0:
+            raise ValueError("ttl must be greater than 0")
+        self._capacity = capacity
+        self._ttl = ttl
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of logins currently remembered."""
+        return len(self._entries)
+
+    @property
+    def stats(self) -> dict:
+        """Get a copy of the hit and miss counters."""
+        with self._lock:
+            return dict(self._stats)
+
+    def check(self, iban: int, pin, pin_hash: PinHash) -> bool:
+        """Return whether this PIN was recently verified for the account.
+
+        Args:
+            iban (int): The IBAN of the account.
+            pin (int or str): The PIN being checked.
+            pin_hash (PinHash): The account's stored hash.
+
+        Returns:
+            bool: True if the login was verified and hasn't expired.
+        """
+        key = self._key(iban, pin, pin_hash)
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None or expires < monotonic():
+                self._entries.pop(key, None)
+                self._stats["misses"] += 1
+                return False
+            self._stats["hits"] += 1
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, iban: int, pin, pin_hash: PinHash):
+        """Remember a login whose PIN has just been verified.
+
+        Args:
+            iban (int): The IBAN of the account.
+            pin (int or str): The verified PIN.
+            pin_hash (PinHash): The account's stored hash.
+        """
+        key = self._key(iban, pin, pin_hash)
+        with self._lock:
+            self._entries[key] = monotonic() + self._ttl
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forget every login."""
+        with self._lock:
+            self._entries.clear()
+
+    def _key(self, iban: int, pin, pin_hash: PinHash) -> bytes:
+        """Build the entry key for a login."""
+        message = pin_hash.salt + pin_hash.digest \
+            + str(iban).encode() + b"$" + pin_bytes(pin)
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
@@ -0,0 +1,232 @@
+"""Read-only replicas of a bank's accounts, served from published snapshots.
+
+The bank that takes writes publishes a snapshot of every account to a file,
+by hand with `publish_snapshot()` or every so often with a
+SnapshotPublisher. Any number of processes can then open a read-only Bank
+over a ReplicaStorage of that file, to answer balance checks without
+touching the primary database. A replica reloads the snapshot once the copy
+it holds is older than its staleness bound, and refuses to answer if the
+newest snapshot is older than that too.
+"""
+
+import os
+import struct
+import threading
+from time import time
+
+from account import Account
+from exceptions import BankError
+from storage import Storage, _decode, _encode, _frame, _int_iban, \
+    _parse_frames
+
+# The header of a snapshot file: a magic number and the time it was taken,
+# in seconds since the epoch. The accounts follow as journal frames.
+_HEADER = struct.Struct("<4sd")
+_MAGIC = b"BRS1"
+
+
+def publish_snapshot(storage: Storage, path: str) -> int:
+    """Write every account in a store to a snapshot file for replicas.
+
+    The snapshot is written to a temporary file and renamed over the old
+    one, so a replica never reads a snapshot that is half written.
+
+    Args:
+        storage (Storage): The store to copy.
+        path (str): The filename of the snapshot.
+
+    Returns:
+        int: The number of accounts written.
+    """
+    taken = time()
+    temporary = f"{path}.{os.getpid()}.tmp"
+    count = 0
+    with open(temporary, "wb") as file, storage.session():
+        file.write(_HEADER.pack(_MAGIC, taken))
+        for account in storage.accounts():
+            file.write(_frame(_encode(account)))
+            count += 1
+    os.replace(temporary, path)
+    return count
+
+
+class SnapshotPublisher:
+    """Publishes a snapshot of a store from a background thread.
+
+    The thread is started by `start()`, or by using the publisher as a
+    context manager, and publishes once straight away and then after every
+    interval until `stop()`.
+    """
+
+    def __init__(self, storage: Storage, path: str, interval: float = 1.0):
+        """Create a publisher.
+
+        Args:
+            storage (Storage): The store to copy.
+            path (str): The filename of the snapshot.
+            interval (float, optional): Seconds between snapshots.
+                Defaults to 1.
+
+        Raises:
+            ValueError: If interval is not greater than 0.
+        """
+        if interval <= 0:
+            raise ValueError("interval must be greater than 0")
+        self._storage = storage
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+        self._published = 0
+
+    def __enter__(self):
+        """Start publishing for the duration of a `with` block."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop publishing at the end of a `with` block."""
+        self.stop()
+
+    @property
+    def published(self) -> int:
+        """Get the number of snapshots published."""
+        return self._published
+
+    def start(self):
+        """Publish a snapshot now, then keep publishing in the background.
+
+        Calling `start()` on a running publisher does nothing.
+        """
+        if self._thread is not None:
+            return
+        self.publish()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._publish_forever,
+                                        name="snapshot-publisher",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop publishing in the background."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
+
+    def publish(self) -> int:
+        """Publish a snapshot now.
+
+        Returns:
+            int: The number of accounts written.
+        """
+        count = publish_snapshot(self._storage, self._path)
+        self._published += 1
+        return count
+
+    def _publish_forever(self):
+        """Publish every interval until `stop()` is called."""
+        while not self._stopped.wait(self._interval):
+            self.publish()
+
+
+class ReplicaStorage(Storage):
+    """A read-only store of the accounts in a published snapshot.
+
+    The snapshot is held in memory as encoded accounts. Every read checks
+    the age of the copy held, and once it is older than max_staleness the
+    snapshot file is read again. Writes raise a BankError.
+    """
+
+    read_only = True
+
+    def __init__(self, path: str, max_staleness: float = 5.0):
+        """Create a replica of a snapshot file.
+
+        Args:
+            path (str): The filename of the snapshot.
+            max_staleness (float, optional): The oldest, in seconds, that
+                the accounts served may be. Defaults to 5.
+
+        Raises:
+            ValueError: If max_staleness is not greater than 0.
+        """
+        super().__init__()
+        if max_staleness <= 0:
+            raise ValueError("max_staleness must be greater than 0")
+        self._path = path
+        self._max_staleness = max_staleness
+        self._records = {}
+        self._taken = None
+        self._stats["reloads"] = 0
+
+    @property
+    def taken(self) -> float:
+        """Get when the snapshot held was taken, or None if none is held."""
+        return self._taken
+
+    def _open(self):
+        self._refresh()
+
+    def _close(self):
+        pass
+
+    def _sync(self):
+        pass
+
+    def _contains(self, iban: int) -> bool:
+        self._refresh()
+        return _int_iban(iban) in self._records
+
+    def _get(self, iban: int) -> Account:
+        self._refresh()
+        data = self._records.get(_int_iban(iban))
+        if data is None:
+            return None
+        self._stats["bytes_read"] += len(data)
+        return _decode(data)
+
+    def _put(self, account: Account):
+        raise BankError("Replica is read-only")
+
+    def _delete(self, iban: int):
+        raise BankError("Replica is read-only")
+
+    def _ibans(self) -> list:
+        self._refresh()
+        return list(self._records)
+
+    def _accounts(self):
+        self._refresh()
+        for data in list(self._records.values()):
+            self._stats["bytes_read"] += len(data)
+            yield _decode(data)
+
+    def _refresh(self):
+        """Read the snapshot again if the copy held is too old.
+
+        Raises:
+            BankError: If there is no snapshot, or the newest one is older
+                than the staleness bound.
+        """
+        if self._taken is not None and \
+                time() - self._taken <= self._max_staleness:
+            return
+        try:
+            with open(self._path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            raise BankError("No snapshot has been published") from None
+        if len(data) < _HEADER.size:
+            raise BankError("Snapshot is not valid")
+        magic, taken = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise BankError("Snapshot is not valid")
+        if taken != self._taken:
+            records = {}
+            _parse_frames(data, records, _HEADER.size)
+            self._records = records
+            self._taken = taken
+            self._stats["reloads"] += 1
+        if time() - taken > self._max_staleness:
+            raise BankError("Replica is too stale")
@@ -0,0 +1,133 @@
+"""End-of-day aggregate reports over every account of a bank.
+
+A report is made in one pass over the columns of a store, chunk by chunk,
+so memory use depends on the chunk size and the number of top accounts
+kept, not on the number of accounts. Each chunk is reduced with NumPy when
+it is installed, and with plain Python otherwise; both give the same
+report.
+"""
+
+import heapq
+from bisect import bisect_left
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Upper bounds of the balance distribution buckets, in cents.
+DEFAULT_BOUNDS = (0, 1000, 10000, 100000, 1000000, 10000000)
+
+Report = namedtuple("Report", ["accounts", "admins", "total", "smallest",
+                               "largest", "bounds", "counts", "top"])
+Report.__doc__ = """Aggregates over every account of a bank.
+
+total, smallest and largest are balances in cents; smallest and largest are
+None if there are no accounts. counts[i] is the number of balances at or
+below bounds[i] and above the bound before it, with a final count for the
+balances above the last bound. top is a list of (iban, balance) tuples,
+largest balance first.
+"""
+
+
+def summarise(columns, top: int = 10, bounds: tuple = DEFAULT_BOUNDS,
+              vectorised: bool = None) -> Report:
+    """Reduce chunks of account columns to a report.
+
+    Args:
+        columns (iterable): (ibans, balances, admins) chunks, such as from
+            `Storage.columns()`.
+        top (int, optional): The number of largest balances to keep.
+            Defaults to 10.
+        bounds (tuple, optional): The sorted upper bounds of the balance
+            buckets, in cents. Defaults to DEFAULT_BOUNDS.
+        vectorised (bool, optional): Reduce the chunks with NumPy. Defaults
+            to None, to use NumPy if it is installed.
+
+    Raises:
+        ValueError: If top is negative, or the bounds aren't sorted.
+        ImportError: If vectorised is True but NumPy isn't installed.
+
+    Returns:
+        Report: The aggregates.
+    """
+    if top < 0:
+        raise ValueError("top must not be negative")
+    bounds = tuple(bounds)
+    if list(bounds) != sorted(bounds):
+        raise ValueError("Bounds must be sorted")
+    if vectorised is None:
+        vectorised = numpy is not None
+    elif vectorised and numpy is None:
+        raise ImportError("NumPy is needed for a vectorised report")
+    reduce_chunk = _reduce_vectorised if vectorised else _reduce
+    accounts = admins = total = 0
+    smallest = largest = None
+    counts = [0] * (len(bounds) + 1)
+    largest_balances = []
+    for ibans, balances, chunk_admins in columns:
+        if not ibans:
+            continue
+        (chunk_total, chunk_admin_count, chunk_smallest, chunk_largest,
+         chunk_counts, chunk_top) = reduce_chunk(ibans, balances,
+                                                 chunk_admins, bounds, top)
+        accounts += len(ibans)
+        admins += chunk_admin_count
+        total += chunk_total
+        smallest = chunk_smallest if smallest is None \
+            else min(smallest, chunk_smallest)
+        largest = chunk_largest if largest is None \
+            else max(largest, chunk_largest)
+        counts = [count + chunk_count
+                  for count, chunk_count in zip(counts, chunk_counts)]
+        largest_balances = heapq.nlargest(
+            top, largest_balances + chunk_top, key=_by_balance)
+    top_accounts = [(iban, balance) for balance, iban in largest_balances]
+    return Report(accounts, admins, total, smallest, largest, bounds,
+                  counts, top_accounts)
+
+
+def _by_balance(entry: tuple) -> tuple:
+    """Order (balance, iban) entries by balance, then by lowest IBAN."""
+    return entry[0], -entry[1]
+
+
+def _reduce(ibans: list, balances: list, admins: list, bounds: tuple,
+            top: int) -> tuple:
+    """Reduce one chunk in plain Python.
+
+    Returns:
+        tuple: The total, admin count, smallest and largest balance,
+            bucket counts and the top (balance, iban) entries.
+    """
+    counts = [0] * (len(bounds) + 1)
+    for balance in balances:
+        counts[bisect_left(bounds, balance)] += 1
+    return (sum(balances), sum(map(bool, admins)), min(balances),
+            max(balances), counts,
+            heapq.nlargest(top, zip(balances, ibans), key=_by_balance))
+
+
+def _reduce_vectorised(ibans: list, balances: list, admins: list,
+                       bounds: tuple, top: int) -> tuple:
+    """Reduce one chunk with NumPy, returning the same as `_reduce()`."""
+    balance_array = numpy.asarray(balances, dtype=numpy.int64)
+    buckets = numpy.searchsorted(numpy.asarray(bounds, dtype=numpy.int64),
+                                 balance_array, side="left")
+    counts = numpy.bincount(buckets, minlength=len(bounds) + 1)
+    chunk_top = []
+    if top:
+        candidates = numpy.argpartition(-balance_array,
+                                        min(top, len(balances)) - 1)[:top]
+        threshold = balance_array[candidates].min()
+        # Ties at the threshold are all kept, so the merge picks the same
+        # IBANs as the plain Python reduction.
+        chosen = numpy.nonzero(balance_array >= threshold)[0]
+        chunk_top = heapq.nlargest(
+            top, ((balances[index], ibans[index]) for index in chosen),
+            key=_by_balance)
+    return (int(balance_array.sum()),
+            int(numpy.count_nonzero(numpy.asarray(admins, dtype=bool))),
+            int(balance_array.min()), int(balance_array.max()),
+            [int(count) for count in counts], chunk_top)
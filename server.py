@@ -0,0 +1,717 @@
+"""Serve banks over a socket, so ATMs can run in other processes.
+
+A BankServer exposes the account operations of one or more banks on a TCP
+or Unix socket. A RemoteBank is the client side: it has the same methods
+as a Bank, so an ATM can use one in place of a bank in its own process.
+Users are only known to the server by the signed sessions it issues from
+`start_session()`: accounts, with their PIN hashes, never cross the socket.
+
+Each request and reply is a frame with a small fixed header followed by
+its arguments or result, in a tagged binary encoding. Replies carry the id
+of their request, so a connection can have many requests in flight at
+once, and the server runs them in a thread pool. A RemoteBank keeps a pool
+of connections and sends each call down the one with the fewest requests
+in flight.
+
+Serve banks from the command line with `python3 server.py --help`.
+"""
+
+import argparse
+import itertools
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from decimal import Decimal
+
+from bank import Bank
+from exceptions import AccountError, AtmError, BankError
+from history import Transaction
+from money import Cents
+from sessions import Session
+
+# The Bank methods a client can call, numbered by their position.
+# Money only moves between banks through the session-checked
+# `transfer_to()`, so `Bank.transfer()` is not served.
+METHODS = ("start_session", "end_session", "valid_user", "check_balance",
+           "check_admin", "withdraw", "deposit", "transfer_to", "reset_pin",
+           "get_statement")
+
+# The methods whose first argument is the user, which must be a session.
+_SESSION_METHODS = frozenset(("end_session", "valid_user", "check_balance",
+                              "check_admin", "withdraw", "deposit",
+                              "transfer_to", "reset_pin", "get_statement"))
+
+# The largest request payload accepted, in bytes. A connection that sends a
+# larger one is closed.
+MAX_FRAME = 1 << 16
+
+# Asks for the names of the banks served, in order.
+_HELLO = 255
+
+# A request: payload length, request id, bank number and method number.
+_REQUEST = struct.Struct("<IIBB")
+# A reply: payload length, request id and status.
+_REPLY = struct.Struct("<IIB")
+_OK = 0
+_FAILED = 1
+
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_LENGTH = struct.Struct("<I")
+
+# The exceptions raised again on the client as themselves. Any other
+# exception from the server is raised as a BankError.
+_ERRORS = {error.__name__: error
+           for error in (AccountError, AtmError, BankError, KeyError,
+                         TypeError, ValueError)}
+
+
+class BankServer:
+    """Serves the account operations of some banks on a socket.
+
+    The server is started by `start()`, or by using it as a context
+    manager, and accepts connections from a background thread until
+    `stop()`. Each connection is read by its own thread, and the requests
+    on it run in a shared thread pool, so a slow call doesn't hold up the
+    others.
+    """
+
+    def __init__(self, banks, address=("127.0.0.1", 0),
+                 max_workers: int = 16):
+        """Create a server.
+
+        Args:
+            banks (Bank or iterable): The bank, or banks, to serve.
+                Transfers can be made between any banks served together.
+            address (tuple or str, optional): A (host, port) to listen on
+                with TCP, or the path of a Unix socket. Defaults to a free
+                port on localhost.
+            max_workers (int, optional): The most requests run at once.
+                Defaults to 16.
+
+        Raises:
+            ValueError: If there are no banks, more than 254 banks, two
+                banks with the same name, or max_workers is not greater
+                than 0.
+        """
+        banks = (banks,) if isinstance(banks, Bank) else tuple(banks)
+        if not 0 < len(banks) < _HELLO:
+            raise ValueError("There must be between 1 and 254 banks")
+        names = [bank.name for bank in banks]
+        if len(set(names)) != len(names):
+            raise ValueError("Bank names must be different")
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+        self._banks = banks
+        self._by_name = dict(zip(names, banks))
+        self._address = address
+        self._max_workers = max_workers
+        self._listener = None
+        self._thread = None
+        self._executor = None
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        """Serve the banks for the duration of a `with` block."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop serving at the end of a `with` block."""
+        self.stop()
+
+    @property
+    def address(self):
+        """Get the address listened on, with the port chosen if it was 0."""
+        if self._listener is not None and \
+                self._listener.family != _unix_family():
+            return self._listener.getsockname()[:2]
+        return self._address
+
+    def start(self):
+        """Listen on the address and accept connections in the background.
+
+        Calling `start()` on a running server does nothing.
+        """
+        if self._thread is not None:
+            return
+        self._listener = _listen(self._address)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._thread = threading.Thread(target=self._accept_forever,
+                                        name="bank-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop accepting connections and close the ones open."""
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        _shut(self._listener)
+        thread.join()
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            _shut(connection)
+        self._executor.shutdown(wait=True)
+        if isinstance(self._address, str):
+            try:
+                os.unlink(self._address)
+            except FileNotFoundError:
+                pass
+
+    def _accept_forever(self):
+        """Accept connections until the listening socket is closed."""
+        while True:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:
+                return
+            _configure(connection)
+            with self._lock:
+                self._connections.add(connection)
+            threading.Thread(target=self._serve, args=(connection,),
+                             name="bank-connection", daemon=True).start()
+
+    def _serve(self, connection: socket.socket):
+        """Read the requests on a connection until it is closed."""
+        send_lock = threading.Lock()
+        reader = connection.makefile("rb")
+        try:
+            while True:
+                header = reader.read(_REQUEST.size)
+                if len(header) < _REQUEST.size:
+                    break
+                length, request_id, bank, method = _REQUEST.unpack(header)
+                if length > MAX_FRAME:
+                    break
+                payload = reader.read(length)
+                if len(payload) < length:
+                    break
+                self._executor.submit(self._handle, connection, send_lock,
+                                      request_id, bank, method, payload)
+        except (OSError, RuntimeError):
+            pass
+        finally:
+            reader.close()
+            with self._lock:
+                self._connections.discard(connection)
+            _shut(connection)
+
+    def _handle(self, connection: socket.socket, send_lock: threading.Lock,
+                request_id: int, bank: int, method: int, payload: bytes):
+        """Make one call and send its reply."""
+        try:
+            if method == _HELLO:
+                result = [bank.name for bank in self._banks]
+            else:
+                arguments = _decode(payload)
+                if METHODS[method] in _SESSION_METHODS and (
+                        not arguments or
+                        not isinstance(arguments[0], Session)):
+                    raise BankError("A session is needed to use a bank "
+                                    "remotely")
+                if METHODS[method] == "get_statement":
+                    if not self._banks[bank].valid_user(arguments[0]):
+                        raise BankError("Session is not valid")
+                    arguments[0] = arguments[0].iban
+                if METHODS[method] == "transfer_to":
+                    other_bank = self._by_name.get(arguments[2])
+                    if other_bank is None:
+                        raise BankError("Bank is not served here")
+                    arguments[2] = other_bank
+                result = getattr(self._banks[bank],
+                                 METHODS[method])(*arguments)
+            status, body = _OK, _encode(result)
+        except Exception as error:
+            status, body = _FAILED, _encode(
+                [type(error).__name__, _message(error)])
+        try:
+            with send_lock:
+                connection.sendall(_REPLY.pack(len(body), request_id,
+                                               status) + body)
+        except OSError:
+            pass
+
+
+class RemoteBank:
+    """A bank served by a BankServer, with the methods of a Bank.
+
+    Users log in with `start_session()`, and the session it returns is
+    passed as the user to the other methods; an Account can't be sent.
+    Calls block until their reply arrives, and can be made from many
+    threads at once. `submit()` sends a call without waiting, so one thread
+    can pipeline many calls down the same connection.
+    """
+
+    def __init__(self, address, bank_name: str = None, pool_size: int = 4,
+                 timeout: float = 10.0):
+        """Connect to a server.
+
+        Args:
+            address (tuple or str): The (host, port) of a TCP server, or the
+                path of a Unix socket.
+            bank_name (str, optional): The name of the bank to use.
+                Defaults to None, for the first bank served.
+            pool_size (int, optional): The most connections to open.
+                Defaults to 4.
+            timeout (float, optional): Seconds to wait for a reply.
+                Defaults to 10.
+
+        Raises:
+            ValueError: If pool_size or timeout is not greater than 0, or
+                the server doesn't serve the named bank.
+            BankError: If the server can't be reached.
+        """
+        if pool_size <= 0:
+            raise ValueError("pool_size must be greater than 0")
+        if timeout <= 0:
+            raise ValueError("timeout must be greater than 0")
+        self._address = address
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._connections = []
+        self._lock = threading.Lock()
+        self._bank = 0
+        names = self._wait(self._send(_HELLO))
+        if bank_name is None:
+            bank_name = names[0]
+        elif bank_name not in names:
+            raise ValueError(f"Server doesn't serve {bank_name}")
+        self._bank = names.index(bank_name)
+        self._name = bank_name
+
+    def __str__(self) -> str:
+        """Returns a string of the name of the Bank."""
+        return str(self._name)
+
+    def __enter__(self):
+        """Use the bank for the duration of a `with` block."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the connections at the end of a `with` block."""
+        self.close()
+
+    @property
+    def name(self):
+        """Get the name of the Bank."""
+        return self._name
+
+    @property
+    def address(self):
+        """Get the address of the server."""
+        return self._address
+
+    def close(self):
+        """Close every connection. Calls still waiting fail."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def submit(self, method: str, *args) -> Future:
+        """Send a call without waiting for its reply.
+
+        Args:
+            method (str): The name of a Bank method in `METHODS`.
+            *args: The arguments of the call.
+
+        Raises:
+            ValueError: If the method can't be called remotely.
+
+        Returns:
+            Future: The result of the call, or the error it raised.
+        """
+        try:
+            number = METHODS.index(method)
+        except ValueError:
+            raise ValueError(f"Can't call {method} remotely") from None
+        return self._send(number, args)
+
+    def start_session(self, iban: int, pin: int) -> Session:
+        """Start a session for a user, as `Bank.start_session()`."""
+        return self._call("start_session", iban, pin)
+
+    def end_session(self, session: Session):
+        """End a session, as `Bank.end_session()`."""
+        self._call("end_session", session)
+
+    def valid_user(self, user: Session) -> bool:
+        """Check a user against the database, as `Bank.valid_user()`."""
+        return self._call("valid_user", user)
+
+    def check_balance(self, user: Session) -> float:
+        """Get a user's balance, as `Bank.check_balance()`."""
+        return self._call("check_balance", user)
+
+    def check_admin(self, user: Session) -> bool:
+        """Check if a user is an admin, as `Bank.check_admin()`."""
+        return self._call("check_admin", user)
+
+    def withdraw(self, user: Session, amount: float):
+        """Withdraw from a user's account, as `Bank.withdraw()`."""
+        self._call("withdraw", user, amount)
+
+    def deposit(self, user: Session, amount: float):
+        """Deposit into a user's account, as `Bank.deposit()`."""
+        self._call("deposit", user, amount)
+
+    def transfer_to(self, user: Session, amount: float,
+                    other_bank: "RemoteBank", iban: int):
+        """Move money to an account in another bank on the same server.
+
+        Raises:
+            BankError: If the other bank isn't served by the same server,
+                or as `Bank.transfer_to()`.
+        """
+        if not isinstance(other_bank, RemoteBank) or \
+                other_bank.address != self._address:
+            raise BankError("Bank is not served here")
+        self._call("transfer_to", user, amount, other_bank.name, iban)
+
+    def reset_pin(self, user: Session, new_pin: int):
+        """Change a user's PIN, as `Bank.reset_pin()`."""
+        self._call("reset_pin", user, new_pin)
+
+    def get_statement(self, user: Session, since: float = None,
+                      limit: int = 10) -> list:
+        """Get the recent transactions of a session's account.
+
+        Unlike `Bank.get_statement()`, this takes the user's session, and
+        the server reads the IBAN from it once it has checked it.
+        """
+        return self._call("get_statement", user, since, limit)
+
+    def _call(self, method: str, *args):
+        """Make a call and wait for its result."""
+        return self._wait(self.submit(method, *args))
+
+    def _wait(self, future: Future):
+        """Wait for the result of a call.
+
+        Raises:
+            BankError: If no reply arrives within the timeout.
+        """
+        try:
+            return future.result(self._timeout)
+        except FutureTimeoutError:
+            raise BankError("Bank server did not reply") from None
+
+    def _send(self, method: int, args: tuple = ()) -> Future:
+        """Send a request down the least busy connection.
+
+        Raises:
+            ValueError: If the arguments are larger than `MAX_FRAME`.
+        """
+        payload = _encode(list(args))
+        if len(payload) > MAX_FRAME:
+            raise ValueError("Arguments are too large to send")
+        with self._lock:
+            self._connections = [connection
+                                 for connection in self._connections
+                                 if not connection.closed]
+            connection = min(self._connections, default=None,
+                             key=_Connection.in_flight)
+            if connection is None or (connection.in_flight() and
+                                      len(self._connections) <
+                                      self._pool_size):
+                try:
+                    connection = _Connection(self._address)
+                except OSError as error:
+                    raise BankError("Can't reach the bank server") \
+                        from error
+                self._connections.append(connection)
+        return connection.send(self._bank, method, payload)
+
+
+class _Connection:
+    """One client connection, matching replies to requests by id."""
+
+    def __init__(self, address):
+        self._socket = socket.socket(_family(address), socket.SOCK_STREAM)
+        try:
+            self._socket.connect(address)
+        except OSError:
+            self._socket.close()
+            raise
+        _configure(self._socket)
+        self._reader = self._socket.makefile("rb")
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self._read_forever, name="bank-client",
+                         daemon=True).start()
+
+    def in_flight(self) -> int:
+        """Return the number of requests waiting for a reply."""
+        return len(self._pending)
+
+    def send(self, bank: int, method: int, payload: bytes) -> Future:
+        """Send a request, returning the future of its reply."""
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise BankError("Connection to the bank server was lost")
+            request_id = next(self._ids) & 0xFFFFFFFF
+            self._pending[request_id] = future
+            try:
+                self._socket.sendall(_REQUEST.pack(
+                    len(payload), request_id, bank, method) + payload)
+            except OSError:
+                del self._pending[request_id]
+                self._fail()
+                raise BankError("Connection to the bank server was lost") \
+                    from None
+        return future
+
+    def close(self):
+        """Close the connection."""
+        with self._lock:
+            self._fail()
+
+    def _read_forever(self):
+        """Hand each reply to its request until the connection closes."""
+        try:
+            while True:
+                header = self._reader.read(_REPLY.size)
+                if len(header) < _REPLY.size:
+                    break
+                length, request_id, status = _REPLY.unpack(header)
+                payload = self._reader.read(length)
+                if len(payload) < length:
+                    break
+                with self._lock:
+                    future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+                result = _decode(payload)
+                if status == _OK:
+                    future.set_result(result)
+                else:
+                    future.set_exception(_error(*result))
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            self._fail()
+        self._reader.close()
+
+    def _fail(self):
+        """Close the socket and fail every pending request, holding the
+        lock."""
+        if not self.closed:
+            self.closed = True
+            _shut(self._socket)
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(
+                BankError("Connection to the bank server was lost"))
+
+
+def _encode(value) -> bytes:
+    """Encode a value in the tagged binary encoding.
+
+    Raises:
+        TypeError: If the value, or part of it, can't be encoded.
+    """
+    parts = []
+    _encode_into(value, parts)
+    return b"".join(parts)
+
+
+def _encode_into(value, parts: list):
+    """Append the encoding of a value to a list of bytes."""
+    if value is None:
+        parts.append(b"N")
+    elif value is True or value is False:
+        parts.append(b"T" if value else b"F")
+    elif type(value) is Cents:
+        parts += (b"c", _INT.pack(value))
+    elif isinstance(value, int):
+        parts += (b"i", _INT.pack(value))
+    elif isinstance(value, float):
+        parts += (b"f", _FLOAT.pack(value))
+    elif isinstance(value, Decimal):
+        _encode_text(b"D", str(value).encode(), parts)
+    elif isinstance(value, str):
+        _encode_text(b"s", value.encode("utf-8"), parts)
+    elif isinstance(value, Session):
+        parts.append(b"S")
+        for field in (value.token, value.iban, value.name, value.admin,
+                      value.expires):
+            _encode_into(field, parts)
+    elif isinstance(value, Transaction):
+        parts.append(b"X")
+        for field in value:
+            _encode_into(field, parts)
+    elif isinstance(value, (list, tuple)):
+        parts += (b"l", _LENGTH.pack(len(value)))
+        for item in value:
+            _encode_into(item, parts)
+    elif isinstance(value, dict):
+        parts += (b"m", _LENGTH.pack(len(value)))
+        for key, item in value.items():
+            _encode_into(key, parts)
+            _encode_into(item, parts)
+    else:
+        raise TypeError(f"Can't send a {type(value).__name__}")
+
+
+def _encode_text(tag: bytes, data: bytes, parts: list):
+    """Append a tag, a length and some bytes to a list of bytes."""
+    parts += (tag, _LENGTH.pack(len(data)), data)
+
+
+def _decode(data: bytes):
+    """Decode a value encoded by `_encode()`.
+
+    Raises:
+        ValueError: If the data isn't an encoded value.
+    """
+    try:
+        value, offset = _decode_from(data, 0)
+    except (IndexError, struct.error, UnicodeDecodeError) as error:
+        raise ValueError("Not an encoded value") from error
+    if offset != len(data):
+        raise ValueError("Not an encoded value")
+    return value
+
+
+def _decode_from(data: bytes, offset: int) -> tuple:
+    """Decode the value at an offset, returning it and the next offset."""
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b"N":
+        return None, offset
+    if tag in (b"T", b"F"):
+        return tag == b"T", offset
+    if tag in (b"i", b"c"):
+        value, = _INT.unpack_from(data, offset)
+        return (Cents(value) if tag == b"c" else value), offset + _INT.size
+    if tag == b"f":
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    if tag in (b"D", b"s"):
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        text = data[offset:offset + length]
+        if len(text) != length:
+            raise IndexError("Value is cut short")
+        if tag == b"D":
+            value = Decimal(text.decode())
+        else:
+            value = text.decode("utf-8")
+        return value, offset + length
+    if tag in (b"S", b"X"):
+        fields = []
+        for _ in range(5):
+            field, offset = _decode_from(data, offset)
+            fields.append(field)
+        if tag == b"S":
+            return Session(*fields), offset
+        return Transaction(*fields), offset
+    if tag in (b"l", b"m"):
+        count, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        items = []
+        for _ in range(count * 2 if tag == b"m" else count):
+            item, offset = _decode_from(data, offset)
+            items.append(item)
+        if tag == b"m":
+            return dict(zip(items[::2], items[1::2])), offset
+        return items, offset
+    raise ValueError("Unknown tag")
+
+
+def _message(error: Exception):
+    """Get the message of an exception, or None if it has none."""
+    return str(error.args[0]) if error.args else None
+
+
+def _error(name: str, message: str) -> Exception:
+    """Make the exception to raise on the client for a failed call."""
+    error = _ERRORS.get(name)
+    if error is None:
+        return BankError(f"Server error: {name}: {message}")
+    return error(message) if message is not None else error()
+
+
+def _unix_family():
+    """Get the Unix socket family, or None where there isn't one."""
+    return getattr(socket, "AF_UNIX", None)
+
+
+def _family(address) -> int:
+    """Get the socket family of an address."""
+    return _unix_family() if isinstance(address, str) else socket.AF_INET
+
+
+def _listen(address) -> socket.socket:
+    """Open a listening socket on an address."""
+    listener = socket.socket(_family(address), socket.SOCK_STREAM)
+    try:
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+        else:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(address)
+        listener.listen()
+    except OSError:
+        listener.close()
+        raise
+    return listener
+
+
+def _configure(connection: socket.socket):
+    """Send small frames straight away on a TCP connection."""
+    if connection.family == socket.AF_INET:
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def _shut(connection: socket.socket):
+    """Shut down and close a socket, waking any thread reading it."""
+    try:
+        connection.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    connection.close()
+
+
+def main():
+    """Parse the command line, then serve the banks until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("banks", nargs="+", metavar="ID=NAME",
+                        help="A bank to serve, such as aib='Allied Irish "
+                             "Banks'.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="The host to listen on (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="The TCP port to listen on (default: 8765).")
+    parser.add_argument("--unix", metavar="PATH",
+                        help="Listen on a Unix socket instead of TCP.")
+    args = parser.parse_args()
+    banks = []
+    for bank in args.banks:
+        bank_id, _, name = bank.partition("=")
+        banks.append(Bank(bank_id, name or bank_id))
+    address = args.unix if args.unix else (args.host, args.port)
+    for bank in banks:
+        bank.open()
+    try:
+        with BankServer(banks, address) as server:
+            print(f"Serving {', '.join(map(str, banks))} on "
+                  f"{server.address}")
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for bank in banks:
+            bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Signed, expiring login sessions for ATM users.
+
+A Session stands in for an Account once a user has logged in. The bank
+checks it in memory, without reading the stored account back to compare
+every field, and it stays valid while the balance changes.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import weakref
+from time import monotonic
+
+from exceptions import BankError
+
+
+class Session:
+    """A handle to a logged in user, signed by the bank that issued it."""
+
+    __slots__ = ("_token", "_iban", "_name", "_admin", "_expires")
+
+    def __init__(self, token: str, iban: int, name: str, admin: bool,
+                 expires: float):
+        """Create a session handle. Sessions are made by `SessionManager`.
+
+        Args:
+            token (str): The signed session token.
+            iban (int): The IBAN of the logged in account.
+            name (str): The user's name.
+            admin (bool): The user's admin status at login.
+            expires (float): When the session expires, on the
+                `time.monotonic()` clock.
+        """
+        self._token = token
+        self._iban = iban
+        self._name = name
+        self._admin = admin
+        self._expires = expires
+
+    def __repr__(self) -> str:
+        """Return a representation that doesn't reveal the token."""
+        return f"Session(iban={self._iban!r}, admin={self._admin!r})"
+
+    @property
+    def token(self) -> str:
+        """Get the signed session token."""
+        return self._token
+
+    @property
+    def iban(self):
+        """Get the user's IBAN."""
+        return self._iban
+
+    @property
+    def name(self):
+        """Get the user's name."""
+        return self._name
+
+    @property
+    def admin(self):
+        """Return whether the user was an admin when they logged in."""
+        return self._admin
+
+    @property
+    def expires(self) -> float:
+        """Get when the session expires, on the `time.monotonic()` clock."""
+        return self._expires
+
+
+class SessionManager:
+    """Issues sessions and checks them in memory.
+
+    A token is a random session id followed by an HMAC of the id, IBAN,
+    admin status and expiry, keyed by a secret held only by the manager, so
+    a session with any field changed fails the check. Live sessions are
+    kept in a dict so they can be ended early. A background thread, started
+    with the first session, drops expired sessions from the dict. It is
+    safe to use from several threads.
+    """
+
+    def __init__(self, ttl: float = 300.0, reap_interval: float = 30.0):
+        """Create a manager with no sessions.
+
+        Args:
+            ttl (float, optional): Seconds a session lasts. Defaults to 300.
+            reap_interval (float, optional): Seconds between sweeps for
+                expired sessions. Defaults to 30.
+
+        Raises:
+            ValueError: If ttl or reap_interval is not greater than 0.
+        """
+        if ttl <= 0:
+            raise ValueError("ttl must be greater than 0")
+        if reap_interval <= 0:
+            raise ValueError("reap_interval must be greater than 0")
+        self._ttl = ttl
+        self._reap_interval = reap_interval
+        self._secret = os.urandom(32)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._stopped = None
+
+    def __len__(self) -> int:
+        """Return the number of sessions not yet ended or swept away."""
+        return len(self._sessions)
+
+    def issue(self, iban: int, name: str, admin: bool) -> Session:
+        """Start a session for a user whose PIN has been checked.
+
+        Args:
+            iban (int): The IBAN of the account.
+            name (str): The user's name.
+            admin (bool): The user's admin status.
+
+        Returns:
+            Session: The new session.
+        """
+        expires = monotonic() + self._ttl
+        session_id = os.urandom(16).hex()
+        token = f"{session_id}.{self._sign(session_id, iban, admin, expires)}"
+        session = Session(token, iban, name, admin, expires)
+        with self._lock:
+            self._sessions[token] = session
+            if self._reaper is None:
+                self._start_reaper()
+        return session
+
+    def check(self, session: Session) -> Session:
+        """Check that a session is genuine, live and hasn't expired.
+
+        Args:
+            session (Session): The session to check.
+
+        Raises:
+            BankError: If the session isn't valid.
+
+        Returns:
+            Session: The session.
+        """
+        if not self.is_valid(session):
+            raise BankError("Session is not valid")
+        return session
+
+    def is_valid(self, session: Session) -> bool:
+        """Return whether a session is genuine, live and hasn't expired.
+
+        Args:
+            session (Session): The session to check.
+
+        Returns:
+            bool: True if the session can be used, otherwise False.
+        """
+        if not isinstance(session, Session):
+            return False
+        if session.expires < monotonic():
+            return False
+        session_id, _, signature = session.token.partition(".")
+        expected = self._sign(session_id, session.iban, session.admin,
+                              session.expires)
+        if not hmac.compare_digest(signature, expected):
+            return False
+        return session.token in self._sessions
+
+    def end(self, session: Session):
+        """End a session so it can't be used again.
+
+        Args:
+            session (Session): The session to end.
+        """
+        if isinstance(session, Session):
+            with self._lock:
+                self._sessions.pop(session.token, None)
+
+    def reap(self) -> int:
+        """Drop every expired session.
+
+        Returns:
+            int: The number of sessions dropped.
+        """
+        now = monotonic()
+        with self._lock:
+            expired = [token for token, session in self._sessions.items()
+                       if session.expires < now]
+            for token in expired:
+                del self._sessions[token]
+        return len(expired)
+
+    def stop(self):
+        """Stop the background sweep, keeping the live sessions.
+
+        The sweep starts again with the next session issued.
+        """
+        self._stop(clear=False)
+
+    def close(self):
+        """Stop the background sweep and end every session."""
+        self._stop(clear=True)
+
+    def _stop(self, clear: bool):
+        """Stop the background sweep, ending every session if clear.
+
+        Each sweep has its own stop event, so a session issued while this
+        waits for the old sweep starts a new one that keeps running.
+        """
+        with self._lock:
+            reaper, self._reaper = self._reaper, None
+            stopped, self._stopped = self._stopped, None
+            if clear:
+                self._sessions.clear()
+        if reaper is not None:
+            stopped.set()
+            reaper.join()
+
+    def _start_reaper(self):
+        """Start the daemon thread that sweeps expired sessions.
+
+        The thread only holds a weak reference to the manager, so it ends
+        once the manager is garbage collected, even if it was never closed.
+        Called with the lock held.
+        """
+        self._stopped = threading.Event()
+        self._reaper = threading.Thread(
+            target=_reap_forever,
+            args=(weakref.ref(self), self._stopped, self._reap_interval),
+            name="session-reaper", daemon=True)
+        self._reaper.start()
+
+    def _sign(self, session_id: str, iban: int, admin: bool,
+              expires: float) -> str:
+        """Sign the fields of a session."""
+        message = f"{session_id}|{iban}|{int(bool(admin))}|{expires!r}"
+        return hmac.new(self._secret, message.encode(),
+                        hashlib.sha256).hexdigest()
+
+
+def _reap_forever(manager, stopped: threading.Event, interval: float):
+    """Sweep expired sessions until stopped or the manager is collected."""
+    while not stopped.wait(interval):
+        sessions = manager()
+        if sessions is None:
+            return
+        sessions.reap()
+        del sessions
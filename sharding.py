@@ -0,0 +1,352 @@
+"""Accounts split across several stores by IBAN range.
+
+A ShardedStorage routes each account to one of its shards by IBAN, so a bank
+can keep its accounts in several files. Each shard has its own lock, so
+operations on accounts in different shards run in parallel. IBANs are
+allocated at random, so shards with equal ranges fill up evenly, and a shard
+that grows too large can be split in two without touching the others.
+
+Show or split the shards of a bank with `python3 sharding.py --help`.
+"""
+
+import argparse
+import json
+import os
+from bisect import bisect_right
+from contextlib import ExitStack, contextmanager
+
+from account import Account
+from allocator import FIRST_IBAN, LAST_IBAN
+from storage import (DbmStorage, JournalStorage, MmapStorage, SQLiteStorage,
+                     Storage, _fsync_directory, _int_iban)
+
+BACKENDS = {
+    "dbm": DbmStorage,
+    "sqlite": lambda path: SQLiteStorage(path + ".db"),
+    "journal": JournalStorage,
+    "mmap": MmapStorage,
+}
+
+
+class ShardedStorage(Storage):
+    """A store that routes each account to a shard by IBAN range.
+
+    Shard i holds the IBANs from bounds[i - 1] up to, but not including,
+    bounds[i]. A call on one account holds only its shard's lock; opening,
+    closing, syncing and batches apply to every shard. When the store isn't
+    held open, each call opens its shard just for that call.
+
+    A store made with `at()` keeps its layout in a file next to its shards,
+    so it can be reopened after `split()`.
+    """
+
+    def __init__(self, shards, bounds=None):
+        """Create a store over some shards.
+
+        Args:
+            shards (iterable): The Storage of each shard, in IBAN order.
+            bounds (iterable, optional): The lowest IBAN of each shard after
+                the first. Defaults to None, for equal ranges.
+
+        Raises:
+            ValueError: If there are no shards, or the bounds aren't one
+                fewer than the shards, increasing and within the IBAN range.
+        """
+        shards = tuple(shards)
+        if not shards:
+            raise ValueError("There must be at least one shard")
+        bounds = _even_bounds(len(shards)) if bounds is None \
+            else tuple(bounds)
+        if len(bounds) != len(shards) - 1 or \
+                list(bounds) != sorted(set(bounds)) or \
+                any(not FIRST_IBAN < bound <= LAST_IBAN for bound in bounds):
+            raise ValueError("Bounds must split the IBAN range in order")
+        super().__init__()
+        self._map = (0, bounds, shards)
+        self._layout = None
+
+    @classmethod
+    def at(cls, path: str, shards: int = 4,
+           make_storage=DbmStorage) -> "ShardedStorage":
+        """Open the shards listed in a layout file, creating them if needed.
+
+        Args:
+            path (str): The filename of the store, without an extension.
+                The layout is path + ".shards" and the shards are named
+                path + ".<number>".
+            shards (int, optional): The number of equal shards to create if
+                there is no layout yet. Defaults to 4.
+            make_storage (callable, optional): Creates the Storage of a shard
+                from its name. Defaults to DbmStorage.
+
+        Raises:
+            ValueError: If shards is not greater than 0.
+
+        Returns:
+            ShardedStorage: The store.
+        """
+        try:
+            with open(path + ".shards") as file:
+                layout = json.load(file)
+        except FileNotFoundError:
+            if shards <= 0:
+                raise ValueError("shards must be greater than 0") from None
+            layout = {"names": [f"{path}.{number}"
+                                for number in range(shards)],
+                      "bounds": list(_even_bounds(shards)),
+                      "next": shards}
+            _save_layout(path, layout)
+        storage = cls([make_storage(name) for name in layout["names"]],
+                      layout["bounds"])
+        storage._layout = (path, make_storage, layout)
+        return storage
+
+    @property
+    def shards(self) -> tuple:
+        """Get the Storage of each shard, in IBAN order."""
+        return self._map[2]
+
+    @property
+    def bounds(self) -> tuple:
+        """Get the lowest IBAN of each shard after the first."""
+        return self._map[1]
+
+    @property
+    def stats(self) -> dict:
+        """Get the counters of every shard, added together."""
+        totals = {}
+        for shard in self.shards:
+            for counter, value in shard.stats.items():
+                totals[counter] = totals.get(counter, 0) + value
+        return totals
+
+    def __contains__(self, iban: int) -> bool:
+        return self._routed(iban, lambda shard: iban in shard)
+
+    def shard_of(self, iban: int) -> int:
+        """Get the index of the shard an IBAN is routed to.
+
+        Args:
+            iban (int): The IBAN.
+
+        Returns:
+            int: The index into `shards`.
+        """
+        key = _int_iban(iban)
+        return 0 if key is None else bisect_right(self.bounds, key)
+
+    def open(self):
+        with self._lock:
+            if not self._held:
+                for shard in self.shards:
+                    shard.open()
+                self._held = True
+
+    def close(self):
+        with self._lock:
+            if self._held:
+                for shard in self.shards:
+                    shard.close()
+                self._held = False
+
+    def sync(self):
+        with self._lock:
+            for shard in self.shards:
+                shard.sync()
+
+    @contextmanager
+    def session(self):
+        """Use the store. Shards that aren't held are opened per call.
+
+        Yields:
+            Storage: This store.
+        """
+        yield self
+
+    @contextmanager
+    def batch(self):
+        """Hold every shard in a batch for the block.
+
+        Yields:
+            Storage: This store.
+        """
+        with self._lock, ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.batch())
+            yield self
+
+    def get(self, iban: int) -> Account:
+        return self._routed(iban, lambda shard: shard.get(iban))
+
+    def put(self, account: Account):
+        self._routed(account.iban, lambda shard: shard.put(account))
+
+    def delete(self, iban: int):
+        self._routed(iban, lambda shard: shard.delete(iban))
+
+    def ibans(self) -> list:
+        ibans = []
+        for lower, upper, shard in self._ranges():
+            with shard.session():
+                ibans.extend(iban for iban in shard.ibans()
+                             if lower <= iban < upper)
+        return ibans
+
+    def accounts(self):
+        for lower, upper, shard in self._ranges():
+            with shard.session():
+                for account in shard.accounts():
+                    if lower <= int(account.iban) < upper:
+                        yield account
+
+    def columns(self, chunk_size: int = 65536):
+        for lower, upper, shard in self._ranges():
+            with shard.session():
+                for ibans, balances, admins in shard.columns(chunk_size):
+                    if all(lower <= iban < upper for iban in ibans):
+                        yield ibans, balances, admins
+                        continue
+                    kept = [index for index, iban in enumerate(ibans)
+                            if lower <= iban < upper]
+                    yield ([ibans[index] for index in kept],
+                           [balances[index] for index in kept],
+                           [admins[index] for index in kept])
+
+    def split(self, index: int, at: int = None,
+              storage: Storage = None) -> int:
+        """Split a shard in two, moving its upper IBANs to a new shard.
+
+        The moved accounts are written to the new shard and flushed, and
+        the layout is saved, before they are removed from the old shard.
+        Only an account's own shard is read, so copies left behind by an
+        interrupted split are never seen. Calls routed to the old shard
+        while it splits wait, then are routed again.
+
+        Args:
+            index (int): The index of the shard to split.
+            at (int, optional): The lowest IBAN to move. Defaults to None,
+                for the median of the IBANs in the shard.
+            storage (Storage, optional): The new, empty shard. A store from
+                `at()` makes its own, and a storage must not be given.
+                Defaults to None.
+
+        Raises:
+            IndexError: If there is no shard with the index.
+            ValueError: If a storage is given for a store made with `at()`,
+                or not given for any other store, or at isn't inside the
+                shard's range.
+
+        Returns:
+            int: The number of accounts moved.
+        """
+        with self._lock:
+            generation, bounds, shards = self._map
+            if not 0 <= index < len(shards):
+                raise IndexError("No shard with that index")
+            if self._layout is not None:
+                if storage is not None:
+                    raise ValueError("Shards are made from the layout")
+                path, make_storage, layout = self._layout
+                name = f"{path}.{layout['next']}"
+                storage = make_storage(name)
+            elif storage is None:
+                raise ValueError("A new shard must be given")
+            lower, upper, old = list(self._ranges())[index]
+            with old.batch():
+                if at is None:
+                    ibans = sorted(iban for iban in old.ibans()
+                                   if lower <= iban < upper)
+                    at = ibans[len(ibans) // 2] if ibans \
+                        else (lower + upper) // 2
+                if not lower < at < upper:
+                    raise ValueError("Split must be inside the shard")
+                with storage.batch():
+                    moved = [account for account in old.accounts()
+                             if at <= int(account.iban) < upper]
+                    for account in moved:
+                        storage.put(account)
+                if self._held:
+                    storage.open()
+                new_bounds = bounds[:index] + (at,) + bounds[index:]
+                new_shards = shards[:index + 1] + (storage,) + \
+                    shards[index + 1:]
+                if self._layout is not None:
+                    layout["names"].insert(index + 1, name)
+                    layout["bounds"] = list(new_bounds)
+                    layout["next"] += 1
+                    _save_layout(path, layout)
+                self._map = (generation + 1, new_bounds, new_shards)
+                for account in moved:
+                    old.delete(account.iban)
+            return len(moved)
+
+    def _routed(self, iban: int, call):
+        """Make a call on the shard of an IBAN, holding the shard's lock.
+
+        If the shards changed while waiting for the lock, the IBAN is
+        routed again.
+        """
+        while True:
+            generation, _, shards = self._map
+            shard = shards[self.shard_of(iban)]
+            with shard._lock:
+                if self._map[0] != generation:
+                    continue
+                with shard.session():
+                    return call(shard)
+
+    def _ranges(self):
+        """Yield the (lower, upper, shard) of each shard, upper excluded."""
+        _, bounds, shards = self._map
+        lowers = (FIRST_IBAN,) + bounds
+        uppers = bounds + (LAST_IBAN + 1,)
+        return zip(lowers, uppers, shards)
+
+
+def _even_bounds(count: int) -> tuple:
+    """Split the IBAN range into equal ranges, returning their bounds."""
+    width = (LAST_IBAN + 1 - FIRST_IBAN) / count
+    return tuple(FIRST_IBAN + round(width * number)
+                 for number in range(1, count))
+
+
+def _save_layout(path: str, layout: dict):
+    """Replace a layout file with a durable copy of a layout."""
+    temporary = path + ".shards.tmp"
+    with open(temporary, "w") as file:
+        json.dump(layout, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path + ".shards")
+    _fsync_directory(path + ".shards")
+
+
+def main():
+    """Parse the command line, then show or split the shards of a store."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="The store, such as aib_bank_accounts.")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="dbm",
+                        help="Storage backend of the shards (default: dbm).")
+    parser.add_argument("--split", type=int, metavar="INDEX",
+                        help="Split this shard at the median of its IBANs.")
+    args = parser.parse_args()
+    if not os.path.exists(args.path + ".shards"):
+        parser.error(f"no shard layout at {args.path}.shards")
+    storage = ShardedStorage.at(args.path, make_storage=BACKENDS[args.backend])
+    if args.split is not None:
+        try:
+            moved = storage.split(args.split)
+        except (IndexError, ValueError) as error:
+            parser.error(str(error))
+        print(f"Moved {moved} accounts out of shard {args.split}")
+    counts = [0] * len(storage.shards)
+    for iban in storage.ibans():
+        counts[storage.shard_of(iban)] += 1
+    print(f"{'shard':>5} {'from IBAN':>10} {'accounts':>9}")
+    lowers = (FIRST_IBAN,) + storage.bounds
+    for number, (lower, count) in enumerate(zip(lowers, counts)):
+        print(f"{number:>5} {lower:>10} {count:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Share one read between concurrent callers asking for the same key.
+
+When a burst of sessions looks up one account at once, only the first
+caller, the leader, reads it. The callers that arrive while that read is in
+flight wait for it and are handed its result, so the store sees one read
+however many callers there are.
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Tracks the reads in flight, keyed by what they read.
+
+    A caller calls `join()`. The leader makes the read and passes its
+    result, or the error it raised, to `land()`; every other caller waits
+    on the future it was given. A read landed is forgotten straight away,
+    so a caller that arrives after `land()` starts a new read. It is safe to
+    use from several threads.
+    """
+
+    def __init__(self):
+        """Create a tracker with no reads in flight."""
+        self._flights = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of reads in flight."""
+        return len(self._flights)
+
+    @property
+    def stats(self) -> dict:
+        """Get a copy of the call and coalesced call counters."""
+        with self._lock:
+            return dict(self._stats)
+
+    @property
+    def coalesced_fraction(self) -> float:
+        """Get the fraction of calls that shared a read, or 0 if none."""
+        with self._lock:
+            calls = self._stats["calls"]
+            return self._stats["coalesced"] / calls if calls else 0.0
+
+    def join(self, key) -> tuple:
+        """Join the read of a key in flight, or lead a new one.
+
+        Args:
+            key (hashable): What is being read.
+
+        Returns:
+            tuple: The Future of the read's result, and True if the caller
+                leads the read and must `land()` it.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            future = self._flights.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def land(self, key, future: Future, result=None,
+             error: BaseException = None):
+        """Hand the result of a read to the callers waiting for it.
+
+        Landing a read that has already landed does nothing.
+
+        Args:
+            key (hashable): What was read.
+            future (Future): The future returned by `join()`.
+            result (optional): The result of the read. Defaults to None.
+            error (BaseException, optional): The error the read raised,
+                given to the waiting callers instead of a result. Defaults
+                to None.
+        """
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+            if future.done():
+                return
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
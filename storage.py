@@ -0,0 +1,1067 @@
+"""Storage backends that hold the accounts of a bank."""
+
+import dbm
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+from account import Account
+from exceptions import BankError
+from pins import DIGEST_SIZE, SALT_SIZE, PinHash, is_encoded
+
+
+class Storage:
+    """Base class for a store of accounts keyed by IBAN.
+
+    A store is either held open with `open()` until `close()`, or opened for
+    the length of each `session()`. Backends implement the underscored
+    methods; the public ones keep the counters and apply the sync policy.
+    A backend that refuses writes sets `read_only`.
+
+    The public methods are safe to call from several threads. Each call is
+    serialised by a lock on the store, and a session that opens the store
+    (or a batch) holds the lock until it ends.
+    """
+
+    read_only = False
+
+    def __init__(self, sync_every: int = 0):
+        """Create a new, closed store.
+
+        Args:
+            sync_every (int, optional): While the store is held open, flush it
+                after this many writes. 0 only flushes on `sync()` and
+                `close()`. Defaults to 0.
+
+        Raises:
+            ValueError: If sync_every is negative.
+        """
+        if sync_every < 0:
+            raise ValueError("sync_every must not be negative")
+        self._sync_every = sync_every
+        self._held = False
+        self._in_session = False
+        self._batching = False
+        self._unsynced_writes = 0
+        self._stats = {"opens": 0, "reads": 0, "writes": 0,
+                       "bytes_read": 0, "bytes_written": 0}
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        """Hold the store open for the duration of a `with` block."""
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the store at the end of a `with` block."""
+        self.close()
+
+    def __contains__(self, iban: int) -> bool:
+        """Return whether an account with the given IBAN is stored."""
+        with self._lock:
+            self._stats["reads"] += 1
+            return self._contains(iban)
+
+    @property
+    def is_open(self) -> bool:
+        """Return whether the store is being held open."""
+        return self._held
+
+    @property
+    def stats(self) -> dict:
+        """Get a copy of the open, read and write counters.
+
+        Backends that store encoded accounts also count the bytes decoded
+        and encoded.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def open(self):
+        """Open the store and keep it open until `close()`.
+
+        Calling `open()` on a store that is already open does nothing.
+        """
+        with self._lock:
+            if not self._held:
+                self._stats["opens"] += 1
+                self._open()
+                self._held = True
+                self._unsynced_writes = 0
+
+    def close(self):
+        """Flush and close the store if it is held open."""
+        with self._lock:
+            if self._held:
+                self._close()
+                self._held = False
+                self._unsynced_writes = 0
+
+    def sync(self):
+        """Flush any pending writes if the store is held open."""
+        with self._lock:
+            if self._held:
+                self._sync()
+                self._unsynced_writes = 0
+
+    @contextmanager
+    def session(self):
+        """Use the store, opening it just for the block if it isn't held.
+
+        A session inside another session of the same thread reuses its
+        handle.
+
+        Yields:
+            Storage: This store.
+        """
+        if self._held:
+            yield self
+            return
+        with self._lock:
+            if self._held or self._in_session:
+                yield self
+                return
+            self._stats["opens"] += 1
+            self._open()
+            self._in_session = True
+            try:
+                yield self
+            finally:
+                self._in_session = False
+                self._close()
+
+    @contextmanager
+    def batch(self):
+        """Group many writes so they are flushed together once at the end.
+
+        The sync policy is suspended for the block. A held store is synced
+        when the block ends; otherwise the store is closed, which flushes it.
+
+        Yields:
+            Storage: This store.
+        """
+        with self._lock, self.session():
+            self._batching = True
+            try:
+                yield self
+            finally:
+                self._batching = False
+            self.sync()
+
+    def get(self, iban: int) -> Account:
+        """Read an account.
+
+        Args:
+            iban (int): The IBAN of the account to read.
+
+        Returns:
+            Account: The account, or None if it does not exist.
+        """
+        with self._lock:
+            self._stats["reads"] += 1
+            return self._get(iban)
+
+    def ibans(self) -> list:
+        """Get the IBAN of every stored account.
+
+        Returns:
+            list: The IBANs as ints.
+        """
+        with self._lock:
+            return self._ibans()
+
+    def accounts(self):
+        """Iterate over every stored account without loading them all.
+
+        Other threads can't use the store until the iteration finishes.
+
+        Yields:
+            Account: Each stored account, in no particular order.
+        """
+        with self._lock:
+            for account in self._accounts():
+                self._stats["reads"] += 1
+                yield account
+
+    def columns(self, chunk_size: int = 65536):
+        """Iterate over the IBAN, balance and admin status of every account.
+
+        The fields come in chunks, so reports can be made over a store of
+        any size in bounded memory. Backends that can read the fields
+        without building each Account do so. Other threads can't use the
+        store until the iteration finishes.
+
+        Args:
+            chunk_size (int, optional): The most accounts in each chunk.
+                Defaults to 65536.
+
+        Raises:
+            ValueError: If chunk_size is not greater than 0.
+
+        Yields:
+            tuple: Lists of the IBANs, balances in cents and admin statuses
+                of up to chunk_size accounts.
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be greater than 0")
+        with self._lock:
+            for chunk in self._columns(chunk_size):
+                self._stats["reads"] += len(chunk[0])
+                yield chunk
+
+    def put(self, account: Account):
+        """Write an account, replacing any stored with the same IBAN.
+
+        Args:
+            account (Account): The account to write.
+        """
+        with self._lock:
+            self._stats["writes"] += 1
+            self._put(account)
+            if self._held and self._sync_every and not self._batching:
+                self._unsynced_writes += 1
+                if self._unsynced_writes >= self._sync_every:
+                    self.sync()
+
+    def delete(self, iban: int):
+        """Remove an account, if it is stored.
+
+        Args:
+            iban (int): The IBAN of the account to remove.
+        """
+        with self._lock:
+            self._stats["writes"] += 1
+            self._delete(iban)
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def _sync(self):
+        raise NotImplementedError
+
+    def _contains(self, iban: int) -> bool:
+        raise NotImplementedError
+
+    def _get(self, iban: int) -> Account:
+        raise NotImplementedError
+
+    def _put(self, account: Account):
+        raise NotImplementedError
+
+    def _delete(self, iban: int):
+        raise NotImplementedError
+
+    def _columns(self, chunk_size: int):
+        ibans, balances, admins = [], [], []
+        for account in self._accounts():
+            ibans.append(int(account.iban))
+            balances.append(account.balance_cents)
+            admins.append(bool(account.admin))
+            if len(ibans) == chunk_size:
+                yield ibans, balances, admins
+                ibans, balances, admins = [], [], []
+        if ibans:
+            yield ibans, balances, admins
+
+    def _ibans(self) -> list:
+        raise NotImplementedError
+
+    def _accounts(self):
+        raise NotImplementedError
+
+
+class DbmStorage(Storage):
+    """Accounts in a dbm database, keyed by `str(iban)`.
+
+    Accounts are stored in the compact encoding of `Account.to_bytes()`.
+    Records that encoding can't represent, and records written by earlier
+    versions that used shelve, are pickled; both kinds can be read.
+    """
+
+    def __init__(self, path: str, sync_every: int = 0):
+        """Create a store backed by a dbm database.
+
+        Args:
+            path (str): The filename of the database, without an extension.
+            sync_every (int, optional): See `Storage`. Defaults to 0.
+        """
+        super().__init__(sync_every)
+        self._path = path
+        self._db = None
+
+    def _open(self):
+        self._db = dbm.open(self._path, "c")
+
+    def _close(self):
+        self._db.close()
+        self._db = None
+
+    def _sync(self):
+        if hasattr(self._db, "sync"):
+            self._db.sync()
+
+    def _contains(self, iban: int) -> bool:
+        return str(iban).encode() in self._db
+
+    def _get(self, iban: int) -> Account:
+        data = self._db.get(str(iban).encode())
+        if data is None:
+            return None
+        self._stats["bytes_read"] += len(data)
+        return _decode(data)
+
+    def _put(self, account: Account):
+        data = _encode(account)
+        self._stats["bytes_written"] += len(data)
+        self._db[str(account.iban).encode()] = data
+
+    def _delete(self, iban: int):
+        key = str(iban).encode()
+        if key in self._db:
+            del self._db[key]
+
+    def _ibans(self) -> list:
+        return [int(key) for key in self._db.keys()]
+
+    def _accounts(self):
+        for key in self._db.keys():
+            data = self._db[key]
+            self._stats["bytes_read"] += len(data)
+            yield _decode(data)
+
+
+class SQLiteStorage(Storage):
+    """Accounts held as rows of an SQLite table indexed by IBAN.
+
+    The database runs in WAL mode so readers in other connections are not
+    blocked by a writer. Writes are committed by the sync policy. PINs are
+    stored as the text form of their hash; tables made before PINs were
+    hashed may still hold the PINs of accounts that haven't logged in since.
+    """
+
+    _CREATE = ("CREATE TABLE IF NOT EXISTS accounts ("
+               "iban INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+               "pin TEXT NOT NULL, admin INTEGER NOT NULL, "
+               "balance INTEGER NOT NULL)")
+    _CONTAINS = "SELECT 1 FROM accounts WHERE iban = ?"
+    _IBANS = "SELECT iban FROM accounts"
+    _ACCOUNTS = "SELECT iban, name, pin, admin, balance FROM accounts"
+    _COLUMNS = "SELECT iban, balance, admin FROM accounts"
+    _GET = "SELECT iban, name, pin, admin, balance FROM accounts WHERE iban = ?"
+    _PUT = ("INSERT OR REPLACE INTO accounts (iban, name, pin, admin, balance) "
+            "VALUES (?, ?, ?, ?, ?)")
+    _DELETE = "DELETE FROM accounts WHERE iban = ?"
+
+    def __init__(self, path: str, sync_every: int = 0):
+        """Create a store backed by an SQLite database.
+
+        Args:
+            path (str): The filename of the database.
+            sync_every (int, optional): See `Storage`. Defaults to 0.
+        """
+        super().__init__(sync_every)
+        self._path = path
+        self._connection = None
+
+    def _open(self):
+        self._connection = sqlite3.connect(self._path,
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(self._CREATE)
+
+    def _close(self):
+        self._connection.commit()
+        self._connection.close()
+        self._connection = None
+
+    def _sync(self):
+        self._connection.commit()
+
+    def _contains(self, iban: int) -> bool:
+        key = _int_iban(iban)
+        if key is None:
+            return False
+        return self._connection.execute(self._CONTAINS, (key,)).fetchone() \
+            is not None
+
+    def _get(self, iban: int) -> Account:
+        key = _int_iban(iban)
+        if key is None:
+            return None
+        row = self._connection.execute(self._GET, (key,)).fetchone()
+        if row is None:
+            return None
+        return self._from_row(row)
+
+    def _put(self, account: Account):
+        self._connection.execute(self._PUT, account.to_record())
+
+    def _delete(self, iban: int):
+        key = _int_iban(iban)
+        if key is not None:
+            self._connection.execute(self._DELETE, (key,))
+
+    def _ibans(self) -> list:
+        return [iban for iban, in self._connection.execute(self._IBANS)]
+
+    def _accounts(self):
+        cursor = self._connection.cursor()
+        cursor.execute(self._ACCOUNTS)
+        rows = cursor.fetchmany(1000)
+        while rows:
+            for row in rows:
+                yield self._from_row(row)
+            rows = cursor.fetchmany(1000)
+
+    def _columns(self, chunk_size: int):
+        cursor = self._connection.cursor()
+        cursor.execute(self._COLUMNS)
+        rows = cursor.fetchmany(chunk_size)
+        while rows:
+            ibans, balances, admins = zip(*rows)
+            yield list(ibans), list(balances), [bool(admin)
+                                                for admin in admins]
+            rows = cursor.fetchmany(chunk_size)
+
+    @staticmethod
+    def _from_row(row: tuple) -> Account:
+        """Build an account from a row of the accounts table."""
+        iban, name, pin, admin, balance = row
+        if not is_encoded(pin):
+            pin = int(pin)
+        return Account.from_record((iban, name, pin, bool(admin),
+                                    int(balance)))
+
+
+class JournalStorage(Storage):
+    """Accounts held in memory and made durable by an append-only journal.
+
+    Each write appends the account's new record to the journal file, which
+    is the source of truth. Appends are buffered and written out with one
+    sequential write and one fsync when the store is synced, so every write
+    since the last sync shares a single commit; the sync policy chooses how
+    many. After snapshot_every journal entries, a compacted snapshot of
+    every account is written and the journal is started afresh.
+
+    The snapshot is loaded and the journal replayed over it when the store
+    is first opened. Each entry holds an account's full record with a CRC,
+    so replay is idempotent and an entry torn by a crash is dropped. A
+    deleted account is journalled as a tombstone holding just its IBAN. The
+    accounts stay in memory afterwards, so the store assumes it is the only
+    writer to its files.
+    """
+
+    def __init__(self, path: str, sync_every: int = 0,
+                 snapshot_every: int = 10000):
+        """Create a store backed by a journal and snapshot file.
+
+        Args:
+            path (str): The filename of the store, without an extension.
+                The files are path + ".journal" and path + ".snapshot".
+            sync_every (int, optional): See `Storage`. Defaults to 0.
+            snapshot_every (int, optional): Journal entries written between
+                snapshots. Defaults to 10000.
+
+        Raises:
+            ValueError: If snapshot_every is not greater than 0.
+        """
+        super().__init__(sync_every)
+        if snapshot_every <= 0:
+            raise ValueError("snapshot_every must be greater than 0")
+        self._journal_path = path + ".journal"
+        self._snapshot_path = path + ".snapshot"
+        self._snapshot_every = snapshot_every
+        self._records = None
+        self._pending = bytearray()
+        self._entries = 0
+        self._journal = None
+
+    def snapshot(self):
+        """Write a compacted snapshot now and start a new journal."""
+        with self._lock, self.session():
+            self._commit()
+            self._snapshot()
+
+    def _open(self):
+        if self._records is None:
+            self._records = {}
+            _read_frames(self._snapshot_path, self._records)
+            self._entries = _read_frames(self._journal_path, self._records,
+                                         truncate=True)
+        self._journal = open(self._journal_path, "ab")
+
+    def _close(self):
+        self._sync()
+        self._journal.close()
+        self._journal = None
+
+    def _sync(self):
+        self._commit()
+        if self._entries >= self._snapshot_every:
+            self._snapshot()
+
+    def _contains(self, iban: int) -> bool:
+        return _int_iban(iban) in self._records
+
+    def _get(self, iban: int) -> Account:
+        data = self._records.get(_int_iban(iban))
+        if data is None:
+            return None
+        self._stats["bytes_read"] += len(data)
+        return _decode(data)
+
+    def _put(self, account: Account):
+        data = _encode(account)
+        self._stats["bytes_written"] += len(data)
+        self._records[_int_iban(account.iban)] = data
+        self._pending += _frame(data)
+        self._entries += 1
+
+    def _delete(self, iban: int):
+        key = _int_iban(iban)
+        if self._records.pop(key, None) is not None:
+            self._pending += _frame(_TOMBSTONE.pack(0, key))
+            self._entries += 1
+
+    def _ibans(self) -> list:
+        return list(self._records)
+
+    def _accounts(self):
+        for data in list(self._records.values()):
+            self._stats["bytes_read"] += len(data)
+            yield _decode(data)
+
+    def _commit(self):
+        """Append the buffered entries to the journal and fsync it."""
+        if self._pending:
+            self._journal.write(self._pending)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._pending.clear()
+
+    def _snapshot(self):
+        """Replace the snapshot with every account and empty the journal.
+
+        The new snapshot is made durable before the journal is emptied. A
+        crash in between leaves entries that replay to the same state.
+        """
+        temporary = self._snapshot_path + ".tmp"
+        with open(temporary, "wb") as file:
+            for data in self._records.values():
+                file.write(_frame(data))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self._snapshot_path)
+        _fsync_directory(self._snapshot_path)
+        self._journal.truncate(0)
+        os.fsync(self._journal.fileno())
+        self._entries = 0
+
+
+class MmapStorage(Storage):
+    """Accounts in a file of fixed-width records, mapped into memory.
+
+    Each account is one record, found through an open-addressing table of
+    IBAN to record slot kept in a second mapped file. Reads unpack the
+    fields straight out of the mapping and writes pack them back into the
+    account's own slot, so a balance update changes the record in place.
+    The files double in size as they fill. The index is rebuilt from the
+    records if it is missing or doesn't match them.
+
+    Names must fit in 64 bytes of UTF-8. Changes reach the disk when the
+    operating system writes the pages back, or on `sync()` and `close()`.
+
+    A store opened read-only maps the files of a store written by another
+    process and sees each change as soon as it is made, remapping the files
+    when the writer grows them. A reader may miss an account while the
+    writer deletes another.
+    """
+
+    def __init__(self, path: str, sync_every: int = 0, capacity: int = 1024,
+                 read_only: bool = False):
+        """Create a store backed by a mapped record file.
+
+        Args:
+            path (str): The filename of the store, without an extension.
+                The files are path + ".records" and path + ".index".
+            sync_every (int, optional): See `Storage`. Defaults to 0.
+            capacity (int, optional): The records a new file has room for.
+                Defaults to 1024.
+            read_only (bool, optional): Map the files of an existing store
+                for reading only. Defaults to False.
+
+        Raises:
+            ValueError: If capacity is not greater than 0.
+        """
+        super().__init__(sync_every)
+        if capacity <= 0:
+            raise ValueError("capacity must be greater than 0")
+        self.read_only = read_only
+        self._records_path = path + ".records"
+        self._index_path = path + ".index"
+        self._initial_capacity = capacity
+        self._records = None
+        self._index = None
+        self._count = 0
+        self._capacity = 0
+        self._index_capacity = 0
+        self._index_count = 0
+
+    def balance_of(self, iban: int) -> int:
+        """Read the balance of an account without building the Account.
+
+        Args:
+            iban (int): The IBAN of the account.
+
+        Returns:
+            int: The balance in cents, or None if the account doesn't
+                exist.
+        """
+        with self._lock, self.session():
+            self._stats["reads"] += 1
+            slot = self._slot(iban)
+            if slot < 0:
+                return None
+            return self._balances[_balance_word(slot)]
+
+    def _open(self):
+        if not self.read_only and not os.path.exists(self._records_path):
+            with open(self._records_path, "wb") as file:
+                file.write(_MMAP_HEADER.pack(_RECORDS_MAGIC, 0,
+                                             self._initial_capacity, 0))
+                file.truncate(_record_offset(self._initial_capacity))
+        self._map_records()
+        if self.read_only:
+            self._map_index()
+            return
+        try:
+            self._map_index()
+        except (FileNotFoundError, ValueError):
+            self._index = None
+        if self._index is None or self._index_count != self._count or \
+                self._index_capacity < _index_capacity(self._count):
+            self._rebuild_index(max(self._index_capacity,
+                                    _index_capacity(self._count)))
+
+    def _close(self):
+        self._sync()
+        self._unmap_index()
+        self._unmap_records()
+
+    def _sync(self):
+        if not self.read_only:
+            self._records[1].flush()
+            self._index[1].flush()
+
+    def _contains(self, iban: int) -> bool:
+        return self._slot(iban) >= 0
+
+    def _get(self, iban: int) -> Account:
+        slot = self._slot(iban)
+        if slot < 0:
+            return None
+        self._stats["bytes_read"] += _RECORD.size
+        (balance, iban, iterations, admin, name_length, salt, digest,
+         name) = _RECORD.unpack_from(self._records[1], _record_offset(slot))
+        if iterations:
+            pin = PinHash(iterations, salt, digest)
+        else:
+            pin = int.from_bytes(salt, "little", signed=True)
+        return Account.from_record((iban, name[:name_length].decode("utf-8"),
+                                    pin, bool(admin), balance))
+
+    def _put(self, account: Account):
+        if self.read_only:
+            raise BankError("Store is read-only")
+        key = _int_iban(account.iban)
+        if key is None or not 0 < key < 2 ** 32:
+            raise ValueError("IBAN must be a positive 32-bit number")
+        name = account.name.encode("utf-8")
+        if len(name) > _NAME_SIZE:
+            raise ValueError(f"Name is longer than {_NAME_SIZE} bytes")
+        if account.pin_hash is None:
+            iterations, digest = 0, b""
+            salt = int(account.to_record()[2]).to_bytes(
+                SALT_SIZE, "little", signed=True)
+        else:
+            iterations, salt, digest = account.pin_hash
+        slot = self._find(key)
+        if slot < 0:
+            if self._count == self._capacity:
+                self._grow_records(self._capacity * 2)
+            if (self._index_count + 1) * 2 > self._index_capacity:
+                self._rebuild_index(self._index_capacity * 2)
+            slot = self._count
+        _RECORD.pack_into(self._records[1], _record_offset(slot),
+                          account.balance_cents, key, iterations,
+                          bool(account.admin), len(name), salt, digest, name)
+        self._stats["bytes_written"] += _RECORD.size
+        if slot == self._count:
+            self._count += 1
+            self._write_header()
+            self._index_add(key, slot)
+
+    def _delete(self, iban: int):
+        if self.read_only:
+            raise BankError("Store is read-only")
+        key = _int_iban(iban)
+        slot = self._slot(key)
+        if slot < 0:
+            return
+        last = self._count - 1
+        records = self._records[1]
+        if slot != last:
+            moved = self._words[_iban_word(last)]
+            start = _record_offset(slot)
+            records[start:start + _RECORD.size] = \
+                records[_record_offset(last):_record_offset(last + 1)]
+            self._slots[self._position(moved) + 1] = slot + 1
+        self._count = last
+        self._write_header()
+        self._index_remove(key)
+        end = _record_offset(last)
+        records[end:end + _RECORD.size] = bytes(_RECORD.size)
+
+    def _ibans(self) -> list:
+        self._refresh()
+        words = self._words
+        return [words[_iban_word(slot)] for slot in range(self._count)]
+
+    def _accounts(self):
+        self._refresh()
+        for slot in range(self._count):
+            yield self._get(self._words[_iban_word(slot)])
+
+    def _columns(self, chunk_size: int):
+        self._refresh()
+        for start in range(0, self._count, chunk_size):
+            end = min(start + chunk_size, self._count)
+            with memoryview(self._records[1]) as data:
+                admins = data[_record_offset(start) + _ADMIN_OFFSET:
+                              _record_offset(end):_RECORD.size].tolist()
+            yield (self._words[_iban_word(start):_iban_word(end):
+                               _RECORD.size // 4].tolist(),
+                   self._balances[_balance_word(start):_balance_word(end):
+                                  _RECORD.size // 8].tolist(),
+                   [bool(admin) for admin in admins])
+
+    def _slot(self, iban) -> int:
+        """Find the slot of an IBAN, or -1 if it isn't stored."""
+        key = _int_iban(iban)
+        if key is None or not 0 < key < 2 ** 32:
+            return -1
+        self._refresh()
+        return self._find(key)
+
+    def _find(self, key: int) -> int:
+        """Find the slot of a valid IBAN in the index, or -1."""
+        slots = self._slots
+        mask = self._index_capacity - 1
+        position = key * _HASH_MULTIPLIER & mask
+        while True:
+            word = _INDEX_WORDS + 2 * position
+            stored = slots[word]
+            if stored == key:
+                return slots[word + 1] - 1
+            if stored == 0:
+                return -1
+            position = (position + 1) & mask
+
+    def _position(self, key: int) -> int:
+        """Find the index word holding a stored IBAN."""
+        slots = self._slots
+        mask = self._index_capacity - 1
+        position = key * _HASH_MULTIPLIER & mask
+        while slots[_INDEX_WORDS + 2 * position] != key:
+            position = (position + 1) & mask
+        return _INDEX_WORDS + 2 * position
+
+    def _index_add(self, key: int, slot: int):
+        """Add an IBAN to the index, which must have room for it."""
+        slots = self._slots
+        mask = self._index_capacity - 1
+        position = key * _HASH_MULTIPLIER & mask
+        while slots[_INDEX_WORDS + 2 * position]:
+            position = (position + 1) & mask
+        word = _INDEX_WORDS + 2 * position
+        slots[word + 1] = slot + 1
+        slots[word] = key
+        self._index_count += 1
+        _INDEX_HEADER.pack_into(self._index[1], 0, _INDEX_MAGIC,
+                                self._index_count, self._index_capacity)
+
+    def _index_remove(self, key: int):
+        """Remove an IBAN from the index, shifting back the entries after it.
+
+        An entry may fill the hole if its home position isn't between the
+        hole and the entry, so every key stays reachable from its home.
+        """
+        slots = self._slots
+        mask = self._index_capacity - 1
+        hole = (self._position(key) - _INDEX_WORDS) // 2
+        position = (hole + 1) & mask
+        while True:
+            word = _INDEX_WORDS + 2 * position
+            stored = slots[word]
+            if stored == 0:
+                break
+            home = stored * _HASH_MULTIPLIER & mask
+            if (position - home) & mask >= (position - hole) & mask:
+                hole_word = _INDEX_WORDS + 2 * hole
+                slots[hole_word + 1] = slots[word + 1]
+                slots[hole_word] = stored
+                hole = position
+            position = (position + 1) & mask
+        hole_word = _INDEX_WORDS + 2 * hole
+        slots[hole_word] = 0
+        slots[hole_word + 1] = 0
+        self._index_count -= 1
+        _INDEX_HEADER.pack_into(self._index[1], 0, _INDEX_MAGIC,
+                                self._index_count, self._index_capacity)
+
+    def _refresh(self):
+        """Remap the files of a read-only store if the writer grew them."""
+        if not self.read_only:
+            return
+        _, count, capacity, index_capacity = \
+            _MMAP_HEADER.unpack_from(self._records[1])
+        if capacity != self._capacity or \
+                index_capacity != self._index_capacity:
+            self._unmap_index()
+            self._unmap_records()
+            self._map_records()
+            self._map_index()
+        else:
+            self._count = count
+
+    def _grow_records(self, capacity: int):
+        """Make room for more records, while no views are held."""
+        self._balances.release()
+        self._words.release()
+        self._records[1].resize(_record_offset(capacity))
+        self._capacity = capacity
+        self._write_header()
+        self._view_records()
+
+    def _rebuild_index(self, capacity: int):
+        """Write a new index of every record and swap it in."""
+        temporary = self._index_path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(_INDEX_HEADER.pack(_INDEX_MAGIC, 0, capacity))
+            file.truncate(_INDEX_HEADER_SIZE + capacity * 8)
+        self._unmap_index()
+        self._index_capacity = capacity
+        self._index_count = 0
+        self._map_index(temporary)
+        for slot in range(self._count):
+            self._index_add(self._words[_iban_word(slot)], slot)
+        self._index[1].flush()
+        os.replace(temporary, self._index_path)
+        self._write_header()
+
+    def _write_header(self):
+        """Write the record count and the file sizes to the records file."""
+        _MMAP_HEADER.pack_into(self._records[1], 0, _RECORDS_MAGIC,
+                               self._count, self._capacity,
+                               self._index_capacity)
+
+    def _map_records(self):
+        """Map the records file and read its header."""
+        file = open(self._records_path, "rb" if self.read_only else "r+b")
+        access = mmap.ACCESS_READ if self.read_only else mmap.ACCESS_WRITE
+        self._records = (file, mmap.mmap(file.fileno(), 0, access=access))
+        magic, self._count, self._capacity, self._index_capacity = \
+            _MMAP_HEADER.unpack_from(self._records[1])
+        if magic != _RECORDS_MAGIC:
+            self._unmap_records()
+            raise ValueError("Not an account record file")
+        self._view_records()
+
+    def _view_records(self):
+        """Make the views of the balances and IBANs in the records."""
+        self._balances = memoryview(self._records[1]).cast("q")
+        self._words = memoryview(self._records[1]).cast("I")
+
+    def _unmap_records(self):
+        """Release the records file."""
+        if self._records is not None:
+            self._balances.release()
+            self._words.release()
+            file, mapped = self._records
+            mapped.close()
+            file.close()
+            self._records = None
+
+    def _map_index(self, path: str = None):
+        """Map an index file and read its header."""
+        file = open(path or self._index_path,
+                    "rb" if self.read_only else "r+b")
+        access = mmap.ACCESS_READ if self.read_only else mmap.ACCESS_WRITE
+        self._index = (file, mmap.mmap(file.fileno(), 0, access=access))
+        magic, self._index_count, self._index_capacity = \
+            _INDEX_HEADER.unpack_from(self._index[1])
+        if magic != _INDEX_MAGIC:
+            self._unmap_index()
+            raise ValueError("Not an account index file")
+        self._slots = memoryview(self._index[1]).cast("I")
+
+    def _unmap_index(self):
+        """Release the index file."""
+        if self._index is not None:
+            self._slots.release()
+            file, mapped = self._index
+            mapped.close()
+            file.close()
+            self._index = None
+
+
+# The header of an MmapStorage records file: a magic number, the record
+# count and capacity, and the capacity of the index, padded so that every
+# record, and the balance at its start, is 8-byte aligned.
+_MMAP_HEADER = struct.Struct("<4s4xQQQ")
+_MMAP_HEADER_SIZE = 64
+_RECORDS_MAGIC = b"BMR1"
+
+# A record: balance in cents, IBAN, PIN hash iterations, admin status, name
+# length, salt, digest and name, padded to a multiple of 8 bytes. A PIN not
+# yet hashed has 0 iterations and is held in the salt.
+_NAME_SIZE = 64
+_RECORD = struct.Struct(f"<qIIBB{SALT_SIZE}s{DIGEST_SIZE}s{_NAME_SIZE}s6x")
+_ADMIN_OFFSET = 16
+
+# The header of an MmapStorage index: a magic number, the entry count and
+# the capacity, a power of 2. Each entry is an IBAN and its slot + 1, as
+# 32-bit words, with an IBAN of 0 for an empty entry.
+_INDEX_HEADER = struct.Struct("<4s4xQQ")
+_INDEX_HEADER_SIZE = 64
+_INDEX_WORDS = _INDEX_HEADER_SIZE // 4
+_INDEX_MAGIC = b"BMI1"
+_HASH_MULTIPLIER = 2654435761
+
+
+def _record_offset(slot: int) -> int:
+    """Get the byte offset of a record slot."""
+    return _MMAP_HEADER_SIZE + slot * _RECORD.size
+
+
+def _balance_word(slot: int) -> int:
+    """Get the index of a record's balance in a view of 8-byte words."""
+    return _record_offset(slot) // 8
+
+
+def _iban_word(slot: int) -> int:
+    """Get the index of a record's IBAN in a view of 4-byte words."""
+    return _record_offset(slot) // 4 + 2
+
+
+def _index_capacity(count: int) -> int:
+    """Get the smallest index capacity holding a count at half load."""
+    capacity = 1024
+    while capacity < count * 2:
+        capacity *= 2
+    return capacity
+
+
+# The length and CRC-32 of each journal or snapshot entry.
+_FRAME = struct.Struct("<II")
+
+# A journal entry removing an account: a version byte of 0, which no
+# account encoding uses, and the IBAN.
+_TOMBSTONE = struct.Struct("<BI")
+
+
+def _frame(data: bytes) -> bytes:
+    """Frame an encoded account for a journal or snapshot file."""
+    return _FRAME.pack(len(data), zlib.crc32(data)) + data
+
+
+def _read_frames(path: str, records: dict, truncate: bool = False) -> int:
+    """Load the accounts in a journal or snapshot file into a dict.
+
+    Reading stops at the first entry that is cut short or fails its CRC.
+
+    Args:
+        path (str): The file to read. A missing file holds no entries.
+        records (dict): Encoded accounts keyed by IBAN, updated in place.
+        truncate (bool, optional): Cut the file off after the last good
+            entry. Defaults to False.
+
+    Returns:
+        int: The number of good entries read.
+    """
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return 0
+    offset, entries = _parse_frames(data, records)
+    if truncate and offset != len(data):
+        with open(path, "r+b") as file:
+            file.truncate(offset)
+    return entries
+
+
+def _parse_frames(data: bytes, records: dict, offset: int = 0) -> tuple:
+    """Load framed accounts from a buffer into a dict, as `_read_frames()`.
+
+    Returns:
+        tuple: The offset after the last good entry and the number of
+            good entries.
+    """
+    entries = 0
+    while offset + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, offset)
+        start = offset + _FRAME.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            break
+        if payload[:1] == b"\0":
+            records.pop(_TOMBSTONE.unpack(payload)[1], None)
+        else:
+            records[_int_iban(_decode(payload).iban)] = payload
+        offset = start + length
+        entries += 1
+    return offset, entries
+
+
+def _fsync_directory(path: str):
+    """Make a rename within the directory of a file durable, where possible."""
+    if os.name != "posix":
+        return
+    descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _encode(account: Account) -> bytes:
+    """Encode an account compactly, or pickle it if it can't be."""
+    try:
+        return account.to_bytes()
+    except ValueError:
+        return pickle.dumps(account, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode(data: bytes) -> Account:
+    """Decode an account written by `_encode()` or by shelve."""
+    if data[:1] == pickle.PROTO:
+        return pickle.loads(data)
+    return Account.from_bytes(data)
+
+
+def _int_iban(iban) -> int:
+    """Convert an IBAN to an int, or None if it isn't a number."""
+    try:
+        return int(iban)
+    except (TypeError, ValueError):
+        return None
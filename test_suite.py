@@ -1,9 +1,35 @@
 from atm import ATM
-from bank import Bank
+from bank import HISTORY_RETENTION, Bank
 from exceptions import BankError,AccountError,AtmError
 from main import *
+from storage import DbmStorage, JournalStorage, MmapStorage, SQLiteStorage
+from account import Account
+from money import parse_amount, to_cents
+from pins import PinHash
+from sessions import Session, SessionManager
+from decimal import Decimal
+import pickle
+import struct
+import bulk
+from async_atm import AsyncATM, AsyncBank
+from cassette import Cassette
+from history import MemoryHistory, SQLiteHistory
+from replica import ReplicaStorage, SnapshotPublisher, publish_snapshot
+from server import BankServer, RemoteBank
+from sharding import ShardedStorage
+from singleflight import SingleFlight
+import loadgen
+import reports
+from metrics import Metrics
 
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 import pytest
 
 
@@ -170,7 +196,1315 @@ class AdminWithdrawTestClass(unittest.TestCase):
             atm.admin_withdraw(user, "100")
 
 
-    
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Run each test inside its own temporary directory."""
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+
+'''Held Database Handle Testing'''
+
+class BankHandleTests(TempDirTestCase):
+    def test_reopens_on_every_call_by_default(self):
+        bank = Bank("aib", "AIB")
+        iban = bank.create_account("Aidan", 1234)
+        opens = bank.stats["opens"]
+        user = bank.login(iban, 1234)
+        bank.deposit(user, 10)
+        assert bank.stats["opens"] - opens == 2
+
+    def test_held_handle_opens_once(self):
+        bank = Bank("aib", "AIB")
+        with bank:
+            assert bank.is_open
+            iban = bank.create_account("Aidan", 1234)
+            user = bank.login(iban, 1234)
+            bank.deposit(user, 10)
+            user = bank.login(iban, 1234)
+            bank.withdraw(user, 5)
+        assert not bank.is_open
+        assert bank.stats["opens"] == 1
+
+    def test_writes_visible_after_close(self):
+        with Bank("aib", "AIB", sync_every=1) as bank:
+            iban = bank.create_account("Aidan", 1234)
+            bank.deposit(bank.login(iban, 1234), 25)
+        other = Bank("aib", "AIB")
+        assert other.check_balance(other.login(iban, 1234)) == 25
+
+    def test_negative_sync_every(self):
+        with pytest.raises(ValueError):
+            Bank("aib", "AIB", sync_every=-1)
+
+    def test_open_twice_is_harmless(self):
+        bank = Bank("aib", "AIB")
+        bank.open()
+        bank.open()
+        bank.close()
+        bank.close()
+        assert bank.stats["opens"] == 1
+
+
+'''Account Cache Testing'''
+
+class AccountCacheTests(TempDirTestCase):
+    def test_repeat_lookups_hit_cache(self):
+        bank = Bank("aib", "AIB", cache_size=4)
+        iban = bank.create_account("Aidan", 1234)
+        opens = bank.stats["opens"]
+        bank.get_account(iban)
+        bank.get_account(iban)
+        assert bank.stats["opens"] == opens
+        assert bank.cache_stats["hits"] == 2
+
+    def test_write_through(self):
+        bank = Bank("aib", "AIB", cache_size=4)
+        iban = bank.create_account("Aidan", 1234)
+        bank.deposit(bank.login(iban, 1234), 40)
+        assert bank.get_account(iban).balance == 40
+        assert Bank("aib", "AIB").get_account(iban).balance == 40
+
+    def test_lru_eviction(self):
+        bank = Bank("aib", "AIB", cache_size=2)
+        first = bank.create_account("Aidan", 1234)
+        bank.create_account("Dan", 2345)
+        bank.get_account(first)
+        bank.create_account("Conor", 3456)
+        stats = bank.cache_stats
+        assert stats["evictions"] == 1
+        assert stats["size"] == 2
+        bank.get_account(first)
+        assert bank.cache_stats["hits"] == 2
+
+    def test_cached_account_cannot_be_tampered(self):
+        bank = Bank("aib", "AIB", cache_size=4)
+        iban = bank.create_account("Aidan", 1234)
+        user = bank.login(iban, 1234)
+        user._balance = 1000
+        with pytest.raises(BankError):
+            bank.withdraw(user, 500)
+
+    def test_cache_disabled_by_default(self):
+        assert Bank("aib", "AIB").cache_stats == {}
+
+
+'''Single Read Per Operation Testing'''
+
+class BankReadCountTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = Bank("aib", "AIB")
+        self.iban = self.bank.create_account("Aidan", 1234)
+        self.bank.deposit(self.bank.login(self.iban, 1234), 100)
+        self.user = self.bank.login(self.iban, 1234)
+
+    def assert_counts(self, call, reads, writes):
+        before = self.bank.stats
+        call()
+        after = self.bank.stats
+        assert after["reads"] - before["reads"] == reads
+        assert after["writes"] - before["writes"] == writes
+
+    def test_withdraw(self):
+        self.assert_counts(lambda: self.bank.withdraw(self.user, 10), 1, 1)
+
+    def test_deposit(self):
+        self.assert_counts(lambda: self.bank.deposit(self.user, 10), 1, 1)
+
+    def test_check_balance_and_admin(self):
+        self.assert_counts(lambda: self.bank.check_balance(self.user), 1, 0)
+        self.assert_counts(lambda: self.bank.check_admin(self.user), 1, 0)
+
+    def test_login_and_transfer(self):
+        self.assert_counts(lambda: self.bank.login(self.iban, 1234), 1, 0)
+        self.assert_counts(lambda: self.bank.transfer(self.iban, 5), 1, 1)
+
+    def test_failed_withdraw_does_not_write(self):
+        with pytest.raises(AccountError):
+            self.assert_counts(
+                lambda: self.bank.withdraw(self.user, 1000), 1, 0)
+        assert self.bank.check_balance(self.user) == 100
+
+    def test_transfer_to_missing_account(self):
+        with pytest.raises(BankError):
+            self.bank.transfer(1, 5)
+
+
+'''Storage Backend Testing'''
+
+class SQLiteStorageTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = Bank("aib", "AIB", storage=SQLiteStorage("aib.db"))
+
+    def test_round_trip(self):
+        iban = self.bank.create_account("Aidan", 1234)
+        user = self.bank.login(iban, 1234)
+        self.bank.deposit(user, 50)
+        user = self.bank.login(iban, 1234)
+        self.bank.withdraw(user, 20)
+        assert self.bank.check_balance(self.bank.login(iban, 1234)) == 30
+        assert iban in self.bank
+
+    def test_admin_flag(self):
+        iban = self.bank.create_admin_account("Admin", 1010)
+        assert self.bank.check_admin(self.bank.login(iban, 1010))
+
+    def test_missing_and_malformed_ibans(self):
+        assert 12345678 not in self.bank
+        assert "not-an-iban" not in self.bank
+        with pytest.raises(BankError):
+            self.bank.login("not-an-iban", 1234)
+
+    def test_held_connection_commits_on_close(self):
+        with self.bank:
+            iban = self.bank.create_account("Aidan", 1234)
+        other = Bank("aib", "AIB", storage=SQLiteStorage("aib.db"))
+        assert other.get_account(iban).name == "Aidan"
+
+    def test_default_storage_is_dbm(self):
+        assert isinstance(Bank("aib", "AIB").storage, DbmStorage)
+
+
+'''Batch Settlement Testing'''
+
+class ApplyBatchTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = Bank("aib", "AIB")
+        self.first = self.bank.create_account("Aidan", 1234)
+        self.second = self.bank.create_account("Dan", 2345)
+
+    def test_applies_in_order_with_results(self):
+        results = self.bank.apply_batch([
+            ("deposit", self.first, 100),
+            ("withdraw", self.second, 10),
+            ("withdraw", self.first, 60),
+            ("deposit", self.second, 20),
+            ("withdraw", self.first, 50),
+        ])
+        errors = [type(result.error) for result in results]
+        assert errors == [type(None), AccountError, type(None), type(None),
+                          AccountError]
+        assert self.bank.get_account(self.first).balance == 40
+        assert self.bank.get_account(self.second).balance == 20
+
+    def test_one_read_and_write_per_account(self):
+        before = self.bank.stats
+        self.bank.apply_batch([("deposit", self.first, 1)] * 50
+                              + [("deposit", self.second, 1)] * 50)
+        after = self.bank.stats
+        assert after["opens"] - before["opens"] == 1
+        assert after["reads"] - before["reads"] == 2
+        assert after["writes"] - before["writes"] == 2
+
+    def test_invalid_items_are_reported(self):
+        results = self.bank.apply_batch([
+            ("deposit", 1, 10),
+            ("deposit", self.first, "ten"),
+            ("deposit", self.first, -10),
+            ("refund", self.first, 10),
+        ])
+        assert [type(result.error) for result in results] == \
+            [BankError, TypeError, ValueError, ValueError]
+        assert self.bank.get_account(self.first).balance == 0
+
+
+'''IBAN Allocation Testing'''
+
+class IbanAllocationTests(TempDirTestCase):
+    def test_create_accounts_in_bulk(self):
+        bank = Bank("aib", "AIB")
+        ibans = bank.create_accounts([("Aidan", 1234), ("Dan", 2345),
+                                      ("Admin", 1010, True)])
+        assert len(set(ibans)) == 3
+        assert all(10000000 <= iban <= 99999999 for iban in ibans)
+        assert bank.get_account(ibans[1]).name == "Dan"
+        assert bank.get_account(ibans[2]).admin
+
+    def test_no_storage_probes_per_allocation(self):
+        bank = Bank("aib", "AIB", pin_iterations=1000)
+        bank.create_account("Aidan", 1234)
+        reads = bank.stats["reads"]
+        bank.create_accounts([("User", 1234)] * 200)
+        assert bank.stats["reads"] == reads
+
+    def test_existing_ibans_are_not_reused(self):
+        bank = Bank("aib", "AIB", pin_iterations=1000)
+        first = bank.create_accounts([("User", 1234)] * 50)
+        allocator = Bank("aib", "AIB")._allocator
+        assert all(iban in allocator for iban in first)
+        assert not set(first) & set(allocator.allocate_many(50))
+
+
+'''Bulk Import and Export Testing'''
+
+class BulkImportExportTests(TempDirTestCase):
+    def write_csv(self, rows):
+        with open("accounts.csv", "w", encoding="utf-8") as file:
+            file.write("iban,name,pin,admin,balance\n")
+            for row in rows:
+                file.write(",".join(str(value) for value in row) + "\n")
+
+    def test_csv_import_in_chunks(self):
+        self.write_csv([(12345678, "Aidan", 1234, 0, 50),
+                        ("", "Dan", 2345, 0, 0),
+                        (23456789, "Admin", 1010, 1, 0)])
+        bank = Bank("aib", "AIB")
+        seen = []
+        result = bulk.import_file(bank, "accounts.csv", chunk_size=2,
+                                  progress=lambda rows, _: seen.append(rows))
+        assert result["rows"] == 3
+        assert seen == [2, 3]
+        assert bank.check_balance(bank.login(12345678, 1234)) == 50
+        assert bank.check_admin(bank.login(23456789, 1010))
+        assert len(list(bank.export_accounts())) == 3
+
+    def test_round_trip_through_jsonl(self):
+        bank = Bank("aib", "AIB")
+        ibans = bank.create_accounts([("Aidan", 1234), ("Admin", 1010, True)])
+        bank.transfer(ibans[0], 25)
+        assert bulk.export_file(bank, "accounts.jsonl")["rows"] == 2
+        copy = Bank("boi", "BOI", storage=SQLiteStorage("boi.db"))
+        bulk.import_file(copy, "accounts.jsonl")
+        assert sorted(copy.export_accounts()) == sorted(bank.export_accounts())
+
+    def test_import_hashes_plain_pins_only(self):
+        from multiprocessing.pool import ThreadPool
+        from pins import hash_pin
+        bank = Bank("aib", "AIB")
+        pin_hash = hash_pin(2345, iterations=1000)
+        records = [(12345678, "Aidan", 1234, False, 0),
+                   (23456789, "Dan", pin_hash, False, 0),
+                   (34567890, "Ann", str(pin_hash), False, 0)]
+        with ThreadPool(2) as pool:
+            assert bank.import_accounts(records, pool) == 3
+        assert bank.get_account(23456789).pin_hash == pin_hash
+        assert bank.get_account(34567890).pin_hash == pin_hash
+        assert bank.check_balance(bank.login(12345678, 1234)) == 0
+
+    def test_import_rejects_no_processes(self):
+        self.write_csv([(12345678, "Aidan", 1234, 0, 0)])
+        with pytest.raises(ValueError):
+            bulk.import_file(Bank("aib", "AIB"), "accounts.csv", processes=0)
+
+    def test_invalid_row(self):
+        self.write_csv([(12345678, "Aidan", "", 0, 0)])
+        with pytest.raises(ValueError):
+            bulk.import_file(Bank("aib", "AIB"), "accounts.csv")
+
+    def test_unknown_extension(self):
+        with pytest.raises(ValueError):
+            bulk.import_file(Bank("aib", "AIB"), "accounts.txt")
+
+
+'''Concurrent Access Testing'''
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ConcurrentAccessTests(TempDirTestCase):
+    def test_no_lost_deposits_on_one_account(self):
+        bank = Bank("aib", "AIB", cache_size=8)
+        iban = bank.create_account("Aidan", 1234)
+        with bank:
+            run_threads(8, lambda: [bank.transfer(iban, 1)
+                                    for _ in range(100)])
+        assert bank.get_account(iban).balance == 800
+
+    def test_no_lost_updates_without_held_handle(self):
+        bank = Bank("aib", "AIB", storage=SQLiteStorage("aib.db"))
+        ibans = bank.create_accounts([("User", 1234)] * 4)
+
+        def work():
+            for iban in ibans * 10:
+                bank.transfer(iban, 1)
+
+        run_threads(6, work)
+        assert [bank.get_account(iban).balance for iban in ibans] == [60] * 4
+
+    def test_atm_cash_balance_is_exact(self):
+        bank = Bank("aib", "AIB")
+        admin_iban = bank.create_admin_account("Admin", 1010)
+        atm = ATM(bank, 0)
+        admin = bank.login(admin_iban, 1010)
+        with bank:
+            run_threads(8, lambda: [atm.admin_deposit(admin, 1)
+                                    for _ in range(50)])
+        assert atm.check_balance(admin) == 400
+
+    def test_failed_withdrawal_returns_cash(self):
+        bank = Bank("aib", "AIB")
+        iban = bank.create_account("Aidan", 1234)
+        atm = ATM(bank, 100)
+        with pytest.raises(AccountError):
+            atm.user_withdraw(bank.login(iban, 1234), 50)
+        assert atm._cassette.total == 10000
+
+
+'''Asyncio Front End Testing'''
+
+class AsyncFrontEndTests(TempDirTestCase):
+    def test_many_terminals_on_one_loop(self):
+        bank = Bank("aib", "AIB", storage=SQLiteStorage("aib.db"),
+                    pin_iterations=1000)
+        ibans = bank.create_accounts([("User", 1234)] * 20)
+
+        async def terminal(atm, iban):
+            user = await atm.login(iban, 1234)
+            await atm.user_deposit(user, 10)
+            user = await atm.login(iban, 1234)
+            return await atm.user_check_balance(user)
+
+        async def run():
+            async with AsyncATM(ATM(bank, 0)) as atm:
+                return await asyncio.gather(
+                    *(terminal(atm, iban) for iban in ibans))
+
+        with bank:
+            balances = asyncio.run(run())
+        assert balances == [10] * 20
+
+    def test_errors_propagate(self):
+        bank = Bank("aib", "AIB")
+        iban = bank.create_account("Aidan", 1234)
+
+        async def run():
+            async with AsyncBank(bank) as async_bank:
+                assert async_bank.name == "AIB"
+                user = await async_bank.login(iban, 1234)
+                await async_bank.withdraw(user, 10)
+
+        with pytest.raises(AccountError):
+            asyncio.run(run())
+
+
+'''Inter-bank Transfer Testing'''
+
+class TransferTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.aib = Bank("aib", "AIB")
+        self.boi = Bank("boi", "BOI")
+        self.source = self.aib.create_account("Aidan", 1234)
+        self.target = self.boi.create_account("Mary", 1123)
+        self.aib.transfer(self.source, 100)
+        self.atm = ATM(self.aib, 500)
+        self.atm.add_connected_bank(self.boi)
+
+    def login(self):
+        return self.atm.login(self.source, 1234)
+
+    def test_transfer_moves_money_without_cash(self):
+        self.atm.user_transfer(self.login(), 40, "BOI", self.target)
+        assert self.aib.get_account(self.source).balance == 60
+        assert self.boi.get_account(self.target).balance == 40
+        assert self.atm._cassette.total == 50000
+
+    def test_bad_destination_takes_nothing(self):
+        with pytest.raises(BankError):
+            self.atm.user_transfer(self.login(), 40, "BOI", 12345678)
+        assert self.aib.get_account(self.source).balance == 100
+
+    def test_transfer_to_own_account_is_rejected(self):
+        session = self.login()
+        for destination in (self.source, str(self.source)):
+            with pytest.raises(BankError):
+                self.aib.transfer_to(session, 50, self.aib, destination)
+        assert self.aib.get_account(self.source).balance == 100
+
+    def test_insufficient_balance(self):
+        with pytest.raises(AccountError):
+            self.atm.user_transfer(self.login(), 400, "BOI", self.target)
+        assert self.boi.get_account(self.target).balance == 0
+
+    def test_unconnected_bank(self):
+        with pytest.raises(AtmError):
+            self.atm.user_transfer(self.login(), 10, "Revolut", self.target)
+
+    def test_failed_credit_is_rolled_back(self):
+        def fail(*args, **kwargs):
+            raise BankError("Storage failure")
+        self.boi._credit = fail
+        with pytest.raises(BankError):
+            self.aib.transfer_to(self.login(), 40, self.boi, self.target)
+        assert self.aib.get_account(self.source).balance == 100
+
+    def test_storage_round_trips(self):
+        user = self.login()
+        aib_before, boi_before = self.aib.stats, self.boi.stats
+        self.aib.transfer_to(user, 10, self.boi, self.target)
+        reads = (self.aib.stats["reads"] - aib_before["reads"]
+                 + self.boi.stats["reads"] - boi_before["reads"])
+        writes = (self.aib.stats["writes"] - aib_before["writes"]
+                  + self.boi.stats["writes"] - boi_before["writes"])
+        assert (reads, writes) == (2, 2)
+
+    def test_opposite_transfers_do_not_deadlock(self):
+        aib = Bank("aib", "AIB", lock_stripes=1)
+        boi = Bank("boi", "BOI", lock_stripes=1)
+        back = boi.create_account("Back", 2222)
+        other = aib.create_account("Other", 1111)
+        boi.transfer(back, 100)
+
+        def forward():
+            for _ in range(50):
+                user = aib.login(self.source, 1234)
+                aib.transfer_to(user, 1, boi, self.target)
+
+        def backward():
+            for _ in range(50):
+                user = boi.login(back, 2222)
+                boi.transfer_to(user, 1, aib, other)
+
+        threads = [threading.Thread(target=forward),
+                   threading.Thread(target=backward)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        assert not any(thread.is_alive() for thread in threads)
+        assert aib.get_account(self.source).balance == 50
+        assert boi.get_account(back).balance == 50
+
+
+'''Compact Account Encoding Testing'''
+
+class AccountEncodingTests(TempDirTestCase):
+    def make_account(self):
+        account = Account(12345678, "Siobhán", 1234, True)
+        account.deposit(1050)
+        return account
+
+    def test_round_trip(self):
+        account = self.make_account()
+        data = account.to_bytes()
+        assert Account.from_bytes(data) == account
+        assert len(data) < len(pickle.dumps(account))
+
+    def test_slots(self):
+        with pytest.raises(AttributeError):
+            self.make_account().extra = 1
+
+    def test_invalid_data(self):
+        with pytest.raises(ValueError):
+            Account.from_bytes(b"\x01abc")
+
+    def test_unpickle_pre_slots_state(self):
+        account = Account.__new__(Account)
+        account.__setstate__({"_iban": 12345678, "_name": "Aidan",
+                              "_pin": 1234, "_admin": False,
+                              "_balance": 5})
+        assert account.to_record() == (12345678, "Aidan", 1234, False, 500)
+
+    def test_store_falls_back_to_pickle(self):
+        bank = Bank("aib", "AIB")
+        iban = bank.create_account(1234, "Conor")
+        assert bank.get_account(iban).name == 1234
+
+
+'''Integer Cents Money Testing'''
+
+class MoneyTests(TempDirTestCase):
+    def test_conversion(self):
+        assert to_cents(10) == 1000
+        assert to_cents(0.1) == 10
+        assert to_cents(Decimal("12.34")) == 1234
+        assert to_cents(to_cents(5)) == 500
+
+    def test_invalid_amounts(self):
+        with pytest.raises(ValueError):
+            to_cents(0.001)
+        with pytest.raises(ValueError):
+            to_cents(float("nan"))
+        with pytest.raises(TypeError):
+            to_cents("10")
+        with pytest.raises(ValueError):
+            parse_amount(0)
+
+    def test_no_float_drift(self):
+        bank = Bank("aib", "AIB")
+        iban = bank.create_account("Aidan", 1234)
+        for _ in range(10):
+            bank.transfer(iban, 0.1)
+        user = bank.login(iban, 1234)
+        assert bank.check_balance(user) == 1.0
+        assert user.balance_cents == 100
+        bank.withdraw(user, 0.3)
+        assert bank.get_account(iban).balance_cents == 70
+
+    def test_old_encoding_balance_is_converted(self):
+        old = struct.pack("<BIidBH", 1, 12345678, 1234, 10.1, 0, 5) + b"Aidan"
+        assert Account.from_bytes(old).balance_cents == 1010
+
+
+'''Hashed PIN Testing'''
+
+class PinHashTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = Bank("aib", "AIB", pin_iterations=1000)
+        self.iban = self.bank.create_account("Aidan", 1234)
+
+    def test_pin_is_stored_hashed(self):
+        account = self.bank.get_account(self.iban)
+        record = account.to_record()
+        assert record[2] != 1234
+        assert PinHash.parse(record[2]) == account.pin_hash
+        assert account.pin_hash.iterations == 1000
+        assert account.check_pin("1234")
+        assert not account.check_pin(4321)
+        other = self.bank.get_account(self.bank.create_account("Dan", 1234))
+        assert other.pin_hash.salt != account.pin_hash.salt
+
+    def test_operations_do_not_hash(self):
+        user = self.bank.login(self.iban, 1234)
+        with mock.patch("pins._derive") as derive:
+            self.bank.deposit(user, 10)
+            user = self.bank.get_account(self.iban)
+            assert self.bank.valid_user(user)
+            assert self.bank.check_balance(user) == 10
+        derive.assert_not_called()
+
+    def test_verified_login_skips_hash(self):
+        self.bank.login(self.iban, 1234)
+        with mock.patch("pins._derive", return_value=b"") as derive:
+            assert self.bank.login(self.iban, 1234).iban == self.iban
+            derive.assert_not_called()
+            with pytest.raises(BankError):
+                self.bank.login(self.iban, 4321)
+            derive.assert_called_once()
+
+    def test_plain_pin_is_hashed_on_login(self):
+        with self.bank.storage.session() as accounts:
+            accounts.put(Account.from_record((12345678, "Old", 1234,
+                                              False, 0)))
+        assert self.bank.get_account(12345678).pin_hash is None
+        self.bank.login(12345678, 1234)
+        assert self.bank.get_account(12345678).check_pin(1234)
+        assert self.bank.get_account(12345678).pin_hash is not None
+
+    def test_cost_change_rehashes_on_login(self):
+        bank = Bank("aib", "AIB", pin_iterations=2000)
+        assert bank.login(self.iban, 1234).pin_hash.iterations == 2000
+        assert bank.get_account(self.iban).pin_hash.iterations == 2000
+
+
+'''Session Token Testing'''
+
+class SessionTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = Bank("aib", "AIB", pin_iterations=1000)
+        self.iban = self.bank.create_account("Aidan", 1234)
+        self.atm = ATM(self.bank, 500)
+
+    def test_session_survives_balance_changes(self):
+        session = self.atm.login(self.iban, 1234)
+        assert isinstance(session, Session)
+        assert session.name == "Aidan" and not session.admin
+        self.atm.user_deposit(session, 50)
+        self.atm.user_withdraw(session, 20)
+        assert self.atm.user_check_balance(session) == 30
+
+    def test_checked_without_comparing_stored_account(self):
+        session = self.atm.login(self.iban, 1234)
+        before = self.bank.stats["reads"]
+        assert self.bank.valid_user(session)
+        assert not self.bank.check_admin(session)
+        assert self.bank.stats["reads"] == before
+        self.bank.deposit(session, 10)
+        assert self.bank.stats["reads"] == before + 1
+
+    def test_forged_and_ended_sessions_are_rejected(self):
+        session = self.atm.login(self.iban, 1234)
+        forged = Session(session.token, 12345678, "Mallory", True,
+                         session.expires)
+        with pytest.raises(BankError):
+            self.bank.check_admin(forged)
+        self.atm.logout(session)
+        with pytest.raises(BankError):
+            self.atm.user_deposit(session, 10)
+
+    def test_sessions_expire_in_background(self):
+        sessions = SessionManager(ttl=0.01, reap_interval=0.01)
+        session = sessions.issue(self.iban, "Aidan", False)
+        deadline = time.monotonic() + 5
+        while len(sessions) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(sessions) == 0
+        assert not sessions.is_valid(session)
+        sessions.close()
+
+    def test_closing_bank_stops_sweep(self):
+        with self.bank:
+            session = self.bank.start_session(self.iban, 1234)
+            sweep = self.bank._sessions._reaper
+            assert sweep.is_alive()
+        assert not sweep.is_alive()
+        assert self.bank.check_balance(session) == 0
+
+    def test_sweep_survives_issue_during_stop(self):
+        sessions = SessionManager(ttl=0.01, reap_interval=0.01)
+        sessions.issue(self.iban, "Aidan", False)
+        old = sessions._reaper
+        join = old.join
+
+        def issue_then_join(*args):
+            sessions.issue(self.iban, "Aidan", False)
+            join(*args)
+
+        old.join = issue_then_join
+        sessions.stop()
+        assert not old.is_alive()
+        sweep = sessions._reaper
+        assert sweep is not None and sweep.is_alive()
+        deadline = time.monotonic() + 5
+        while len(sessions) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(sessions) == 0
+        sessions.close()
+        assert not sweep.is_alive()
+
+
+'''Journal Storage Testing'''
+
+class JournalStorageTests(TempDirTestCase):
+    def make_bank(self, **options):
+        return Bank("aib", "AIB", storage=JournalStorage("aib", **options),
+                    pin_iterations=1000)
+
+    def test_replayed_on_startup(self):
+        bank = self.make_bank()
+        iban = bank.create_account("Aidan", 1234)
+        for _ in range(5):
+            bank.transfer(iban, 10)
+        assert self.make_bank().get_account(iban).balance == 50
+
+    def test_snapshot_compacts_journal(self):
+        bank = self.make_bank(sync_every=1, snapshot_every=10)
+        iban = bank.create_account("Aidan", 1234)
+        with bank:
+            for _ in range(25):
+                bank.transfer(iban, 1)
+        assert os.path.exists("aib.snapshot")
+        assert os.path.getsize("aib.journal") < 10 * 100
+        assert self.make_bank().get_account(iban).balance == 25
+
+    def test_group_commit(self):
+        bank = self.make_bank()
+        ibans = bank.create_accounts([("User", 1234)] * 10)
+        with mock.patch("storage.os.fsync") as fsync:
+            bank.apply_batch([("deposit", iban, 1) for iban in ibans] * 5)
+        assert fsync.call_count == 1
+
+    def test_torn_entry_is_dropped(self):
+        bank = self.make_bank()
+        iban = bank.create_account("Aidan", 1234)
+        bank.transfer(iban, 10)
+        size = os.path.getsize("aib.journal")
+        with open("aib.journal", "ab") as file:
+            file.write(b"\x40\x00\x00\x00\x00\x00\x00\x00torn")
+        assert self.make_bank().get_account(iban).balance == 10
+        assert os.path.getsize("aib.journal") == size
+
+
+'''Transaction History Testing'''
+
+class HistoryTests(TempDirTestCase):
+    def make_bank(self, **options):
+        bank = Bank("aib", "AIB", pin_iterations=1000, **options)
+        iban = bank.create_account("Aidan", 1234)
+        return bank, iban
+
+    def test_operations_are_recorded(self):
+        bank, iban = self.make_bank()
+        bank.transfer(iban, 50)
+        session = bank.start_session(iban, 1234)
+        bank.deposit(session, 20)
+        bank.withdraw(session, 30)
+        bank.apply_batch([("deposit", iban, 5), ("withdraw", iban, 500)])
+        statement = bank.get_statement(iban)
+        assert [(entry.kind, entry.amount, entry.balance)
+                for entry in statement] == [
+            ("deposit", 500, 4500), ("withdraw", 3000, 4000),
+            ("deposit", 2000, 7000), ("transfer in", 5000, 5000)]
+
+    def test_limit_and_since(self):
+        bank, iban = self.make_bank()
+        for _ in range(20):
+            bank.transfer(iban, 1)
+        statement = bank.get_statement(iban, limit=5)
+        assert len(statement) == 5
+        assert statement[0].balance == 2000
+        since = statement[2].timestamp
+        assert all(entry.timestamp >= since
+                   for entry in bank.get_statement(iban, since, 20))
+        assert bank.get_statement(12345678) == []
+        with pytest.raises(ValueError):
+            bank.get_statement(iban, limit=0)
+
+    def test_default_history_is_bounded(self):
+        bank, iban = self.make_bank()
+        history = bank.history
+        assert history._retention == HISTORY_RETENTION
+        for _ in range(HISTORY_RETENTION + 10):
+            bank.transfer(iban, 1)
+        assert len(history) == HISTORY_RETENTION
+        statement = bank.get_statement(iban, limit=HISTORY_RETENTION + 10)
+        assert len(statement) == HISTORY_RETENTION
+        assert statement[-1].balance == 1100
+        with pytest.raises(ValueError):
+            MemoryHistory(0)
+
+    def test_transfers_between_banks(self):
+        bank, iban = self.make_bank()
+        other = Bank("boi", "BOI", pin_iterations=1000)
+        target = other.create_account("Mary", 1123)
+        bank.transfer(iban, 100)
+        atm = ATM(bank, 0)
+        atm.add_connected_bank(other)
+        session = atm.login(iban, 1234)
+        atm.user_transfer(session, 40, "BOI", target)
+        assert atm.user_statement(session, limit=1)[0].kind == \
+            "transfer out"
+        assert other.get_statement(target)[0][2:] == ("transfer in",
+                                                      4000, 4000)
+
+    def test_sqlite_history_uses_index(self):
+        history = SQLiteHistory("history.db")
+        bank, iban = self.make_bank(history=history)
+        bank.transfer(iban, 10)
+        bank.transfer(iban, 15)
+        assert [entry.balance for entry in bank.get_statement(iban)] == \
+            [2500, 1000]
+        plan = history._connection.execute(
+            "EXPLAIN QUERY PLAN " + history._STATEMENT,
+            (iban, 0, 10)).fetchall()
+        assert "transactions_by_account" in str(plan)
+        history.close()
+
+
+'''Load Generator Testing'''
+
+class LoadGeneratorTests(TempDirTestCase):
+    def config(self, **changes):
+        config = loadgen.LoadConfig(
+            operations=300, processes=1, banks=2, atms=2, accounts=10,
+            mix=dict(loadgen.DEFAULT_MIX), storage="sqlite",
+            pin_iterations=1000, seed="test")
+        return config._replace(**changes)
+
+    def test_every_operation_is_measured(self):
+        result = loadgen.run_load(self.config())
+        summaries = result["operations"]
+        assert set(summaries) == set(loadgen.OPERATIONS)
+        assert sum(summary["count"] for summary in summaries.values()) == 300
+        for summary in summaries.values():
+            assert 0 < summary["p50_ms"] <= summary["p95_ms"] \
+                <= summary["p99_ms"]
+
+    def test_percentiles(self):
+        ordered = list(range(1, 101))
+        assert loadgen._percentile(ordered, 50) == 50
+        assert loadgen._percentile(ordered, 99) == 99
+        assert loadgen._percentile([7], 95) == 7
+
+    def test_invalid_config(self):
+        with pytest.raises(ValueError):
+            loadgen.run_load(self.config(mix={"refund": 1}))
+        with pytest.raises(ValueError):
+            loadgen.run_load(self.config(banks=1, mix={"transfer": 1}))
+
+
+'''Metrics Testing'''
+
+class MetricsTests(TempDirTestCase):
+    def test_disabled_by_default(self):
+        bank = Bank("aib", "AIB")
+        atm = ATM(bank)
+        assert "withdraw" not in vars(bank)
+        assert "user_withdraw" not in vars(atm)
+
+    def test_calls_errors_and_storage_are_counted(self):
+        metrics = Metrics()
+        bank = Bank("aib", "AIB", pin_iterations=1000, metrics=metrics)
+        atm = ATM(bank, 100, metrics=metrics)
+        iban = bank.create_account("Aidan", 1234)
+        session = atm.login(iban, 1234)
+        atm.user_deposit(session, 10)
+        with pytest.raises(AccountError):
+            atm.user_withdraw(session, 50)
+        assert metrics.histogram("bank_call_seconds", bank="AIB",
+                                 method="deposit").count == 1
+        assert metrics.counter("atm_errors_total", bank="AIB",
+                               method="user_withdraw") == 1
+        assert metrics.counter("bank_storage_writes_total", bank="AIB") == \
+            bank.stats["writes"]
+        assert metrics.counter("bank_storage_bytes_written_total",
+                               bank="AIB") > 0
+
+    def test_prometheus_text(self):
+        metrics = Metrics(buckets=(0.5, 1))
+        metrics.increment("requests_total", 2, path='say "hi"')
+        metrics.observe("latency_seconds", 0.75)
+        text = metrics.to_prometheus()
+        assert "# TYPE requests_total counter\n" in text
+        assert 'requests_total{path="say \\"hi\\""} 2\n' in text
+        assert 'latency_seconds_bucket{le="0.5"} 0\n' in text
+        assert 'latency_seconds_bucket{le="1"} 1\n' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 1\n' in text
+        assert "latency_seconds_count 1\n" in text
+
+
+
+'''Cash Cassette Testing'''
+
+class CassetteTests(TempDirTestCase):
+    def test_dispenses_when_greedy_would_fail(self):
+        cassette = Cassette({5000: 1, 2000: 3})
+        assert cassette.dispense(6000) == {2000: 3}
+        assert cassette.counts() == {5000: 1, 2000: 0, 1000: 0, 500: 0}
+
+    def test_rejects_huge_amount_without_building_tables(self):
+        cassette = Cassette.from_amount(100000)
+        atm = ATM(Bank("aib", "AIB", pin_iterations=1000),
+                  cassette=cassette)
+        with mock.patch.object(Cassette, "_build_tables") as build:
+            assert not cassette.can_dispense(10 ** 14)
+            with pytest.raises(AtmError):
+                cassette.dispense(10 ** 14)
+            with pytest.raises(AtmError):
+                atm.user_withdraw(mock.Mock(spec=Account), 10 ** 12)
+            build.assert_not_called()
+        assert cassette.total == 100000
+
+    def test_rejects_unreachable_amounts(self):
+        cassette = Cassette({5000: 2, 2000: 1})
+        assert not cassette.can_dispense(3000)
+        assert not cassette.can_dispense(1250)
+        with pytest.raises(AtmError):
+            cassette.dispense(3000)
+        with pytest.raises(AtmError):
+            cassette.dispense(20000)
+        assert cassette.total == 12000
+
+    def test_amounts_above_cache_limit(self):
+        cassette = Cassette({5000: 30, 2000: 1}, cache_limit=10000)
+        assert cassette.dispense(152000) == {5000: 30, 2000: 1}
+
+    def test_forecast(self):
+        cassette = Cassette({5000: 10, 2000: 100}, rate_window=60)
+        cassette.dispense(5000)
+        forecast = cassette.forecast()
+        assert 500 < forecast[5000] < 600
+        assert forecast[2000] == float("inf")
+        assert forecast[1000] == 0.0
+        assert set(cassette.forecast(horizon=600)) == {5000, 1000, 500}
+
+    def test_atm_keeps_deposits_it_cannot_pay_out(self):
+        bank = Bank("aib", "AIB", pin_iterations=1000)
+        admin = bank.login(bank.create_admin_account("Admin", 1010), 1010)
+        atm = ATM(bank, 0)
+        atm.admin_deposit(admin, 27.5)
+        assert atm.cash_inventory(admin) == {5000: 0, 2000: 1, 1000: 0,
+                                             500: 1}
+        assert atm.check_balance(admin) == 27.5
+        with pytest.raises(AtmError):
+            atm.admin_withdraw(admin, 27.5)
+        assert atm.admin_withdraw(admin, 25) == {2000: 1, 500: 1}
+
+    def test_admin_deposit_notes_must_match(self):
+        bank = Bank("aib", "AIB", pin_iterations=1000)
+        admin = bank.login(bank.create_admin_account("Admin", 1010), 1010)
+        atm = ATM(bank, 0)
+        with pytest.raises(ValueError):
+            atm.admin_deposit(admin, 100, {5000: 1})
+        atm.admin_deposit(admin, 100, {1000: 10})
+        assert atm.cash_inventory(admin)[1000] == 10
+
+
+
+'''Sharded Storage Testing'''
+
+class ShardedStorageTests(TempDirTestCase):
+    def test_accounts_are_routed_by_range(self):
+        bank = Bank("aib", "AIB", pin_iterations=1000, shards=4)
+        ibans = bank.create_accounts([("User", 1234)] * 40)
+        bank.transfer(ibans[0], 25)
+        storage = bank.storage
+        assert len(storage.shards) == 4
+        for iban in ibans:
+            with storage.shards[storage.shard_of(iban)] as shard:
+                assert shard.get(iban) is not None
+        assert sorted(storage.ibans()) == sorted(ibans)
+        assert bank.get_account(ibans[0]).balance == 25
+        reopened = Bank("aib", "AIB", pin_iterations=1000)
+        assert ibans[0] not in reopened
+        reopened = Bank("aib", "AIB", pin_iterations=1000, shards=2)
+        assert len(reopened.storage.shards) == 4
+        assert reopened.get_account(ibans[0]).balance == 25
+
+    def test_split_moves_upper_half(self):
+        storage = ShardedStorage.at("aib", shards=1)
+        bank = Bank("aib", "AIB", pin_iterations=1000, storage=storage)
+        ibans = bank.create_accounts([("User", 1234)] * 20)
+        with bank:
+            assert storage.split(0) == 10
+            bank.transfer(ibans[-1], 5)
+        with storage:
+            assert [len(shard.ibans()) for shard in storage.shards] == \
+                [10, 10]
+        reopened = ShardedStorage.at("aib")
+        assert reopened.bounds == storage.bounds
+        assert sorted(reopened.ibans()) == sorted(ibans)
+        assert Bank("aib", "AIB", storage=reopened).get_account(
+            ibans[-1]).balance == 5
+
+    def test_split_needs_a_shard_inside_its_range(self):
+        storage = ShardedStorage([DbmStorage("low"), DbmStorage("high")],
+                                 [50000000])
+        with pytest.raises(ValueError):
+            storage.split(0)
+        with pytest.raises(ValueError):
+            storage.split(0, 60000000, DbmStorage("extra"))
+        assert storage.split(1, 70000000, DbmStorage("extra")) == 0
+        assert storage.bounds == (50000000, 70000000)
+
+    def test_journal_delete_survives_replay(self):
+        storage = JournalStorage("aib")
+        with storage:
+            storage.put(Account(12345678, "Aidan", 1234, iterations=1000))
+            storage.delete(12345678)
+        with JournalStorage("aib") as reopened:
+            assert reopened.ibans() == []
+
+
+
+'''Read Replica Testing'''
+
+class ReplicaTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = Bank("aib", "AIB", pin_iterations=1000)
+        self.iban = self.bank.create_account("Aidan", 1234)
+        self.bank.transfer(self.iban, 40)
+
+    def test_replica_answers_reads_and_refuses_writes(self):
+        publish_snapshot(self.bank.storage, "aib.replica")
+        replica = Bank("aib", "AIB", storage=ReplicaStorage("aib.replica"),
+                       pin_iterations=1000)
+        assert replica.read_only
+        assert self.iban in replica
+        session = replica.start_session(self.iban, 1234)
+        assert replica.check_balance(session) == 40
+        assert replica.get_account(self.iban).balance == 40
+        with pytest.raises(BankError):
+            replica.deposit(session, 10)
+        assert self.bank.get_account(self.iban).balance == 40
+        with pytest.raises(ValueError):
+            Bank("aib", "AIB", storage=ReplicaStorage("aib.replica"),
+                 cache_size=10)
+
+    def test_staleness_bound(self):
+        now = time.time()
+        with mock.patch("replica.time", return_value=now - 9):
+            publish_snapshot(self.bank.storage, "aib.replica")
+        storage = ReplicaStorage("aib.replica", max_staleness=10)
+        replica = Bank("aib", "AIB", storage=storage)
+        assert replica.get_account(self.iban).balance == 40
+        self.bank.transfer(self.iban, 5)
+        publish_snapshot(self.bank.storage, "aib.replica")
+        assert replica.get_account(self.iban).balance == 40
+        with mock.patch("replica.time", return_value=now + 2):
+            assert replica.get_account(self.iban).balance == 45
+        with mock.patch("replica.time", return_value=now + 11):
+            with pytest.raises(BankError):
+                replica.get_account(self.iban)
+        assert storage.stats["reloads"] == 2
+
+    def test_publisher(self):
+        with SnapshotPublisher(self.bank.storage, "aib.replica",
+                               interval=0.01) as publisher:
+            self.bank.transfer(self.iban, 2)
+            while publisher.published < 3:
+                time.sleep(0.01)
+        replica = Bank("aib", "AIB", storage=ReplicaStorage("aib.replica"))
+        assert replica.get_account(self.iban).balance == 42
+
+
+
+'''Memory-Mapped Storage Testing'''
+
+class MmapStorageTests(TempDirTestCase):
+    def test_bank_on_mmap_storage(self):
+        storage = MmapStorage("aib", capacity=2)
+        bank = Bank("aib", "AIB", storage=storage, pin_iterations=1000)
+        ibans = bank.create_accounts([("User", 1234)] * 50)
+        bank.transfer(ibans[7], 12.5)
+        session = bank.start_session(ibans[7], 1234)
+        assert bank.check_balance(session) == 12.5
+        assert storage.balance_of(ibans[7]) == 1250
+        assert storage.balance_of(12345678) is None
+        assert "Fake_ACCOUNT" not in bank
+        with storage:
+            assert sorted(storage.ibans()) == sorted(ibans)
+
+    def test_delete_and_rebuilt_index(self):
+        storage = MmapStorage("aib")
+        with storage:
+            for iban in range(10000000, 10000100):
+                storage.put(Account.from_record(
+                    (iban, "User", 1234, False, iban)))
+            for iban in range(10000000, 10000100, 3):
+                storage.delete(iban)
+        os.remove("aib.index")
+        with MmapStorage("aib") as reopened:
+            for iban in range(10000000, 10000100):
+                account = reopened.get(iban)
+                if iban % 3 == 1:
+                    assert account is None
+                else:
+                    assert account.balance_cents == iban
+                    assert account.check_pin(1234)
+
+    def test_read_only_sees_writes(self):
+        writer = MmapStorage("aib", capacity=2)
+        writer.open()
+        writer.put(Account(12345678, "Aidan", 1234, iterations=1000))
+        with MmapStorage("aib", read_only=True) as reader:
+            for iban in range(10000000, 10000010):
+                writer.put(Account.from_record((iban, "User", 1234, False,
+                                                5)))
+            assert reader.get(10000009).balance_cents == 5
+            with pytest.raises(BankError):
+                reader.put(Account.from_record((10000000, "User", 1234,
+                                                False, 0)))
+        writer.close()
+
+    def test_names_must_fit(self):
+        with MmapStorage("aib") as storage:
+            with pytest.raises(ValueError):
+                storage.put(Account.from_record((12345678, "x" * 65, 1234,
+                                                 False, 0)))
+
+
+
+'''Reporting Testing'''
+
+class ReportTests(TempDirTestCase):
+    def make_bank(self, storage):
+        bank = Bank("aib", "AIB", storage=storage, pin_iterations=1000)
+        ibans = bank.create_accounts([("User", 1234)] * 30 +
+                                     [("Admin", 1010, True)] * 2)
+        with bank:
+            for index, iban in enumerate(ibans):
+                if index % 4:
+                    bank.transfer(iban, index * 10)
+        return bank, ibans
+
+    def test_report_on_each_backend(self):
+        for storage in (DbmStorage("aib"), SQLiteStorage("aib.db"),
+                        MmapStorage("aib"), ShardedStorage.at("aib", 3)):
+            bank, ibans = self.make_bank(storage)
+            report = bank.report(top=3, bounds=(0, 10000), chunk_size=7)
+            assert report.accounts == 32
+            assert report.admins == 2
+            assert report.total == sum(index * 1000 for index in range(32)
+                                       if index % 4)
+            assert report.smallest == 0 and report.largest == 31000
+            assert report.counts == [8, 8, 16]
+            assert report.top == [(ibans[31], 31000), (ibans[30], 30000),
+                                  (ibans[29], 29000)]
+            for path in os.listdir():
+                os.remove(path)
+
+    @unittest.skipIf(reports.numpy is None, "NumPy is not installed")
+    def test_vectorised_matches_plain(self):
+        bank, _ = self.make_bank(DbmStorage("aib"))
+        with bank:
+            columns = list(bank.storage.columns(5))
+        assert reports.summarise(columns, 4, vectorised=True) == \
+            reports.summarise(columns, 4, vectorised=False)
+
+    def test_empty_bank(self):
+        report = Bank("aib", "AIB").report()
+        assert report.accounts == 0 and report.smallest is None
+        assert report.top == []
+
+
+class RemoteBankTests(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.aib = Bank("aib", "AIB", pin_iterations=1000)
+        self.boi = Bank("boi", "BOI", pin_iterations=1000)
+        self.user = self.aib.create_account("Aidan", 1234)
+        self.admin = self.aib.create_admin_account("Admin", 1010)
+        self.payee = self.boi.create_account("Mary", 1123)
+
+    def test_atm_over_tcp(self):
+        with BankServer([self.aib, self.boi]) as server, \
+                RemoteBank(server.address) as aib, \
+                RemoteBank(server.address, "BOI") as boi:
+            atm = ATM(aib, 100)
+            assert atm.add_connected_bank(boi)
+            session = atm.login(self.user, 1234)
+            atm.user_deposit(session, 50)
+            assert atm.user_withdraw(session, 20) == {2000: 1}
+            atm.user_transfer(session, 10, "BOI", self.payee)
+            assert atm.user_check_balance(session) == 20
+            assert self.boi.get_account(self.payee).balance == 10
+            assert [entry.kind for entry in atm.user_statement(session)] == \
+                ["transfer out", "withdraw", "deposit"]
+            with pytest.raises(AccountError):
+                atm.user_withdraw(session, 50)
+            assert atm._cassette.total == 13000
+            with pytest.raises(BankError):
+                atm.login(self.user, 9999)
+            assert atm.check_balance(atm.login(self.admin, 1010)) == 130
+            with pytest.raises(ValueError):
+                RemoteBank(server.address, "Revolut")
+
+    def test_local_and_remote_banks_do_not_mix(self):
+        with BankServer(self.boi) as server, \
+                RemoteBank(server.address) as boi:
+            atm = ATM(self.aib, 100)
+            with pytest.raises(TypeError):
+                atm.add_connected_bank(boi)
+            with pytest.raises(BankError):
+                self.aib.transfer_to(self.aib.start_session(self.user, 1234),
+                                     10, boi, self.payee)
+            with RemoteBank(server.address) as remote:
+                with pytest.raises(TypeError):
+                    ATM(remote, 100).add_connected_bank(self.aib)
+        assert self.boi.get_account(self.payee).balance == 0
+
+    def test_pipelined_calls_over_unix_socket(self):
+        path = os.path.join(os.getcwd(), "bank.sock")
+        with BankServer(self.aib, path) as server, \
+                RemoteBank(server.address, pool_size=2) as aib:
+            session = aib.start_session(self.user, 1234)
+            futures = [aib.submit("deposit", session, to_cents(1))
+                       for _ in range(50)]
+            for future in futures:
+                future.result()
+            assert aib.check_balance(session) == 50
+            assert self.aib.get_account(self.user).balance == 50
+        assert not os.path.exists(path)
+
+    def test_only_sessions_are_accepted(self):
+        victim = self.aib.get_account(self.user)
+        with BankServer(self.aib) as server, \
+                RemoteBank(server.address) as aib:
+            for method in ("login", "get_account"):
+                with pytest.raises(ValueError):
+                    aib.submit(method, self.user)
+            with pytest.raises(TypeError):
+                aib.withdraw(victim, 10)
+            for user in (self.user, None, "token"):
+                with pytest.raises(BankError):
+                    aib.check_balance(user)
+            with pytest.raises(ValueError):
+                aib.submit("transfer", self.user, 1000000)
+            with pytest.raises(BankError):
+                aib.get_statement(self.user)
+            self.aib.transfer(self.user, 5)
+            mallory = self.aib.create_account("Mallory", 4321)
+            session = aib.start_session(mallory, 4321)
+            forged = Session(session.token, self.user, "Mallory", False,
+                             session.expires)
+            with pytest.raises(BankError):
+                aib.get_statement(forged)
+            assert aib.get_statement(session) == []
+        assert self.aib.get_account(self.user).balance == 5
+
+    def test_oversized_frame_closes_connection(self):
+        with BankServer(self.aib) as server:
+            client = socket.create_connection(server.address)
+            with client:
+                client.sendall(struct.pack("<IIBB", 1 << 31, 1, 0, 0))
+                assert client.recv(1) == b""
+            with RemoteBank(server.address) as aib:
+                session = aib.start_session(self.user, 1234)
+                with pytest.raises(ValueError):
+                    aib.submit("withdraw", session, "x" * (1 << 17))
+
+    def test_calls_fail_once_server_stops(self):
+        server = BankServer(self.aib)
+        server.start()
+        aib = RemoteBank(server.address)
+        session = aib.start_session(self.user, 1234)
+        server.stop()
+        with pytest.raises(BankError):
+            aib.check_balance(session)
+        aib.close()
+
+
+class CoalescedReadTests(TempDirTestCase):
+    def test_concurrent_lookups_share_one_read(self):
+        bank = Bank("aib", "AIB", pin_iterations=1000)
+        iban = bank.create_account("Aidan", 1234)
+        reads = bank.stats["reads"]
+        get = DbmStorage._get
+        first_read = threading.Event()
+
+        def slow_get(storage, key):
+            first_read.set()
+            time.sleep(0.2)
+            return get(storage, key)
+
+        results = []
+        with mock.patch.object(DbmStorage, "_get", slow_get):
+            leader = threading.Thread(
+                target=lambda: results.append(bank.get_account(iban)))
+            leader.start()
+            first_read.wait()
+            followers = [threading.Thread(
+                target=lambda: results.append(bank.get_account(iban)))
+                for _ in range(7)]
+            for thread in followers:
+                thread.start()
+            for thread in [leader] + followers:
+                thread.join()
+        assert bank.stats["reads"] - reads == 1
+        assert len({id(account) for account in results}) == 8
+        assert all(account == results[0] for account in results)
+        assert bank.coalescing_stats["coalesced"] == 7
+        assert bank.coalescing_stats["fraction"] == 7 / 8
+
+    def test_lookup_after_change_reads_again(self):
+        bank = Bank("aib", "AIB", pin_iterations=1000)
+        iban = bank.create_account("Aidan", 1234)
+        session = bank.start_session(iban, 1234)
+        assert bank.check_balance(session) == 0
+        bank.deposit(session, 5)
+        assert bank.check_balance(session) == 5
+        assert Bank("boi", "BOI", coalesce_reads=False).coalescing_stats == {}
+
+    def test_error_reaches_every_caller(self):
+        flights = SingleFlight()
+        future, leader = flights.join("key")
+        follower, following = flights.join("key")
+        assert leader and not following and follower is future
+        flights.land("key", future, error=BankError("Read failed"))
+        with pytest.raises(BankError):
+            follower.result()
+        assert len(flights) == 0
+        assert flights.join("key")[1]
+
 
 if __name__ == '__main__':
     unittest.main()